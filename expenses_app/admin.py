@@ -4,7 +4,9 @@ from django.contrib import admin
 from .models import User, Expense, ExpenseSplit
 
 from django.contrib import admin
-from .models import User, Expense, ExpenseSplit
+from .models import (
+    User, Expense, ExpenseSplit, Group, GroupBalance, GroupMembership,
+    PairwiseBalance, UserBalance)
 
 
 @admin.register(User)
@@ -23,3 +25,29 @@ class ExpenseAdmin(admin.ModelAdmin):
 @admin.register(ExpenseSplit)
 class ExpenseSplitAdmin(admin.ModelAdmin):
     list_display = ('expense', 'user', 'amount', 'percentage')
+
+
+@admin.register(PairwiseBalance)
+class PairwiseBalanceAdmin(admin.ModelAdmin):
+    list_display = ('user_low', 'user_high', 'amount')
+
+
+@admin.register(UserBalance)
+class UserBalanceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'net')
+
+
+@admin.register(Group)
+class GroupAdmin(admin.ModelAdmin):
+    list_display = ('name', 'created_by', 'created_at')
+    search_fields = ('name',)
+
+
+@admin.register(GroupMembership)
+class GroupMembershipAdmin(admin.ModelAdmin):
+    list_display = ('group', 'user', 'joined_at')
+
+
+@admin.register(GroupBalance)
+class GroupBalanceAdmin(admin.ModelAdmin):
+    list_display = ('group', 'user', 'net')
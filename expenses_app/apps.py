@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class ExpensesAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "expenses_app"
+
+    def ready(self):
+        from .authentication import invalidate_cached_user
+        from .metrics import install_query_recorder
+        connection_created.connect(install_query_recorder)
+        post_save.connect(invalidate_cached_user, sender=get_user_model())
+        post_delete.connect(invalidate_cached_user, sender=get_user_model())
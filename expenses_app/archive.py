@@ -0,0 +1,153 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import versions
+from .models import (
+    ArchivedExpense, ArchivedExpenseSplit, ArchivedExpenseSummary, Expense,
+    ExpenseSplit)
+
+# Old expenses are moved out of the hot Expense / ExpenseSplit tables into
+# ArchivedExpense / ArchivedExpenseSplit in batches, one transaction each.
+# Nothing is recorded about progress: whatever is still in the hot tables
+# and older than the horizon is what is left to do, so an interrupted run
+# just picks up where it stopped. The ledger tables are left alone (the
+# debts still stand), and what each user paid is compacted into
+# ArchivedExpenseSummary rows for balance sheet totals.
+
+
+def default_horizon():
+    return timezone.localdate() - timedelta(days=settings.EXPENSE_ARCHIVE_AFTER_DAYS)
+
+
+def pending(before):
+    return Expense.objects.filter(date__lt=before)
+
+
+def archive_batch(before, batch_size):
+    # Archives up to batch_size of the oldest expenses dated before
+    # ``before``; returns how many were moved.
+    with transaction.atomic():
+        expenses = list(pending(before).select_for_update()
+                        .order_by('date', 'id')[:batch_size])
+        if not expenses:
+            return 0
+        ids = [expense.id for expense in expenses]
+        splits = list(ExpenseSplit.objects.filter(expense_id__in=ids).order_by('id'))
+
+        ArchivedExpense.objects.bulk_create([
+            ArchivedExpense(
+                id=expense.id, payer_id=expense.payer_id, group_id=expense.group_id,
+                total_amount=expense.total_amount, split_method=expense.split_method,
+                description=expense.description, date=expense.date)
+            for expense in expenses
+        ], batch_size=1000)
+        ArchivedExpenseSplit.objects.bulk_create([
+            ArchivedExpenseSplit(
+                id=split.id, expense_id=split.expense_id, user_id=split.user_id,
+                amount=split.amount, percentage=split.percentage)
+            for split in splits
+        ], batch_size=1000)
+        update_summaries(summary_deltas(
+            (expense.payer_id, expense.date.replace(day=1), expense.split_method,
+             expense.total_amount, 1)
+            for expense in expenses))
+
+        ExpenseSplit.objects.filter(expense_id__in=ids).delete()
+        Expense.objects.filter(id__in=ids).delete()
+        # Hot expense lists and cached pages change; totals do not.
+        versions.bump_users(
+            {expense.payer_id for expense in expenses} | {split.user_id for split in splits},
+            {expense.group_id for expense in expenses if expense.group_id},
+            any(expense.group_id is None for expense in expenses))
+    return len(expenses)
+
+
+def summary_deltas(rows):
+    # (user, month, split method) -> [total, expense count]
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for user_id, month, method, total, count in rows:
+        delta = deltas[(user_id, month, method)]
+        delta[0] += total
+        delta[1] += count
+    return deltas
+
+
+def update_summaries(deltas):
+    ArchivedExpenseSummary.objects.bulk_create(
+        [ArchivedExpenseSummary(user_id=user_id, month=month, split_method=method)
+         for user_id, month, method in deltas],
+        ignore_conflicts=True)
+    rows = (ArchivedExpenseSummary.objects.select_for_update()
+            .filter(user_id__in={user_id for user_id, _, _ in deltas},
+                    month__in={month for _, month, _ in deltas})
+            .order_by('pk'))
+    changed = []
+    for row in rows:
+        delta = deltas.get((row.user_id, row.month, row.split_method))
+        if delta:
+            row.total += delta[0]
+            row.expense_count += delta[1]
+            changed.append(row)
+    ArchivedExpenseSummary.objects.bulk_update(
+        changed, ['total', 'expense_count'], batch_size=500)
+
+
+def compute_summaries():
+    # Derive the summaries from the archive tables, for rebuild_balances.
+    rows = (ArchivedExpense.objects.order_by()
+            .annotate(month=TruncMonth('date'))
+            .values_list('payer', 'month', 'split_method')
+            .annotate(total=Sum('total_amount'), count=Count('id')))
+    return {key: delta for key, delta in summary_deltas(rows).items() if any(delta)}
+
+
+def user_summary_rows(user_id):
+    return (ArchivedExpenseSummary.objects.filter(user_id=user_id)
+            .exclude(expense_count=0)
+            .values_list('month', 'split_method', 'total', 'expense_count'))
+
+
+def add_archived(summary, rows, by_month=False):
+    # Adds a user's archived summary rows to the live totals of
+    # ExpenseQuerySet.summary(), and to its ``by_month`` list if requested.
+    months = {}
+    if by_month:
+        months = {row['month']: dict(row) for row in summary['by_month']}
+    for month, method, total, count in rows:
+        summary['total_expenses'] += total
+        summary['expense_count'] += count
+        summary['by_split_method'][method]['total'] += total
+        summary['by_split_method'][method]['count'] += count
+        if by_month:
+            bucket = months.setdefault(
+                month, {'month': month, 'total': Decimal('0'), 'count': 0})
+            bucket['total'] += total
+            bucket['count'] += count
+    if by_month:
+        summary['by_month'] = [months[month] for month in sorted(months)]
+    return summary
+
+
+def payer_summary(user_id, by_month=False):
+    # Balance sheet totals of everything the user paid, archived or not.
+    user_expenses = Expense.objects.filter(payer_id=user_id)
+    summary = user_expenses.summary()
+    if by_month:
+        summary['by_month'] = list(user_expenses.monthly_totals())
+    return add_archived(summary, user_summary_rows(user_id), by_month)
+
+
+async def apayer_summary(user_id, by_month=False):
+    user_expenses = Expense.objects.filter(payer_id=user_id)
+    summary = await user_expenses.asummary()
+    if by_month:
+        summary['by_month'] = [row async for row in user_expenses.monthly_totals()]
+    rows = [row async for row in user_summary_rows(user_id)]
+    return add_archived(summary, rows, by_month)
@@ -0,0 +1,196 @@
+import functools
+import time
+
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework import exceptions, status
+
+from . import archive, changes, conditional, payloads, routers, versions
+from .authentication import CachedJWTAuthentication
+from .models import Expense
+from .pagination import ExpenseKeysetPagination
+from .renderers import FastJSONRenderer
+from .serializers import (
+    BalanceSheetQuerySerializer, BalanceSummarySerializer, ChangeFeedQuerySerializer,
+    sparse_fields)
+
+# Native async versions of the read-heavy ExpenseViewSet actions. DRF views
+# are synchronous, so under ASGI every request to them holds a worker thread
+# for its whole lifetime; these use the async ORM instead and only hop to a
+# thread for the queries themselves. Responses are byte-for-byte what the
+# DRF actions return.
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    return HttpResponse(FastJSONRenderer().render(data), status=status_code,
+                        content_type='application/json', headers=headers)
+
+
+def error_response(exc, headers=None):
+    # Same body shape as rest_framework.views.exception_handler.
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(detail, exc.status_code, headers)
+
+
+def async_api_view(view):
+    # GET-only, JWT authenticated async view. Reads go to the replica like
+    # those of the sync actions (see ReplicaReadsMixin); the async ORM runs
+    # each query in a copy of this context, so it sees the routing.
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return error_response(exceptions.MethodNotAllowed(request.method),
+                                  headers={'Allow': 'GET'})
+
+        authenticator = CachedJWTAuthentication()
+        challenge = {'WWW-Authenticate': authenticator.authenticate_header(request)}
+        try:
+            credentials = await authenticator.aauthenticate(request)
+        except exceptions.AuthenticationFailed as exc:
+            return error_response(exc, headers=challenge)
+        if credentials is None:
+            return error_response(exceptions.NotAuthenticated(), headers=challenge)
+        request.user, request.auth = credentials
+
+        token = routers.route_reads(await routers.aread_alias_for(request.user))
+        try:
+            return await view(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return error_response(exc)
+        finally:
+            routers.reset_reads(token)
+    return wrapper
+
+
+async def versioned_response(request, action, scope, build):
+    # Async counterpart of ExpenseViewSet.versioned_response; the two share
+    # ETags and cached payloads. ``build`` is a coroutine function.
+    state = await versions.ascope_state(scope)
+    if state[1] is None:
+        return json_response(await build())
+    key = conditional.payload_key(action, scope, state, request.GET)
+    etag, last_modified = conditional.validators(key, state[1], 'application/json')
+    response = conditional.not_modified(request, etag)
+    if response is None:
+        payload_cache = conditional.get_payload_cache()
+        data = payload_cache.get(key)
+        if data is None:
+            data = await build()
+            payload_cache.set(key, data)
+        response = json_response(data)
+    return conditional.add_validators(response, etag, last_modified)
+
+
+async def expense_page(request, queryset, fields):
+    # Async counterpart of ExpenseListMixin.expense_page.
+    paginator = ExpenseKeysetPagination()
+    rows = await paginator.apaginate_queryset(payloads.expense_rows(queryset), request)
+    return paginator.get_paginated_data(await payloads.aexpense_payloads(rows, fields))
+
+
+@async_api_view
+async def user_expenses(request):
+    fields = sparse_fields(request.GET)
+    return await versioned_response(
+        request, 'user_expenses', versions.user_scope(request.user.pk),
+        lambda: expense_page(request, Expense.objects.filter(payer=request.user), fields))
+
+
+@async_api_view
+async def overall_expenses(request):
+    fields = sparse_fields(request.GET)
+    return await versioned_response(
+        request, 'overall_expenses', versions.GLOBAL_SCOPE,
+        lambda: expense_page(request, Expense.objects.filter(group__isnull=True), fields))
+
+
+@async_api_view
+async def balance_sheet(request):
+    params = BalanceSheetQuerySerializer(data=request.GET)
+    params.is_valid(raise_exception=True)
+    user_expenses = Expense.objects.filter(payer=request.user)
+
+    async def build():
+        summary = await archive.apayer_summary(
+            request.user.pk, by_month=params.validated_data.get('group_by') == 'month')
+
+        balance_data = {}
+        if not params.validated_data['summary_only']:
+            rows = [row async for row in payloads.expense_rows(user_expenses)]
+            balance_data["user_expenses"] = await payloads.aexpense_payloads(rows)
+        balance_data.update(BalanceSummarySerializer(summary).data)
+        return balance_data
+
+    return await versioned_response(
+        request, 'balance_sheet', versions.user_scope(request.user.pk), build)
+
+
+async def change_feed_params(request, hub, cursor=None):
+    # The validated (cursor, timeout) of a change feed request; the cursor
+    # is None when the client has none yet. Queries go through the hub, so
+    # a waiting request does not keep a thread and connection of its own.
+    params = ChangeFeedQuerySerializer(data=request.GET)
+    params.is_valid(raise_exception=True)
+    cursor = params.validated_data.get('cursor', cursor)
+    if cursor is not None:
+        await hub.run(changes.check_cursor, cursor)
+    return cursor, params.validated_data.get('timeout')
+
+
+@async_api_view
+async def expense_changes(request):
+    # Long-poll: returns the user's changes after ``cursor`` as soon as there
+    # are any, or an empty list after ``timeout`` seconds. Clients send the
+    # returned cursor with the next request; the first request, without
+    # one, just returns the current cursor.
+    hub = changes.get_hub()
+    cursor, timeout = await change_feed_params(request, hub)
+    if cursor is None:
+        return json_response({'cursor': await hub.head(), 'changes': []})
+    limit = changes.feed_settings()['LONG_POLL_TIMEOUT']
+    timeout = limit if timeout is None else min(timeout, limit)
+    rows, cursor = await hub.next_changes(request.user.pk, cursor, timeout)
+    return json_response({'cursor': cursor, 'changes': rows})
+
+
+def sse_event(change, cursor):
+    data = FastJSONRenderer().render(change).decode()
+    return f"id: {cursor}\nevent: change\ndata: {data}\n\n"
+
+
+@async_api_view
+async def expense_change_stream(request):
+    # Server-sent events: one ``change`` event per change, with the cursor
+    # to resume from as the event id so EventSource resumes from
+    # Last-Event-ID after a reconnect. Needs an ASGI server; under WSGI
+    # every open stream holds a worker.
+    hub = changes.get_hub()
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    cursor, _ = await change_feed_params(
+        request, hub, int(last_event_id) if last_event_id.isdigit() else None)
+    if cursor is None:
+        cursor = await hub.head()
+    options = changes.feed_settings()
+    user_id = request.user.pk
+
+    async def events():
+        yield 'retry: 3000\n\n'
+        # One subscription for the whole stream: changes are handed to it
+        # as they are read, with no queries of its own in between.
+        subscription = hub.subscribe(user_id, cursor)
+        resume_from = cursor
+        try:
+            deadline = time.monotonic() + options['STREAM_SECONDS']
+            while (remaining := deadline - time.monotonic()) > 0:
+                rows = await subscription.get(min(options['HEARTBEAT'], remaining))
+                if not rows:
+                    # Keeps proxies from closing an idle connection.
+                    yield ': keepalive\n\n'
+                for change in rows:
+                    resume_from = hub.resume_cursor(resume_from, change['id'])
+                    yield sse_event(change, resume_from)
+        finally:
+            hub.unsubscribe(subscription)
+
+    return StreamingHttpResponse(
+        events(), content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,178 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+
+class UserCache:
+    # Bounded in-process LRU cache of users with a TTL, optionally backed by
+    # a shared Django cache so other processes on the host can reuse lookups.
+
+    def __init__(self, max_size=10000, ttl=60, shared_cache=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_cache = shared_cache
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.shared_hits = self.evictions = 0
+
+    @classmethod
+    def from_settings(cls):
+        options = settings.JWT_USER_CACHE
+        alias = options.get('SHARED_CACHE')
+        return cls(max_size=options.get('MAX_SIZE', 10000),
+                   ttl=options.get('TTL', 60),
+                   shared_cache=caches[alias] if alias else None)
+
+    def shared_key(self, user_id):
+        return f"expenses_app:jwt-user:{user_id}"
+
+    def get(self, user_id):
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user
+                del self._entries[key]
+
+        if self.shared_cache is not None:
+            user = self.shared_cache.get(self.shared_key(key))
+            if user is not None:
+                self._store(key, user, now)
+                with self._lock:
+                    self.shared_hits += 1
+                return user
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, user_id, user):
+        key = str(user_id)
+        self._store(key, user, time.monotonic())
+        if self.shared_cache is not None:
+            self.shared_cache.set(self.shared_key(key), user, self.ttl)
+
+    def _store(self, key, user, now):
+        with self._lock:
+            self._entries[key] = (user, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared_cache is not None:
+            self.shared_cache.delete(self.shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.shared_hits = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    global _user_cache
+    with _user_cache_lock:
+        if _user_cache is None:
+            _user_cache = UserCache.from_settings()
+        return _user_cache
+
+
+def invalidate_cached_user(sender, instance, **kwargs):
+    # post_save/post_delete receiver for the user model (see apps.py), so
+    # every save drops the cached user, wherever it happens. Dropped again
+    # on commit in case a request cached the old row in the meantime.
+    # QuerySet.update() sends no signals; such changes show after the TTL.
+    user_cache, user_id = get_user_cache(), instance.pk
+    user_cache.invalidate(user_id)
+    transaction.on_commit(lambda: user_cache.invalidate(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # JWTAuthentication that resolves the token's user through UserCache
+    # instead of loading the row on every request. Each request gets its
+    # own copy, so changes to request.user do not leak into other requests.
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        user_cache = get_user_cache()
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, copy.copy(user))
+            return user
+        return copy.copy(self.check_cached_user(user, validated_token))
+
+    async def aauthenticate(self, request):
+        # authenticate() for async views. Token validation is CPU only, and
+        # the database is only reached on a user cache miss.
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return await sync_to_async(super().get_user)(validated_token)
+
+        user_cache = get_user_cache()
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await sync_to_async(super().get_user)(validated_token)
+            user_cache.set(user_id, copy.copy(user))
+            return user
+        return copy.copy(self.check_cached_user(user, validated_token))
+
+    def check_cached_user(self, user, validated_token):
+        # Same checks JWTAuthentication applies to a freshly loaded user.
+        if getattr(api_settings, 'CHECK_USER_IS_ACTIVE', True) and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if getattr(api_settings, 'CHECK_REVOKE_TOKEN', False):
+            from rest_framework_simplejwt.utils import get_md5_hash_password
+            if validated_token.get(
+                    api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed")
+        return user
@@ -0,0 +1,165 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.template.loader import render_to_string
+from django.utils.crypto import salted_hmac
+from xhtml2pdf import pisa
+
+from . import archive
+from .models import Expense
+from .versions import user_version
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Job state lives on disk next to the cached PDFs, so every worker process
+# sees it: ``<job>.pending`` while a job is queued (its content becomes
+# ``running`` once a worker picks it up) and ``<job>.failed`` after a
+# failure. A finished job is just its PDF.
+
+_executor = None
+_lock = threading.RLock()
+
+
+class RenderError(Exception):
+    pass
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BALANCE_SHEET_WORKERS,
+                thread_name_prefix='balance-sheet')
+        return _executor
+
+
+def job_id(user_id, version):
+    # Content address of a user's balance sheet: changes with every write
+    # that touches the user, and cannot be guessed without SECRET_KEY.
+    return salted_hmac('expenses_app.balance_sheet', f"{user_id}:{version}",
+                       algorithm='sha256').hexdigest()
+
+
+def cache_path(user_id, key):
+    return Path(settings.BALANCE_SHEET_CACHE_DIR) / str(user_id) / f"{key}.pdf"
+
+
+def marker_path(user_id, key, state):
+    return cache_path(user_id, key).with_suffix(f'.{state}')
+
+
+def submit(user_id):
+    # Returns (job id, status). A cached sheet for the current data version
+    # is reused; otherwise rendering is queued on the worker pool, or done
+    # inline when BALANCE_SHEET_WORKERS is 0.
+    key = job_id(user_id, user_version(user_id))
+    if cache_path(user_id, key).exists():
+        return key, DONE
+    if claim(user_id, key):
+        if not settings.BALANCE_SHEET_WORKERS:
+            try:
+                execute(user_id, key)
+            except RenderError:
+                pass
+        else:
+            get_executor().submit(run_job, user_id, key)
+    return key, job_status(user_id, key)
+
+
+def claim(user_id, key):
+    # Creates the job's pending marker. False if a request, in this process
+    # or another, already queued it and the job is not older than
+    # BALANCE_SHEET_JOB_TIMEOUT (its worker may have died). Failed jobs are
+    # retried.
+    marker = marker_path(user_id, key, PENDING)
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker_path(user_id, key, FAILED).unlink(missing_ok=True)
+    try:
+        marker.touch(exist_ok=False)
+        return True
+    except FileExistsError:
+        pass
+    try:
+        age = time.time() - marker.stat().st_mtime
+    except FileNotFoundError:
+        # Finished in the meantime.
+        return False
+    if age < settings.BALANCE_SHEET_JOB_TIMEOUT:
+        return False
+    marker.write_text('')
+    return True
+
+
+def job_status(user_id, key):
+    try:
+        return marker_path(user_id, key, PENDING).read_text() or PENDING
+    except FileNotFoundError:
+        pass
+    if cache_path(user_id, key).exists():
+        return DONE
+    if marker_path(user_id, key, FAILED).exists():
+        return FAILED
+    return None
+
+
+def execute(user_id, key):
+    pending = marker_path(user_id, key, PENDING)
+    try:
+        pending.write_text(RUNNING)
+        render(user_id, key)
+    except Exception as exc:
+        marker_path(user_id, key, FAILED).write_text(str(exc))
+        raise
+    finally:
+        pending.unlink(missing_ok=True)
+
+
+def run_job(user_id, key):
+    try:
+        execute(user_id, key)
+    finally:
+        # Worker threads hold their own connections; don't leak them.
+        connections.close_all()
+
+
+def render(user_id, key):
+    user_expenses = Expense.objects.filter(payer_id=user_id)
+    context = {
+        'user_expenses': user_expenses,
+        'total_expenses': archive.payer_summary(user_id)['total_expenses']
+    }
+    html_content = render_to_string('balance_sheet.html', context)
+    pdf = BytesIO()
+    pisa_status = pisa.CreatePDF(html_content, dest=pdf)
+    if pisa_status.err:
+        raise RenderError(f"xhtml2pdf reported {pisa_status.err} errors.")
+
+    path = cache_path(user_id, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(pdf.getvalue())
+    os.replace(tmp_path, path)
+
+    # Only the newest sheet per user is worth keeping. Sheets written after
+    # this one are left alone: they are for a later version, or another
+    # request is about to serve them.
+    written = path.stat().st_mtime_ns
+    for stale in [*path.parent.glob('*.pdf'), *path.parent.glob('*.failed')]:
+        try:
+            if stale != path and stale.stat().st_mtime_ns < written:
+                stale.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+    return path
@@ -0,0 +1,97 @@
+import contextlib
+import math
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import django
+from django.db import connection
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_databases,
+    setup_test_environment, teardown_databases, teardown_test_environment)
+
+
+def percentile(samples, fraction):
+    # Nearest-rank percentile of an already sorted list.
+    if not samples:
+        return None
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+
+@contextlib.contextmanager
+def benchmark_database():
+    # A throwaway test database on the configured backend, with balance
+    # sheets rendered inline into a temporary directory.
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(
+                BALANCE_SHEET_WORKERS=0, BALANCE_SHEET_CACHE_DIR=cache_dir):
+            yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+    }
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def measure(name, run, iterations, warmup=1, expected_status=None):
+    # ``run`` prepares and sends one request; it returns a callable that
+    # performs the timed part so set-up work stays out of the numbers.
+    for _ in range(warmup):
+        run()()
+
+    latencies, query_counts, errors = [], [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        send = run()
+        with CaptureQueriesContext(connection) as queries:
+            request_started = time.perf_counter()
+            response = send()
+            latencies.append(time.perf_counter() - request_started)
+        query_counts.append(len(queries))
+        if expected_status and response.status_code not in expected_status:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    # Memory is traced in a separate request: tracemalloc would distort the
+    # latencies above.
+    send = run()
+    tracemalloc.start()
+    try:
+        send()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'action': name,
+        'requests': iterations,
+        'errors': errors,
+        'throughput_rps': round(iterations / sum(latencies), 2) if latencies else None,
+        'wall_seconds': round(elapsed, 4),
+        'latency_ms': latency_summary(latencies),
+        'queries': {
+            'mean': round(sum(query_counts) / len(query_counts), 2),
+            'max': max(query_counts),
+        },
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
@@ -0,0 +1,344 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import exceptions, status
+
+from .models import DataVersion, ExpenseChange
+
+logger = logging.getLogger(__name__)
+
+# Change feed: every expense write appends ExpenseChange rows (one per
+# affected user) through ledger.apply_changes, and clients follow their own
+# rows by id instead of re-fetching whole lists. Waiting subscribers share
+# one ChangeHub per event loop. The hub reads the log for all of them on a
+# thread and database connection of its own and hands each subscriber its
+# rows: a subscriber's only query is the one reading its backlog when it
+# subscribes, and an idle one holds no thread or connection.
+
+# DataVersion scope whose version is the highest purged change id; cursors
+# below it have lost changes.
+PURGED_SCOPE = 'change-log-purged'
+
+
+def feed_settings():
+    return {'POLL_INTERVAL': 1.0, 'HEARTBEAT': 15, 'LONG_POLL_TIMEOUT': 25,
+            'STREAM_SECONDS': 300, 'PAGE_SIZE': 500, 'GAP_SECONDS': 30,
+            'RETENTION_DAYS': 7,
+            **getattr(settings, 'CHANGE_FEED', {})}
+
+
+class CursorExpired(exceptions.APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = ('Changes after this cursor have been purged. Reload the data and '
+                      'continue from the current cursor.')
+    default_code = 'cursor_expired'
+
+
+class ChangeSet:
+    # Collects the changes of one ledger.apply_changes call.
+
+    def __init__(self, splits_only=False):
+        self.splits_only = splits_only
+        # expense id -> [group id, affected user ids, signs seen]
+        self.expenses = {}
+
+    def add(self, expense, splits, sign):
+        change = self.expenses.setdefault(expense.pk, [None, set(), set()])
+        change[0] = expense.group_id
+        change[1].add(expense.payer_id)
+        change[1].update(split.user_id for split in splits)
+        change[2].add(sign)
+
+    def action(self, signs):
+        if self.splits_only or len(signs) == 2:
+            return ExpenseChange.UPDATED
+        return ExpenseChange.CREATED if 1 in signs else ExpenseChange.DELETED
+
+    def save(self):
+        ExpenseChange.objects.bulk_create([
+            ExpenseChange(user_id=user_id, expense_id=expense_id, group_id=group_id,
+                          action=self.action(signs))
+            for expense_id, (group_id, user_ids, signs) in self.expenses.items()
+            for user_id in sorted(user_ids)
+        ], batch_size=1000)
+
+
+CHANGE_FIELDS = ('id', 'user_id', 'expense_id', 'group_id', 'action', 'created_at')
+
+
+def user_changes(user_id, after, upto, limit):
+    return list(ExpenseChange.objects.filter(user_id=user_id, id__gt=after, id__lte=upto)
+                .order_by('id').values_list(*CHANGE_FIELDS)[:limit])
+
+
+def new_changes(after, gaps, limit):
+    # Changes after ``after``, and any of the ``gaps`` ids below it that
+    # were committed since.
+    condition = Q(id__gt=after)
+    if gaps:
+        condition |= Q(id__in=gaps)
+    return list(ExpenseChange.objects.filter(condition)
+                .order_by('id').values_list(*CHANGE_FIELDS)[:limit])
+
+
+def payload(row):
+    change_id, _, expense_id, group_id, action, created_at = row
+    return {'id': change_id, 'expense': expense_id, 'group': group_id,
+            'action': action, 'at': created_at}
+
+
+def purged():
+    # The highest purged change id, 0 if nothing was purged yet.
+    return DataVersion.objects.filter(scope=PURGED_SCOPE).values_list(
+        'version', flat=True).first() or 0
+
+
+def open_gaps(gap_seconds, window):
+    # The newest change id (the purge watermark if the log is empty), and
+    # the missing ids below it that may still be committed: those whose
+    # next change was created less than ``gap_seconds`` ago, mapped to the
+    # seconds they stay open. Only the newest ``window`` changes are read.
+    rows = list(ExpenseChange.objects.order_by('-id').values_list('id', 'created_at')[:window])
+    if not rows:
+        return purged(), {}
+    now = timezone.now()
+    gaps = {}
+    for (change_id, created_at), (previous_id, _) in zip(rows, rows[1:]):
+        remaining = gap_seconds - (now - created_at).total_seconds()
+        if remaining > 0:
+            gaps.update(dict.fromkeys(
+                range(max(previous_id, change_id - window) + 1, change_id), remaining))
+    return rows[0][0], gaps
+
+
+def head(gap_seconds, window):
+    # The current cursor: the newest change id, or the id before the oldest
+    # change that may still be committed, so no change is skipped.
+    last_id, gaps = open_gaps(gap_seconds, window)
+    return min(gaps) - 1 if gaps else last_id
+
+
+def check_cursor(cursor):
+    if cursor < purged():
+        raise CursorExpired()
+
+
+def purge(before, batch_size=10000):
+    # Deletes changes created before ``before``, oldest first, and records
+    # the highest purged id so older cursors are refused. Returns how many
+    # rows were removed.
+    deleted = 0
+    while True:
+        ids = list(ExpenseChange.objects.filter(created_at__lt=before)
+                   .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        DataVersion.objects.bulk_create([DataVersion(scope=PURGED_SCOPE)],
+                                        ignore_conflicts=True)
+        DataVersion.objects.filter(scope=PURGED_SCOPE, version__lt=ids[-1]).update(
+            version=ids[-1])
+        deleted += ExpenseChange.objects.filter(id__in=ids).delete()[0]
+
+
+def run_queries(func, *args):
+    try:
+        return func(*args)
+    except DatabaseError:
+        # Reconnect on the next call.
+        connection.close()
+        raise
+
+
+class Subscription:
+    # One waiting client. Rows are handed over by the hub; ``cursor`` is
+    # where its backlog is read from until ``backlog`` is done.
+
+    def __init__(self, user_id, cursor):
+        self.user_id = user_id
+        self.floor = self.cursor = cursor
+        self.backlog = True
+        # Backlog rows the hub still counts as gaps, not to hand over twice.
+        self.seen = set()
+        self.rows = []
+        self.ready = asyncio.Event()
+        self.event = asyncio.Event()
+
+    def deliver(self, rows):
+        rows = [row for row in rows if row[0] > self.floor and row[0] not in self.seen]
+        if rows:
+            self.rows.extend(rows)
+            self.event.set()
+
+    async def get(self, timeout):
+        # The changes handed over so far, waiting up to ``timeout`` seconds
+        # for some once the backlog has been read; an empty list on timeout.
+        deadline = time.monotonic() + timeout
+        await self.ready.wait()
+        remaining = deadline - time.monotonic()
+        if not self.rows and remaining > 0:
+            try:
+                await asyncio.wait_for(self.event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        rows, self.rows = sorted(self.rows), []
+        self.event.clear()
+        return [payload(row) for row in rows]
+
+
+class ChangeHub:
+    # Reads the change log for the subscribers of one event loop. While
+    # anyone is subscribed, a single task reads new rows every
+    # POLL_INTERVAL seconds and hands them to the subscribers of the users
+    # they belong to; new subscribers get their backlog first. Ids that are
+    # skipped (rows not committed yet, or rolled back) are looked for again
+    # for GAP_SECONDS, so rows committed out of id order are not lost.
+
+    max_gaps = 1000
+
+    def __init__(self, poll_interval, page_size, gap_seconds=30, batch_size=10000):
+        self.poll_interval = poll_interval
+        self.page_size = page_size
+        self.gap_seconds = gap_seconds
+        self.batch_size = batch_size
+        # All of the hub's queries run here, on one connection, whatever
+        # request started the poller.
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='expense-changes')
+        self.subscribers = defaultdict(set)
+        self.last_id = None
+        # missing id -> time.monotonic() deadline
+        self.gaps = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(run_queries, func, *args))
+
+    def subscribe(self, user_id, cursor):
+        subscription = Subscription(user_id, cursor)
+        self.subscribers[user_id].add(subscription)
+        self.wakeup.set()
+        if self.task is None:
+            # Started in an empty context so it does not carry the request
+            # that happened to start it (its thread, its read routing).
+            self.task = asyncio.get_running_loop().create_task(
+                self.poll(), context=contextvars.Context())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self.subscribers[subscription.user_id]
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self.subscribers[subscription.user_id]
+
+    async def head(self):
+        return await self.run(head, self.gap_seconds, self.max_gaps)
+
+    def resume_cursor(self, cursor, change_id):
+        # The cursor to hand a client that had ``cursor`` and has now been
+        # given changes up to ``change_id``. It stays below the oldest gap,
+        # so a client resuming from it still gets that change if it commits;
+        # changes above the gap may then be delivered again.
+        now = time.monotonic()
+        gaps = [gap for gap, deadline in self.gaps.items() if deadline > now]
+        if gaps:
+            change_id = min(change_id, min(gaps) - 1)
+        return max(cursor, change_id)
+
+    async def next_changes(self, user_id, cursor, timeout):
+        # The changes after ``cursor`` (see Subscription.get) and the cursor
+        # to continue from.
+        subscription = self.subscribe(user_id, cursor)
+        try:
+            rows = await subscription.get(timeout)
+            return rows, self.resume_cursor(cursor, rows[-1]['id']) if rows else cursor
+        finally:
+            self.unsubscribe(subscription)
+
+    async def poll(self):
+        try:
+            while self.subscribers:
+                self.wakeup.clear()
+                try:
+                    more = await self.read()
+                except Exception:
+                    logger.exception('Reading the expense change log failed')
+                    more = False
+                if not more:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            # Start again from the newest change next time, and do not hold
+            # a connection while nobody is subscribed.
+            self.task = self.last_id = None
+            self.gaps.clear()
+            self.executor.submit(connection.close)
+
+    async def read(self):
+        # One round of reads; True if there is more to read right away.
+        if self.last_id is None:
+            # Gaps left by earlier writes are looked for as well.
+            self.last_id, gaps = await self.run(open_gaps, self.gap_seconds, self.max_gaps)
+            now = time.monotonic()
+            self.gaps = {change_id: now + remaining for change_id, remaining in gaps.items()}
+        more = False
+        for subscription in [subscription for subscriptions in list(self.subscribers.values())
+                             for subscription in subscriptions if subscription.backlog]:
+            rows = []
+            if subscription.cursor < self.last_id:
+                rows = await self.run(user_changes, subscription.user_id,
+                                      subscription.cursor, self.last_id, self.page_size)
+            subscription.seen.update(row[0] for row in rows if row[0] in self.gaps)
+            if len(rows) == self.page_size:
+                subscription.cursor = rows[-1][0]
+                more = True
+            else:
+                subscription.backlog = False
+            subscription.deliver(rows)
+            subscription.ready.set()
+
+        now = time.monotonic()
+        self.gaps = {change_id: deadline for change_id, deadline in self.gaps.items()
+                     if deadline > now}
+        rows = await self.run(new_changes, self.last_id, list(self.gaps), self.batch_size)
+        by_user = defaultdict(list)
+        for row in rows:
+            if row[0] > self.last_id:
+                missing = range(self.last_id + 1, row[0])
+                if len(self.gaps) + len(missing) <= self.max_gaps:
+                    self.gaps.update(dict.fromkeys(missing, now + self.gap_seconds))
+                self.last_id = row[0]
+            else:
+                self.gaps.pop(row[0], None)
+            by_user[row[1]].append(row)
+        for user_id, user_rows in by_user.items():
+            for subscription in self.subscribers.get(user_id, ()):
+                # Subscribers still reading their backlog get these from it.
+                if not subscription.backlog:
+                    subscription.deliver(user_rows)
+        return more or len(rows) == self.batch_size
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_hub():
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        options = feed_settings()
+        hub = _hubs[loop] = ChangeHub(
+            options['POLL_INTERVAL'], options['PAGE_SIZE'], options['GAP_SECONDS'])
+    return hub
@@ -0,0 +1,98 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+class PayloadCache:
+    # Bounded in-process LRU of serialized response data. Keys include the
+    # data version the payload was built from, so a write never has to
+    # invalidate anything: entries for old versions just age out.
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set(self, key, data):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_payload_cache = None
+_payload_cache_lock = threading.Lock()
+
+
+def get_payload_cache():
+    global _payload_cache
+    with _payload_cache_lock:
+        if _payload_cache is None:
+            _payload_cache = PayloadCache(
+                settings.EXPENSE_PAYLOAD_CACHE.get('MAX_ENTRIES', 256))
+        return _payload_cache
+
+
+def payload_key(action, scope, state, query_params):
+    # ``state`` is the scope's (version, updated_at). The timestamp keeps keys
+    # unique even if versions restart, e.g. after restoring a backup.
+    params = tuple(sorted((name, tuple(values)) for name, values in query_params.lists()))
+    return (action, scope, *state, params)
+
+
+def validators(key, updated_at, media_type):
+    # Strong ETag over the payload key and representation, plus the time the
+    # scope last changed as Last-Modified (informational; see not_modified).
+    digest = hashlib.sha256(repr((key, media_type)).encode()).hexdigest()[:32]
+    return f'"{digest}"', int(updated_at.timestamp())
+
+
+def not_modified(request, etag):
+    # A 304 (or 412) response when the request's preconditions say the
+    # client's copy is current, otherwise None. ``request`` is a Django
+    # HttpRequest. Only the ETag is compared: Last-Modified has one second
+    # resolution, so If-Modified-Since would miss a second write in the
+    # same second.
+    return get_conditional_response(request, etag=etag)
+
+
+def add_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep the payload but must revalidate before reusing it.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,43 @@
+import csv
+
+CSV_EXPORT_COLUMNS = ['id', 'payer', 'total_amount', 'split_method',
+                      'description', 'date', 'splits']
+
+
+class Echo:
+    # csv.writer only needs write(); hand each formatted row straight back.
+    def write(self, value):
+        return value
+
+
+def format_csv_splits(expense):
+    # Inverse of importers.parse_csv_splits, so exports can be re-imported.
+    if expense.split_method == 'equal':
+        return ';'.join(str(split.user_id) for split in expense.splits.all())
+    share_field = 'percentage' if expense.split_method == 'percentage' else 'amount'
+    return ';'.join(f"{split.user_id}:{getattr(split, share_field)}"
+                    for split in expense.splits.all())
+
+
+def csv_value(expense, column):
+    if column == 'payer':
+        return expense.payer_id
+    if column == 'splits':
+        return format_csv_splits(expense)
+    return getattr(expense, column)
+
+
+def stream_csv(queryset, columns, chunk_size=2000):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    if 'splits' in columns:
+        queryset = queryset.prefetch_related('splits')
+    rows = []
+    for expense in queryset.iterator(chunk_size=chunk_size):
+        rows.append(writer.writerow(
+            [csv_value(expense, column) for column in columns]))
+        if len(rows) >= chunk_size:
+            yield ''.join(rows)
+            rows = []
+    if rows:
+        yield ''.join(rows)
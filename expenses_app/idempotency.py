@@ -0,0 +1,59 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(request):
+    # Read before DRF parses the body; Django keeps it for the parser.
+    return hashlib.sha256(request.body).digest()
+
+
+def claim(user, key, digest):
+    # Must run inside the transaction that performs the request and then
+    # stores its response. Returns (record, True) when this request owns the
+    # key and should run, or (record, False) with the stored record of an
+    # earlier request to replay. A concurrent duplicate blocks on the unique
+    # (user, key) index until the first request commits and then replays
+    # it, or takes over the key if it rolled back.
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=digest, expires_at=expires_at), True
+    except IntegrityError:
+        pass
+    record = IdempotencyKey.objects.select_for_update().get(user=user, key=key)
+    if record.expires_at <= now:
+        # Expired but not purged yet: start over as a new key.
+        record.fingerprint = digest
+        record.status_code = record.response = None
+        record.expires_at = expires_at
+        record.save()
+        return record, True
+    return record, False
+
+
+def store(record, response):
+    record.status_code = response.status_code
+    record.response = response.data
+    record.save(update_fields=['status_code', 'response'])
+
+
+def purge_expired(batch_size=10000):
+    # Deletes expired keys in batches; returns how many were removed.
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+                   .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
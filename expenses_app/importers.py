@@ -0,0 +1,276 @@
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import BaseUserManager
+from django.db import IntegrityError, transaction
+
+from . import ledger
+from .models import User, Expense, ExpenseSplit, Group, GroupMembership
+from .serializers import BulkUserSerializer, ExpenseSerializer
+from .splits import plan_expenses
+
+CSV_COLUMNS = ['payer', 'total_amount', 'split_method',
+               'description', 'date', 'splits']
+
+
+class RowError(Exception):
+    pass
+
+
+def decode_lines(fileobj):
+    # (line number, text) for each line of an uploaded file, or a RowError
+    # for a line that is not valid UTF-8. UTF-8 never uses newline bytes
+    # inside a character, so lines can be decoded one at a time.
+    for line_number, line in enumerate(fileobj, 1):
+        try:
+            yield line_number, line.decode('utf-8-sig' if line_number == 1 else 'utf-8')
+        except UnicodeDecodeError as e:
+            yield line_number, RowError(f"Invalid UTF-8 at byte {e.start}: {e.reason}.")
+
+
+def read_jsonl(fileobj):
+    for row_number, line in decode_lines(fileobj):
+        if isinstance(line, RowError):
+            yield row_number, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, RowError(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(row, dict):
+            yield row_number, RowError("Each line must be a JSON object.")
+            continue
+        yield row_number, row
+
+
+def csv_lines(lines):
+    for _, line in lines:
+        if isinstance(line, RowError):
+            raise line
+        yield line
+
+
+def read_csv(fileobj):
+    # A CSV row can span lines, so reading stops at the first line that
+    # cannot be decoded or parsed; the rows before it are still imported.
+    reader = csv.DictReader(csv_lines(decode_lines(fileobj)))
+    try:
+        missing = set(CSV_COLUMNS) - set(reader.fieldnames or [])
+        if missing:
+            yield 1, RowError(
+                f"Missing CSV columns: {', '.join(sorted(missing))}.")
+            return
+        for row in reader:
+            row['splits'] = parse_csv_splits(row['splits'], row['split_method'])
+            yield reader.line_num, row
+    except RowError as e:
+        yield reader.line_num + 1, RowError(f"{e} The rest of the file was not read.")
+    except csv.Error as e:
+        yield reader.line_num, RowError(f"Invalid CSV: {e}. The rest of the file was not read.")
+
+
+def parse_csv_splits(value, split_method):
+    # "1;2;3" for equal splits, "1:799.00;2:2000.00" for exact amounts and
+    # "1:50;2:50" for percentages.
+    share_field = 'percentage' if split_method == 'percentage' else 'amount'
+    splits = []
+    for entry in (value or '').split(';'):
+        if not entry.strip():
+            continue
+        user, _, share = entry.partition(':')
+        split = {'user': user.strip()}
+        if share.strip():
+            split[share_field] = share.strip()
+        splits.append(split)
+    return splits
+
+
+def referenced_user_ids(rows):
+    user_ids = set()
+    for _, row in rows:
+        if isinstance(row, RowError):
+            continue
+        candidates = [row.get('payer')]
+        splits = row.get('splits')
+        if isinstance(splits, list):
+            candidates.extend(split.get('user')
+                              for split in splits if isinstance(split, dict))
+        for candidate in candidates:
+            try:
+                user_ids.add(int(candidate))
+            except (TypeError, ValueError):
+                pass
+    return user_ids
+
+
+def referenced_group_ids(rows):
+    group_ids = set()
+    for _, row in rows:
+        if isinstance(row, RowError):
+            continue
+        try:
+            group_ids.add(int(row.get('group')))
+        except (TypeError, ValueError):
+            pass
+    return group_ids
+
+
+def group_members(group_ids):
+    members = {group_id: set() for group_id in group_ids}
+    for group_id, user_id in GroupMembership.objects.filter(
+            group_id__in=group_ids).values_list('group', 'user'):
+        members[group_id].add(user_id)
+    return members
+
+
+def import_chunk(rows, user=None):
+    users = User.objects.in_bulk(referenced_user_ids(rows))
+    group_ids = referenced_group_ids(rows)
+    context = {
+        'users': users,
+        'groups': Group.objects.in_bulk(group_ids),
+        'group_members': group_members(group_ids),
+        'user': user,
+        'plan_splits': False,
+    }
+    valid, errors = [], []
+    for row_number, row in rows:
+        if isinstance(row, RowError):
+            errors.append({'row': row_number, 'errors': [str(row)]})
+            continue
+        serializer = ExpenseSerializer(data=row, context=context)
+        if serializer.is_valid():
+            valid.append((row_number, serializer.validated_data))
+        else:
+            errors.append({'row': row_number, 'errors': serializer.errors})
+
+    # Split rules and amounts for the whole chunk in one vectorized pass.
+    planned = plan_expenses(
+        (data['split_method'], data['total_amount'], data['splits'])
+        for _, data in valid)
+    ready = []
+    for (row_number, data), (splits_data, error) in zip(valid, planned):
+        if error:
+            errors.append({'row': row_number, 'errors': {'non_field_errors': [error]}})
+        else:
+            ready.append((data, splits_data))
+    errors.sort(key=lambda error: error['row'])
+
+    if ready:
+        with transaction.atomic():
+            expenses = Expense.objects.bulk_create([
+                Expense(**{key: value for key, value in data.items()
+                           if key != 'splits'})
+                for data, _ in ready
+            ])
+            entries = [
+                (expense, [ExpenseSplit(expense=expense, **split_data)
+                           for split_data in splits_data])
+                for expense, (_, splits_data) in zip(expenses, ready)
+            ]
+            ExpenseSplit.objects.bulk_create(
+                [split for _, splits in entries for split in splits],
+                batch_size=settings.EXPENSE_SPLIT_BATCH_SIZE)
+            ledger.record_expenses(entries)
+
+    return len(ready), errors
+
+
+def import_expenses(rows, batch_size=None, user=None):
+    # ``user`` is the importing user; rows for a group they are not a member
+    # of are rejected.
+    batch_size = batch_size or settings.EXPENSE_IMPORT_BATCH_SIZE
+    rows = iter(rows)
+    created, errors = 0, []
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        chunk_created, chunk_errors = import_chunk(chunk, user)
+        created += chunk_created
+        errors.extend(chunk_errors)
+    return {'created': created, 'failed': len(errors), 'errors': errors}
+
+
+def import_users(records, batch_size=None):
+    batch_size = batch_size or settings.USER_BULK_BATCH_SIZE
+    errors = {}
+    valid = []
+    for index, record in enumerate(records):
+        serializer = BulkUserSerializer(data=record)
+        if not serializer.is_valid():
+            errors[index] = serializer.errors
+            continue
+        data = dict(serializer.validated_data)
+        data['email'] = BaseUserManager.normalize_email(data['email'])
+        valid.append((index, data))
+
+    valid = unique_users(valid, errors)
+
+    # PBKDF2 releases the GIL, so hashing scales across threads.
+    with ThreadPoolExecutor(max_workers=settings.USER_BULK_HASH_WORKERS) as pool:
+        passwords = pool.map(make_password,
+                             [data.pop('password', None) for _, data in valid])
+        users = [(index, User(password=password, **data))
+                 for (index, data), password in zip(valid, passwords)]
+
+    created = []
+    for offset in range(0, len(users), batch_size):
+        batch = users[offset:offset + batch_size]
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create([user for _, user in batch])
+        except IntegrityError:
+            # Lost a race with another writer; retry one by one so only the
+            # conflicting records fail.
+            for index, user in batch:
+                try:
+                    with transaction.atomic():
+                        user.save(force_insert=True)
+                except IntegrityError:
+                    user.pk = None
+                    errors[index] = {
+                        'non_field_errors': ["A user with this email or mobile number already exists."]}
+        created.extend((index, user) for index, user in batch if user.pk)
+
+    return {
+        'created': len(created),
+        'failed': len(errors),
+        'users': [{'index': index, 'id': user.pk, 'email': user.email}
+                  for index, user in created],
+        'errors': [{'index': index, 'errors': errors[index]}
+                   for index in sorted(errors)],
+    }
+
+
+def unique_users(valid, errors):
+    # One query per unique field for the whole batch, plus duplicates
+    # within the batch itself (the first occurrence wins).
+    messages = {
+        'email': "A user with this email already exists.",
+        'mobile_number': "A user with this mobile number already exists.",
+    }
+    taken = {
+        field: set(User.objects.filter(
+            **{f'{field}__in': [data[field] for _, data in valid]}
+        ).values_list(field, flat=True))
+        for field in messages
+    }
+    unique = []
+    for index, data in valid:
+        record_errors = {field: [message] for field, message in messages.items()
+                         if data[field] in taken[field]}
+        if record_errors:
+            errors[index] = record_errors
+            continue
+        for field in messages:
+            taken[field].add(data[field])
+        unique.append((index, data))
+    return unique
@@ -0,0 +1,211 @@
+import itertools
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import F, Sum
+
+from . import changes, rollups, versions
+from .models import (
+    ArchivedExpense, ArchivedExpenseSplit, Expense, ExpenseSplit, GroupBalance, PairwiseBalance,
+    UserBalance)
+
+
+def record_expenses(entries):
+    apply_changes([], entries)
+
+
+def reverse_expenses(entries):
+    apply_changes(entries, [])
+
+
+def apply_changes(removed, added, splits_only=False):
+    # ``removed`` and ``added`` are iterables of (expense, splits). Must run
+    # inside the transaction that writes the expenses so the ledger never
+    # drifts. Every expense write goes through here, so it also maintains
+    # the group ledgers and spending rollups, bumps the data version of
+    # everyone involved and appends to their change feed.
+    # With ``splits_only`` the expenses themselves are unchanged and only
+    # the given splits are added or removed.
+    pair_deltas = defaultdict(Decimal)
+    net_deltas = defaultdict(Decimal)
+    group_deltas = defaultdict(Decimal)
+    rollup_deltas = rollups.new_deltas()
+    touched, touched_groups = set(), set()
+    outside_groups = False
+    change_set = changes.ChangeSet(splits_only)
+    for entries, sign in ((removed, -1), (added, 1)):
+        for expense, splits in entries:
+            change_set.add(expense, splits, sign)
+            touched.add(expense.payer_id)
+            if expense.group_id:
+                touched_groups.add(expense.group_id)
+            else:
+                outside_groups = True
+            for split in splits:
+                touched.add(split.user_id)
+                amount = sign * (split.amount or 0)
+                add_debt(pair_deltas, net_deltas, split.user_id,
+                         expense.payer_id, amount)
+                if expense.group_id:
+                    add_group_debt(group_deltas, expense.group_id, split.user_id,
+                                   expense.payer_id, amount)
+            rollups.add_expense(rollup_deltas, expense, splits, sign,
+                                include_payment=not splits_only)
+    update_pairs(pair_deltas)
+    update_nets(net_deltas)
+    update_group_nets(group_deltas)
+    rollups.update_rollups(rollup_deltas)
+    versions.bump_users(touched, touched_groups, outside_groups)
+    change_set.save()
+
+
+def add_debt(pair_deltas, net_deltas, debtor_id, creditor_id, amount):
+    if debtor_id == creditor_id or not amount:
+        return
+    net_deltas[creditor_id] += amount
+    net_deltas[debtor_id] -= amount
+    if debtor_id < creditor_id:
+        pair_deltas[(debtor_id, creditor_id)] += amount
+    else:
+        pair_deltas[(creditor_id, debtor_id)] -= amount
+
+
+def add_group_debt(group_deltas, group_id, debtor_id, creditor_id, amount):
+    if debtor_id == creditor_id or not amount:
+        return
+    group_deltas[(group_id, creditor_id)] += amount
+    group_deltas[(group_id, debtor_id)] -= amount
+
+
+def update_pairs(deltas):
+    deltas = {pair: delta for pair, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    # Create missing rows first so every pair can be locked and updated in
+    # place, even when concurrent transactions touch the same pair.
+    PairwiseBalance.objects.bulk_create(
+        [PairwiseBalance(user_low_id=low, user_high_id=high)
+         for low, high in deltas],
+        ignore_conflicts=True)
+    user_ids = {user_id for pair in deltas for user_id in pair}
+    rows = (PairwiseBalance.objects.select_for_update()
+            .filter(user_low_id__in=user_ids, user_high_id__in=user_ids)
+            .order_by('pk'))
+    changed = []
+    for row in rows:
+        delta = deltas.get((row.user_low_id, row.user_high_id))
+        if delta:
+            row.amount += delta
+            changed.append(row)
+    PairwiseBalance.objects.bulk_update(changed, ['amount'], batch_size=500)
+
+
+def update_nets(deltas):
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    UserBalance.objects.bulk_create(
+        [UserBalance(user_id=user_id) for user_id in deltas],
+        ignore_conflicts=True)
+    rows = (UserBalance.objects.select_for_update()
+            .filter(user_id__in=deltas).order_by('pk'))
+    changed = []
+    for row in rows:
+        row.net += deltas[row.user_id]
+        changed.append(row)
+    UserBalance.objects.bulk_update(changed, ['net'], batch_size=500)
+
+
+def update_group_nets(deltas):
+    # ``deltas`` maps (group id, user id) to the change in that member's net.
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    GroupBalance.objects.bulk_create(
+        [GroupBalance(group_id=group_id, user_id=user_id)
+         for group_id, user_id in deltas],
+        ignore_conflicts=True)
+    group_ids = {group_id for group_id, _ in deltas}
+    user_ids = {user_id for _, user_id in deltas}
+    rows = (GroupBalance.objects.select_for_update()
+            .filter(group_id__in=group_ids, user_id__in=user_ids).order_by('pk'))
+    changed = []
+    for row in rows:
+        delta = deltas.get((row.group_id, row.user_id))
+        if delta:
+            row.net += delta
+            changed.append(row)
+    GroupBalance.objects.bulk_update(changed, ['net'], batch_size=500)
+
+
+def forget_user(user):
+    # Called before a user is deleted: the cascade removes their expenses and
+    # splits, live and archived, so take them out of everyone else's
+    # balances first.
+    paid = [model.objects.filter(payer=user).prefetch_related('splits')
+            for model in (Expense, ArchivedExpense)]
+    reverse_expenses((expense, list(expense.splits.all()))
+                     for expense in itertools.chain(*paid))
+    owed = [model.objects.filter(user=user).exclude(expense__payer=user)
+            .select_related('expense')
+            for model in (ExpenseSplit, ArchivedExpenseSplit)]
+    apply_changes([(split.expense, [split]) for split in itertools.chain(*owed)], [],
+                  splits_only=True)
+
+
+def compute_balances():
+    # Derive balances from the expense data, live and archived, aggregated
+    # per (payer, participant) pair in the database.
+    pair_deltas = defaultdict(Decimal)
+    net_deltas = defaultdict(Decimal)
+    for split_model in (ExpenseSplit, ArchivedExpenseSplit):
+        totals = (split_model.objects.exclude(user=F('expense__payer'))
+                  .values_list('user', 'expense__payer')
+                  .annotate(total=Sum('amount')).order_by())
+        for debtor_id, creditor_id, total in totals:
+            add_debt(pair_deltas, net_deltas, debtor_id, creditor_id, total)
+    return pair_deltas, net_deltas
+
+
+def compute_group_balances():
+    # Per (group, member) nets derived from the group expenses, live and
+    # archived.
+    group_deltas = defaultdict(Decimal)
+    for split_model in (ExpenseSplit, ArchivedExpenseSplit):
+        totals = (split_model.objects.filter(expense__group__isnull=False)
+                  .exclude(user=F('expense__payer'))
+                  .values_list('expense__group', 'user', 'expense__payer')
+                  .annotate(total=Sum('amount')).order_by())
+        for group_id, debtor_id, creditor_id, total in totals:
+            add_group_debt(group_deltas, group_id, debtor_id, creditor_id, total)
+    return group_deltas
+
+
+def group_balances(group):
+    # Nonzero member nets of one group, from its ledger.
+    return sorted(GroupBalance.objects.filter(group=group).exclude(net=0)
+                  .values_list('user', 'net'))
+
+
+def outside_group_nets():
+    # Net positions from expenses outside any group, which every user can
+    # see. Group debts are private to members and settled per group.
+    nets = defaultdict(Decimal, UserBalance.objects.exclude(net=0).values_list('user', 'net'))
+    rows = (GroupBalance.objects.exclude(net=0).order_by()
+            .values_list('user').annotate(total=Sum('net')))
+    for user_id, total in rows:
+        nets[user_id] -= total
+    return {user_id: net for user_id, net in nets.items() if net}
+
+
+def user_balances(user):
+    net = (UserBalance.objects.filter(user=user)
+           .values_list('net', flat=True).first())
+    balances = []
+    rows = (PairwiseBalance.objects.filter(user_low=user).exclude(amount=0)
+            .values_list('user_high', 'amount'))
+    balances.extend((other, -amount) for other, amount in rows)
+    rows = (PairwiseBalance.objects.filter(user_high=user).exclude(amount=0)
+            .values_list('user_low', 'amount'))
+    balances.extend(rows)
+    return net or Decimal('0.00'), sorted(balances)
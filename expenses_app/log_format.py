@@ -0,0 +1,15 @@
+import logging
+
+# Attributes every LogRecord has; anything else was passed through ``extra``.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class KeyValueFormatter(logging.Formatter):
+    # Appends the fields passed through ``extra`` as key=value pairs, so log
+    # lines stay greppable and machine-parseable.
+
+    def format(self, record):
+        line = super().format(record)
+        fields = [f"{key}={value!r}" for key, value in vars(record).items()
+                  if key not in RECORD_ATTRIBUTES]
+        return f"{line} {' '.join(fields)}" if fields else line
@@ -0,0 +1,44 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from expenses_app.archive import archive_batch, default_horizon, pending
+
+
+class Command(BaseCommand):
+    help = ('Move expenses older than the archive horizon (EXPENSE_ARCHIVE_AFTER_DAYS) '
+            'into the archive tables, one batch per transaction. Interrupted runs '
+            'can simply be started again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before', type=date.fromisoformat,
+            help='Archive expenses dated before this day (YYYY-MM-DD) instead.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--max-batches', type=int,
+            help='Stop after this many batches; the next run continues from there.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only count the expenses that would be archived.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive.')
+        before = options['before'] or default_horizon()
+        if options['dry_run']:
+            self.stdout.write(
+                f"{pending(before).count()} expenses dated before {before} to archive.")
+            return
+
+        archived = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            moved = archive_batch(before, options['batch_size'])
+            if not moved:
+                break
+            archived += moved
+            batches += 1
+            self.stdout.write(f"Archived {archived} expenses dated before {before}.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {archived} expenses archived in {batches} batches, "
+            f"{pending(before).count()} left before {before}."))
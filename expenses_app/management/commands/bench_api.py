@@ -0,0 +1,239 @@
+import itertools
+import json
+import random
+from datetime import date
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from expenses_app import archive, balance_sheets
+from expenses_app.authentication import get_user_cache
+from expenses_app.benchmarks import benchmark_database, environment, measure
+from expenses_app.conditional import get_payload_cache
+from expenses_app.models import ArchivedExpense, Expense, User
+from expenses_app.synthetic import seed_dataset
+from expenses_app.versions import user_version
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic dataset in a throwaway test database and drive every '
+            'ExpenseViewSet and UserViewSet action in-process, reporting throughput, '
+            'latency percentiles, query counts and peak memory as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--expenses', type=int, default=2000)
+        parser.add_argument('--splits', type=int, default=4,
+                            help='Participants per seeded expense.')
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Timed requests per action.')
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--actions', default='',
+                            help='Comma separated subset of actions to run.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            report = self.run(options)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        self.stdout.write(output)
+
+    def run(self, options):
+        users = seed_dataset(options['users'], options['expenses'],
+                             options['splits'], seed=options['seed'])
+        get_user_cache().clear()
+        bench = Bench(users, options['splits'], options['seed'])
+
+        selected = {name for name in options['actions'].split(',') if name}
+        results = [
+            measure(name, run, options['requests'], options['warmup'], expected)
+            for name, run, expected in bench.scenarios()
+            if not selected or name in selected
+        ]
+        return {
+            'config': {key: options[key] for key in
+                       ('users', 'expenses', 'splits', 'requests', 'warmup', 'seed')},
+            'environment': environment(),
+            'results': results,
+        }
+
+
+class Bench:
+    def __init__(self, users, splits, seed):
+        self.users = users
+        self.user = users[0]
+        self.splits = max(1, min(splits, len(users)))
+        self.rng = random.Random(seed)
+        self.counter = itertools.count()
+        self.client = APIClient()
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        # Bulk onboarding and the auth cache stats are staff only.
+        self.admin_client = APIClient()
+        admin = User.create_user(**{**self.user_body(), 'is_staff': True})
+        token = RefreshToken.for_user(admin).access_token
+        self.admin_client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        # The seeded expenses span 2023; archive its first two months so the
+        # archive actions have something to read.
+        while archive.archive_batch(date(2023, 3, 1), 1000):
+            pass
+        self.archived_ids = list(
+            ArchivedExpense.objects.visible_to(self.user).values_list('id', flat=True))
+        self.expense_ids = list(
+            Expense.objects.filter(payer=self.user).values_list('id', flat=True))
+
+    def expense_body(self):
+        participants = self.rng.sample(self.users, self.splits)
+        return {
+            'payer': self.user.id,
+            'total_amount': f"{self.rng.randrange(100, 100000) / 100:.2f}",
+            'split_method': 'equal',
+            'description': 'Benchmark expense',
+            'date': '2024-08-25',
+            'splits': [{'user': user.id} for user in participants],
+        }
+
+    def new_expense(self):
+        response = self.client.post('/api/expenses/', self.expense_body(), format='json')
+        return response.json()['id']
+
+    def user_body(self):
+        n = next(self.counter)
+        return {'email': f'bench-{n}@example.invalid', 'name': f'Bench {n}',
+                'mobile_number': f'{8000000000 + n:010d}', 'password': 'bench-password'}
+
+    def get(self, path, client=None, uncached=False, **params):
+        # With ``uncached`` the payload cache is emptied before each request,
+        # so versioned reads build their payload instead of reusing the one
+        # cached by the previous request.
+        client = client or self.client
+
+        def run():
+            if uncached:
+                get_payload_cache().clear()
+            return lambda: consume(client.get(path, params))
+        return run
+
+    def scenarios(self):
+        ok, created, accepted, no_content = {200}, {201}, {200, 202}, {204}
+        client = self.client
+        expense_id = lambda: self.rng.choice(self.expense_ids)
+
+        def create_expense():
+            body = self.expense_body()
+            return lambda: client.post('/api/expenses/', body, format='json')
+
+        def update_expense():
+            pk, body = self.new_expense(), self.expense_body()
+            return lambda: client.put(f'/api/expenses/{pk}/', body, format='json')
+
+        def partial_update_expense():
+            pk = self.new_expense()
+            return lambda: client.patch(
+                f'/api/expenses/{pk}/', {'description': 'Renamed'}, format='json')
+
+        def destroy_expense():
+            pk = self.new_expense()
+            return lambda: client.delete(f'/api/expenses/{pk}/')
+
+        def retrieve_expense():
+            pk = expense_id()
+            return lambda: client.get(f'/api/expenses/{pk}/')
+
+        def archived_expense():
+            pk = self.rng.choice(self.archived_ids)
+            return lambda: client.get(f'/api/expenses/archived/{pk}/')
+
+        def bulk_import():
+            lines = '\n'.join(json.dumps(self.expense_body()) for _ in range(100))
+            upload = SimpleUploadedFile('expenses.jsonl', lines.encode())
+            return lambda: client.post(
+                '/api/expenses/bulk-import/', {'file': upload}, format='multipart')
+
+        def create_user():
+            body = self.user_body()
+            return lambda: client.post('/api/users/', body, format='json')
+
+        def bulk_create_users():
+            body = [self.user_body() for _ in range(10)]
+            return lambda: self.admin_client.post('/api/users/bulk/', body, format='json')
+
+        def retrieve_user():
+            pk = self.rng.choice(self.users).id
+            return lambda: client.get(f'/api/users/{pk}/')
+
+        def existing_user():
+            body = self.user_body()
+            del body['password']
+            return User.create_user(**body).id
+
+        def update_user():
+            pk = existing_user()
+            return lambda: client.patch(
+                f'/api/users/{pk}/', {'name': 'Renamed'}, format='json')
+
+        def destroy_user():
+            pk = existing_user()
+            return lambda: client.delete(f'/api/users/{pk}/')
+
+        def balance_sheet_job():
+            consume(client.get('/api/expenses/download-balance-sheet/'))
+            job_id = balance_sheets.job_id(self.user.pk, user_version(self.user.pk))
+            return lambda: client.get(f'/api/expenses/balance-sheet-jobs/{job_id}/')
+
+        return [
+            ('expenses.list', self.get('/api/expenses/'), ok),
+            ('expenses.retrieve', retrieve_expense, ok),
+            ('expenses.create', create_expense, created),
+            ('expenses.update', update_expense, ok),
+            ('expenses.partial_update', partial_update_expense, ok),
+            ('expenses.destroy', destroy_expense, no_content),
+            ('expenses.bulk_import', bulk_import, ok),
+            ('expenses.user_expenses', self.get('/api/expenses/user_expenses/'), ok),
+            ('expenses.user_expenses.uncached', self.get(
+                '/api/expenses/user_expenses/', uncached=True), ok),
+            ('expenses.overall_expenses', self.get('/api/expenses/overall_expenses/'), ok),
+            ('expenses.overall_expenses.uncached', self.get(
+                '/api/expenses/overall_expenses/', uncached=True), ok),
+            ('expenses.archived', self.get('/api/expenses/archived/'), ok),
+            ('expenses.archived_expense', archived_expense, ok),
+            ('expenses.balance_sheet', self.get('/api/expenses/balance_sheet/'), ok),
+            ('expenses.balance_sheet.uncached', self.get(
+                '/api/expenses/balance_sheet/', uncached=True), ok),
+            ('expenses.balance_sheet_summary', self.get(
+                '/api/expenses/balance_sheet/', summary_only='true', group_by='month'), ok),
+            ('expenses.balance_sheet_summary.uncached', self.get(
+                '/api/expenses/balance_sheet/', uncached=True,
+                summary_only='true', group_by='month'), ok),
+            ('expenses.balances', self.get('/api/expenses/balances/'), ok),
+            ('expenses.settle_up', self.get('/api/expenses/settle-up/'), ok),
+            ('expenses.analytics', self.get(
+                '/api/expenses/analytics/', granularity='week'), ok),
+            ('expenses.download_csv', self.get('/api/expenses/download-csv/'), ok),
+            ('expenses.download_balance_sheet', self.get(
+                '/api/expenses/download-balance-sheet/'), accepted),
+            ('expenses.balance_sheet_job', balance_sheet_job, ok),
+            ('users.list', self.get('/api/users/'), ok),
+            ('users.retrieve', retrieve_user, ok),
+            ('users.create', create_user, created),
+            ('users.bulk_create', bulk_create_users, ok),
+            ('users.partial_update', update_user, ok),
+            ('users.destroy', destroy_user, no_content),
+            ('users.auth_cache_stats', self.get(
+                '/api/users/auth-cache-stats/', client=self.admin_client), ok),
+        ]
+
+
+def consume(response):
+    # Streaming responses only do their work while being iterated.
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from expenses_app.authentication import get_user_cache
+from expenses_app.benchmarks import benchmark_database, environment, latency_summary
+from expenses_app.synthetic import seed_dataset
+
+ACTIONS = {
+    'user_expenses': ('/api/expenses/user_expenses/', '/api/async/expenses/user_expenses/'),
+    'overall_expenses': ('/api/expenses/overall_expenses/',
+                         '/api/async/expenses/overall_expenses/'),
+    'balance_sheet': ('/api/expenses/balance_sheet/', '/api/async/expenses/balance_sheet/'),
+}
+
+# wsgi: the DRF action through the WSGI handler, one thread per in-flight
+# request. asgi-sync: the same DRF action through the ASGI handler, which
+# runs it on a thread. asgi: the native async view through the ASGI handler.
+MODES = ['wsgi', 'asgi-sync', 'asgi']
+
+
+class Command(BaseCommand):
+    help = ('Compare the DRF read actions served through WSGI with their async '
+            'versions served through ASGI at increasing concurrency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--expenses', type=int, default=2000)
+        parser.add_argument('--splits', type=int, default=4)
+        parser.add_argument('--concurrency', default='1,10,50',
+                            help='Comma separated in-flight request counts.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per action, mode and concurrency level.')
+        parser.add_argument('--actions', default=','.join(ACTIONS))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        actions = [name for name in options['actions'].split(',') if name]
+        unknown = set(actions) - set(ACTIONS)
+        if unknown:
+            raise CommandError(f"Unknown actions: {', '.join(sorted(unknown))}.")
+        levels = [int(level) for level in options['concurrency'].split(',')]
+
+        with benchmark_database():
+            users = seed_dataset(options['users'], options['expenses'],
+                                 options['splits'], seed=options['seed'])
+            get_user_cache().clear()
+            token = RefreshToken.for_user(users[0]).access_token
+            headers = {'Authorization': f'Bearer {token}'}
+
+            results = []
+            for action in actions:
+                for concurrency in levels:
+                    for mode in MODES:
+                        results.append(run(action, mode, concurrency,
+                                           options['requests'], headers))
+            report = {
+                'config': {key: options[key] for key in
+                           ('users', 'expenses', 'splits', 'requests', 'seed')},
+                'environment': environment(),
+                'results': results,
+            }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        self.stdout.write(output)
+
+
+def run(action, mode, concurrency, requests, headers):
+    sync_path, async_path = ACTIONS[action]
+    if mode == 'wsgi':
+        latencies, errors, elapsed = run_threads(sync_path, concurrency, requests, headers)
+    else:
+        path = async_path if mode == 'asgi' else sync_path
+        latencies, errors, elapsed = asyncio.run(
+            run_tasks(path, concurrency, requests, headers))
+    return {
+        'action': action,
+        'mode': mode,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / elapsed, 2),
+        'latency_ms': latency_summary(latencies),
+    }
+
+
+def run_threads(path, concurrency, requests, headers):
+    def worker(count):
+        client, latencies, errors = Client(), [], 0
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != 200
+        finally:
+            connections.close_all()
+        return latencies, errors
+
+    shares = [requests // concurrency + (i < requests % concurrency)
+              for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(worker, shares))
+    elapsed = time.perf_counter() - started
+    return ([latency for latencies, _ in outcomes for latency in latencies],
+            sum(errors for _, errors in outcomes), elapsed)
+
+
+async def run_tasks(path, concurrency, requests, headers):
+    client, in_flight = AsyncClient(), asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one():
+        nonlocal errors
+        async with in_flight:
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            errors += response.status_code != 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, errors, time.perf_counter() - started
@@ -0,0 +1,88 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from expenses_app import payloads
+from expenses_app.benchmarks import benchmark_database, environment
+from expenses_app.models import Expense
+from expenses_app.renderers import FastJSONRenderer
+from expenses_app.serializers import ExpenseSerializer
+from expenses_app.synthetic import seed_dataset
+
+
+class Command(BaseCommand):
+    help = ('Seed expenses in a throwaway test database and compare ExpenseSerializer '
+            'plus JSONRenderer with the values() payloads plus FastJSONRenderer, '
+            'reporting milliseconds per 10k expenses for each stage.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--expenses', type=int, default=10000)
+        parser.add_argument('--splits', type=int, default=4,
+                            help='Participants per seeded expense.')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_dataset(options['users'], options['expenses'], options['splits'],
+                         seed=options['seed'])
+            report = {
+                'config': {key: options[key] for key in
+                           ('users', 'expenses', 'splits', 'repeat', 'seed')},
+                'environment': environment(),
+                'results': self.compare(options['expenses'], options['repeat']),
+            }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        self.stdout.write(output)
+
+    def compare(self, count, repeat):
+        expenses = Expense.objects.order_by('-date', '-id')
+
+        def serializer_path():
+            instances = list(expenses.prefetch_related('splits'))
+            return instances, lambda: list(ExpenseSerializer(instances, many=True).data)
+
+        def payloads_path():
+            rows = list(payloads.expense_rows(expenses))
+            splits = list(payloads.split_rows([row['id'] for row in rows]))
+            return (rows, splits), lambda: payloads.build_payloads(
+                rows, payloads.split_payloads(splits))
+
+        results, bodies = [], []
+        for name, path, renderer in [
+            ('serializer', serializer_path, JSONRenderer()),
+            ('payloads', payloads_path, FastJSONRenderer()),
+        ]:
+            fetch, build, render = [], [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                _, serialize = path()
+                fetched = time.perf_counter()
+                data = serialize()
+                built = time.perf_counter()
+                body = renderer.render(data)
+                rendered = time.perf_counter()
+                fetch.append(fetched - started)
+                build.append(built - fetched)
+                render.append(rendered - built)
+            bodies.append(body)
+            per_10k = 10000 / count * 1000
+            results.append({
+                'path': name,
+                'fetch_ms_per_10k': round(min(fetch) * per_10k, 2),
+                'build_ms_per_10k': round(min(build) * per_10k, 2),
+                'render_ms_per_10k': round(min(render) * per_10k, 2),
+                'total_ms_per_10k': round(
+                    (min(fetch) + min(build) + min(render)) * per_10k, 2),
+                'bytes': len(body),
+            })
+        results.append({'identical_output': bodies[0] == bodies[1]})
+        return results
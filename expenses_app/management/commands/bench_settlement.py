@@ -0,0 +1,46 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from expenses_app.settlement import settle_up
+
+
+class Command(BaseCommand):
+    help = 'Measure how settle-up planning time grows with the number of users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000,100000',
+            help='Comma separated user counts to benchmark.')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        results = []
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            net_balances = synthetic_balances(rng, size)
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                transfers = settle_up(net_balances)
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            results.append({
+                'users': size,
+                'transfers': len(transfers),
+                'seconds': round(best, 6),
+                'microseconds_per_user': round(best / size * 1e6, 3),
+            })
+        self.stdout.write(json.dumps(results, indent=2))
+
+
+def synthetic_balances(rng, size):
+    # Net positions in cents that sum to zero, like the ledger guarantees.
+    net_balances = {
+        user_id: rng.randint(-500000, 500000) for user_id in range(1, size)
+    }
+    net_balances[size] = -sum(net_balances.values())
+    return net_balances
@@ -0,0 +1,113 @@
+import json
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from expenses_app import money
+from expenses_app.splits import SplitBatch, plan, plan_expenses
+
+
+class Command(BaseCommand):
+    help = 'Compare batched split planning with planning one expense at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000,100000',
+            help='Comma separated expense counts to benchmark.')
+        parser.add_argument('--splits', type=int, default=4,
+                            help='Participants per expense.')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        results = []
+        for size in [int(size) for size in options['sizes'].split(',')]:
+            expenses = synthetic_expenses(rng, size, options['splits'])
+            batch = SplitBatch.from_expenses(expenses)
+            timings = {
+                'per_expense': best_of(options['repeat'], lambda: [
+                    plan_one(*expense) for expense in expenses]),
+                'batched': best_of(options['repeat'], lambda: plan_expenses(expenses)),
+                'batched_arrays_only': best_of(options['repeat'], lambda: plan(batch)),
+            }
+            split_count = size * options['splits']
+            results.append({
+                'expenses': size,
+                'splits': split_count,
+                **{name: {'seconds': round(seconds, 6),
+                          'microseconds_per_split': round(seconds / split_count * 1e6, 3)}
+                   for name, seconds in timings.items()},
+                'speedup': round(timings['per_expense'] / timings['batched'], 2),
+            })
+        self.stdout.write(json.dumps(results, indent=2))
+
+
+def best_of(repeat, run):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def synthetic_expenses(rng, size, splits):
+    # An even mix of the three split methods, all of them valid.
+    expenses = []
+    for index in range(size):
+        total_cents = rng.randint(100, 1000000)
+        method = ('equal', 'exact', 'percentage')[index % 3]
+        if method == 'equal':
+            splits_data = [{'user': user} for user in range(splits)]
+        elif method == 'exact':
+            amounts = money.allocate(total_cents, [rng.randint(1, 9) for _ in range(splits)])
+            splits_data = [{'user': user, 'amount': money.from_cents(amount)}
+                           for user, amount in enumerate(amounts)]
+        else:
+            percentages = money.allocate(10000, [rng.randint(1, 9) for _ in range(splits)])
+            splits_data = [{'user': user, 'percentage': money.from_cents(percentage)}
+                           for user, percentage in enumerate(percentages)]
+        expenses.append((method, money.from_cents(total_cents), splits_data))
+    return expenses
+
+
+def plan_one(split_method, total_amount, splits_data):
+    # The per-expense Decimal loop the serializer used before planning was
+    # batched, kept as the baseline: validate each split, then allocate.
+    total_amount = Decimal(total_amount)
+    if split_method == 'exact':
+        if sum(Decimal(split.get('amount', 0)) for split in splits_data) != total_amount:
+            return None
+    elif split_method == 'percentage':
+        total_percentage = Decimal('0.00')
+        for split in splits_data:
+            percentage = Decimal(split.get('percentage', '0.00'))
+            if percentage < 0 or percentage > 100:
+                return None
+            total_percentage += percentage
+        if not (Decimal('99.99') <= total_percentage <= Decimal('100.01')):
+            return None
+
+    total_cents = money.to_cents(total_amount)
+    splits_data = [dict(split_data) for split_data in splits_data]
+    percentages = None
+    if split_method == 'percentage':
+        percentages = [money.to_cents(split_data.get('percentage', '0.00'))
+                       for split_data in splits_data]
+        amounts = money.allocate(total_cents, percentages)
+    elif split_method == 'equal':
+        amounts = money.allocate(total_cents, [1] * len(splits_data))
+    else:
+        amounts = [money.to_cents(split_data.get('amount') or 0)
+                   for split_data in splits_data]
+    for index, split_data in enumerate(splits_data):
+        split_data['amount'] = money.from_cents(amounts[index])
+        if percentages is not None:
+            split_data['percentage'] = money.from_cents(percentages[index])
+        elif total_cents:
+            split_data['percentage'] = money.from_cents(
+                (amounts[index] * 20000 // total_cents + 1) // 2)
+    return splits_data
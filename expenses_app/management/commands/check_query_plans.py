@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from expenses_app.query_plans import hot_queries, prepare_planner, sequential_scans
+from expenses_app.synthetic import seed_dataset
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic dataset, EXPLAIN the hot queries and fail if any '
+            'of them falls back to a sequential scan. The seed data is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--expenses', type=int, default=5000)
+        parser.add_argument('--splits', type=int, default=4)
+        parser.add_argument('--groups', type=int, default=10,
+                            help='Groups to deal the seeded users into.')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print the full plan of every query.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = seed_dataset(options['users'], options['expenses'],
+                                 options['splits'], groups=options['groups'])
+            expense_ids = list(users[0].expenses_paid.values_list('id', flat=True)[:50])
+            prepare_planner()
+
+            failures = []
+            for name, queryset in hot_queries(users[0], expense_ids).items():
+                plan = queryset.explain()
+                scans = sequential_scans(plan)
+                if scans:
+                    failures.append(name)
+                    self.stdout.write(self.style.ERROR(
+                        f"{name}: sequential scan on {', '.join(scans)}"))
+                else:
+                    self.stdout.write(f"{name}: ok")
+                if options['verbose_plans'] or scans:
+                    self.stdout.write(plan)
+
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(
+                f"{len(failures)} hot queries use sequential scans: {', '.join(failures)}.")
+        self.stdout.write(self.style.SUCCESS("All hot queries use indexes."))
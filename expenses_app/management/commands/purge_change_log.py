@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from expenses_app.changes import feed_settings, purge
+
+
+class Command(BaseCommand):
+    help = 'Delete expense change feed entries older than CHANGE_FEED RETENTION_DAYS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=None,
+                            help='Keep this many days of changes instead.')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if days is None:
+            days = feed_settings()['RETENTION_DAYS']
+        deleted = purge(timezone.now() - timedelta(days=days), options['batch_size'])
+        self.stdout.write(f'Deleted {deleted} change feed entries.')
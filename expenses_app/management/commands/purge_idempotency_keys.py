@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from expenses_app.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys whose replay window (IDEMPOTENCY_KEY_TTL) has passed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(options['batch_size'])
+        self.stdout.write(f'Deleted {deleted} expired idempotency keys.')
@@ -0,0 +1,146 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from expenses_app.archive import compute_summaries
+from expenses_app.ledger import compute_balances, compute_group_balances
+from expenses_app.models import (
+    ArchivedExpense, ArchivedExpenseSplit, ArchivedExpenseSummary, Expense, ExpenseSplit,
+    GroupBalance, PairwiseBalance, SpendingRollup, UserBalance)
+from expenses_app.rollups import compute_rollups
+from expenses_app.versions import bump_all_users
+
+
+def lock_expense_tables():
+    # Holds off expense writes (reads go on) until the transaction ends, so
+    # nothing is written between reading the expenses and replacing the
+    # tables derived from them. SQLite needs no lock: the transaction reads
+    # from one snapshot, and its writes fail if another writer committed
+    # since.
+    if connection.vendor != 'postgresql':
+        return
+    tables = ', '.join(connection.ops.quote_name(model._meta.db_table) for model in (
+        Expense, ExpenseSplit, ArchivedExpense, ArchivedExpenseSplit))
+    with connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {tables} IN SHARE MODE')
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the materialized balance, spending rollup and archived '
+            'summary tables from live and archived expenses and splits. Expense '
+            'writes wait while it runs.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Compare the stored balances with the live data without writing.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            lock_expense_tables()
+            pairs, nets = compute_balances()
+            group_nets = compute_group_balances()
+            buckets = compute_rollups()
+            summaries = compute_summaries()
+            if options['check']:
+                self.check_balances(pairs, nets, group_nets, buckets, summaries)
+            else:
+                self.rebuild(pairs, nets, group_nets, buckets, summaries)
+
+    def rebuild(self, pairs, nets, group_nets, buckets, summaries):
+        PairwiseBalance.objects.all().delete()
+        UserBalance.objects.all().delete()
+        GroupBalance.objects.all().delete()
+        SpendingRollup.objects.all().delete()
+        ArchivedExpenseSummary.objects.all().delete()
+        PairwiseBalance.objects.bulk_create(
+            [PairwiseBalance(user_low_id=low, user_high_id=high, amount=amount)
+             for (low, high), amount in pairs.items() if amount],
+            batch_size=1000)
+        UserBalance.objects.bulk_create(
+            [UserBalance(user_id=user_id, net=net)
+             for user_id, net in nets.items() if net],
+            batch_size=1000)
+        GroupBalance.objects.bulk_create(
+            [GroupBalance(group_id=group_id, user_id=user_id, net=net)
+             for (group_id, user_id), net in group_nets.items() if net],
+            batch_size=1000)
+        SpendingRollup.objects.bulk_create(
+            [SpendingRollup(user_id=user_id, day=day, split_method=method,
+                            paid=paid, owed=owed, expense_count=expense_count)
+             for (user_id, day, method), (paid, owed, expense_count) in buckets.items()],
+            batch_size=1000)
+        ArchivedExpenseSummary.objects.bulk_create(
+            [ArchivedExpenseSummary(user_id=user_id, month=month, split_method=method,
+                                    total=total, expense_count=expense_count)
+             for (user_id, month, method), (total, expense_count) in summaries.items()],
+            batch_size=1000)
+        # Cached balance payloads were built from the old tables.
+        bump_all_users()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(pairs)} pairwise, {len(nets)} user and "
+            f"{len(group_nets)} group balances, {len(buckets)} spending rollups "
+            f"and {len(summaries)} archived summaries."))
+
+    def check_balances(self, pairs, nets, group_nets, buckets, summaries):
+        stored_pairs = {
+            (low, high): amount for low, high, amount in
+            PairwiseBalance.objects.values_list('user_low', 'user_high', 'amount')
+        }
+        stored_nets = dict(UserBalance.objects.values_list('user', 'net'))
+        stored_group_nets = {
+            (group_id, user_id): net for group_id, user_id, net in
+            GroupBalance.objects.values_list('group', 'user', 'net')
+        }
+
+        mismatches = []
+        for pair in pairs.keys() | stored_pairs.keys():
+            expected, stored = pairs.get(pair, 0), stored_pairs.get(pair, 0)
+            if expected != stored:
+                mismatches.append(
+                    f"pair {pair[0]}/{pair[1]}: stored {stored}, expected {expected}")
+        for user_id in nets.keys() | stored_nets.keys():
+            expected, stored = nets.get(user_id, 0), stored_nets.get(user_id, 0)
+            if expected != stored:
+                mismatches.append(
+                    f"user {user_id}: stored {stored}, expected {expected}")
+        for key in group_nets.keys() | stored_group_nets.keys():
+            expected, stored = group_nets.get(key, 0), stored_group_nets.get(key, 0)
+            if expected != stored:
+                mismatches.append(
+                    f"group {key[0]} user {key[1]}: stored {stored}, expected {expected}")
+        # Global buckets are summed over their stripes.
+        stored_buckets = {
+            (user_id, day, method): [paid, owed, expense_count]
+            for user_id, day, method, paid, owed, expense_count in
+            SpendingRollup.objects.order_by().values_list('user', 'day', 'split_method')
+            .annotate(paid=Sum('paid'), owed=Sum('owed'), count=Sum('expense_count'))
+            if paid or owed or expense_count
+        }
+        for key in buckets.keys() | stored_buckets.keys():
+            expected, stored = buckets.get(key), stored_buckets.get(key)
+            if expected != stored:
+                mismatches.append(
+                    f"rollup {key[0] or 'all'}/{key[1]}/{key[2]}: "
+                    f"stored {stored}, expected {expected}")
+        stored_summaries = {
+            (user_id, month, method): [total, expense_count]
+            for user_id, month, method, total, expense_count in
+            ArchivedExpenseSummary.objects.values_list(
+                'user', 'month', 'split_method', 'total', 'expense_count')
+            if total or expense_count
+        }
+        for key in summaries.keys() | stored_summaries.keys():
+            expected, stored = summaries.get(key), stored_summaries.get(key)
+            if expected != stored:
+                mismatches.append(
+                    f"archived summary {key[0]}/{key[1]}/{key[2]}: "
+                    f"stored {stored}, expected {expected}")
+
+        for mismatch in sorted(mismatches):
+            self.stderr.write(mismatch)
+        if mismatches:
+            raise CommandError(
+                f"{len(mismatches)} balances or rollups differ from the expense data.")
+        self.stdout.write(self.style.SUCCESS(
+            "Balances and rollups match the expense data."))
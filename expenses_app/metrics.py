@@ -0,0 +1,216 @@
+import bisect
+import contextvars
+import random
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.fields import empty
+
+DEFAULT_METRICS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 1.0,
+    'TOKEN': None,
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# The detailed measurements of the sampled request being served by the
+# current thread or task, or None when the request was not sampled.
+_current_sample = contextvars.ContextVar('expenses_metrics_sample', default=None)
+
+
+def metrics_settings():
+    return {**DEFAULT_METRICS, **getattr(settings, 'REQUEST_METRICS', {})}
+
+
+class Histogram:
+    # Cumulative-bucket histogram in the Prometheus style, one series per
+    # label tuple.
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            label_text = format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{{{label_text},le=\"{bound}\"}} {cumulative}")
+            lines.append(f"{self.name}_bucket{{{label_text},le=\"+Inf\"}} {count}")
+            lines.append(f"{self.name}_sum{{{label_text}}} {total:.6f}".rstrip('0').rstrip('.'))
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+
+    def inc(self, labels, amount=1):
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{{{format_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+def format_labels(names, values):
+    return ','.join(
+        f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Registry:
+    # Per-process request metrics. Every request is counted and timed;
+    # query and serializer measurements only cover sampled requests.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        route = ('route', 'method')
+        with self._lock:
+            self.requests = Counter(
+                'expenses_http_requests_total', 'Requests served.', route + ('status',))
+            self.latency = Histogram(
+                'expenses_http_request_duration_seconds', 'Time spent serving a request.',
+                route, LATENCY_BUCKETS)
+            self.response_size = Histogram(
+                'expenses_http_response_size_bytes', 'Size of non-streaming response bodies.',
+                route, SIZE_BUCKETS)
+            self.sampled = Counter(
+                'expenses_http_sampled_requests_total',
+                'Requests whose queries and serializers were measured.', route)
+            self.queries = Histogram(
+                'expenses_db_queries_per_request', 'Database queries run by a sampled request.',
+                route, QUERY_COUNT_BUCKETS)
+            self.query_time = Histogram(
+                'expenses_db_query_duration_seconds',
+                'Time a sampled request spent waiting on the database.', route, LATENCY_BUCKETS)
+            self.serializer_time = Histogram(
+                'expenses_serializer_duration_seconds',
+                'Time a sampled request spent in serializers.', route, LATENCY_BUCKETS)
+
+    def record(self, route, method, status, duration, size, sample):
+        labels = (route, method)
+        with self._lock:
+            self.requests.inc(labels + (str(status),))
+            self.latency.observe(labels, duration)
+            if size is not None:
+                self.response_size.observe(labels, size)
+            if sample is not None:
+                self.sampled.inc(labels)
+                self.queries.observe(labels, sample.queries)
+                self.query_time.observe(labels, sample.query_time)
+                self.serializer_time.observe(labels, sample.serializer_time)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.requests, self.latency, self.response_size, self.sampled,
+                           self.queries, self.query_time, self.serializer_time):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class Sample:
+    __slots__ = ('queries', 'query_time', 'serializer_time', 'serializer_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every database connection. Async views run their queries
+    # on a worker thread's connection, but the context variable follows them
+    # there, so both sync and async requests are measured.
+    sample = _current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.query_time += time.perf_counter() - started
+        sample.queries += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # connection_created handler.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def start_sample(sample_rate):
+    if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+        return None, None
+    sample = Sample()
+    return sample, _current_sample.set(sample)
+
+
+def finish_sample(token):
+    if token is not None:
+        _current_sample.reset(token)
+
+
+class TimedSerializerMixin:
+    # Adds the time spent converting to and from primitives to the sampled
+    # request. Only the outermost serializer is timed, so nested and list
+    # serializers aren't counted twice.
+
+    def to_representation(self, instance):
+        sample = _current_sample.get()
+        if sample is None or sample.serializer_depth:
+            return super().to_representation(instance)
+        return timed(sample, super().to_representation, instance)
+
+    def run_validation(self, data=empty):
+        sample = _current_sample.get()
+        if sample is None or sample.serializer_depth:
+            return super().run_validation(data)
+        return timed(sample, super().run_validation, data)
+
+
+def timed(sample, method, argument):
+    sample.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        return method(argument)
+    finally:
+        sample.serializer_time += time.perf_counter() - started
+        sample.serializer_depth -= 1
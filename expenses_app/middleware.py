@@ -0,0 +1,62 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics
+
+# Anything else is reported as "other" so odd methods can't add series.
+KNOWN_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class RequestMetricsMiddleware:
+    # Records per-route latency, status and response size for every request,
+    # plus database and serializer time for a sampled share of them. Works
+    # in both sync and async chains so ASGI requests to async views don't
+    # get pushed onto a thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        options = metrics.metrics_settings()
+        self.enabled = options['ENABLED']
+        self.sample_rate = options['SAMPLE_RATE']
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        sample, token = metrics.start_sample(self.sample_rate)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.finish_sample(token)
+        self.record(request, response, time.perf_counter() - started, sample)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        sample, token = metrics.start_sample(self.sample_rate)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.finish_sample(token)
+        self.record(request, response, time.perf_counter() - started, sample)
+        return response
+
+    def record(self, request, response, duration, sample):
+        match = request.resolver_match
+        size = None if response.streaming else len(response.content)
+        metrics.registry.record(
+            match.view_name if match else 'unmatched',
+            request.method if request.method in KNOWN_METHODS else 'other',
+            response.status_code, duration, size, sample)
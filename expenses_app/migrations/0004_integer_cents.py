@@ -0,0 +1,66 @@
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+import expenses_app.money
+
+# (model, field, decimal max_digits, final field)
+MONEY_FIELDS = [
+    ('expense', 'total_amount', 10, lambda: expenses_app.money.CentsField()),
+    ('expensesplit', 'amount', 10,
+     lambda: expenses_app.money.CentsField(null=True, blank=True)),
+    ('pairwisebalance', 'amount', 14, lambda: expenses_app.money.CentsField(default=0)),
+    ('userbalance', 'net', 14, lambda: expenses_app.money.CentsField(default=0)),
+    ('spendingrollup', 'paid', 14, lambda: expenses_app.money.CentsField(default=0)),
+    ('spendingrollup', 'owed', 14, lambda: expenses_app.money.CentsField(default=0)),
+]
+
+
+def copy_to_cents(apps, schema_editor):
+    for model_name, name, _, _ in MONEY_FIELDS:
+        model = apps.get_model('expenses_app', model_name)
+        model.objects.update(**{
+            name: Cast(Round(F(f'{name}_decimal') * 100), models.BigIntegerField())})
+
+
+def copy_to_decimal(apps, schema_editor):
+    for model_name, name, max_digits, _ in MONEY_FIELDS:
+        model = apps.get_model('expenses_app', model_name)
+        decimal = models.DecimalField(max_digits=max_digits, decimal_places=2)
+        model.objects.update(**{
+            f'{name}_decimal': Cast(Cast(F(name), models.FloatField()) / 100, decimal)})
+
+
+def split_operations():
+    # Each money column is renamed out of the way, copied into a new integer
+    # column of the same name, then dropped.
+    before, after = [], []
+    for model_name, name, max_digits, final_field in MONEY_FIELDS:
+        before += [
+            migrations.RenameField(model_name, name, f'{name}_decimal'),
+            migrations.AlterField(model_name, f'{name}_decimal', models.DecimalField(
+                max_digits=max_digits, decimal_places=2, null=True, blank=True)),
+            migrations.AddField(model_name, name, expenses_app.money.CentsField(
+                null=True, blank=True)),
+        ]
+        after += [
+            migrations.RemoveField(model_name, f'{name}_decimal'),
+            migrations.AlterField(model_name, name, final_field()),
+        ]
+    return before, after
+
+
+BEFORE_COPY, AFTER_COPY = split_operations()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses_app', '0003_dataversion_updated_at'),
+    ]
+
+    operations = [
+        *BEFORE_COPY,
+        migrations.RunPython(copy_to_cents, copy_to_decimal),
+        *AFTER_COPY,
+    ]
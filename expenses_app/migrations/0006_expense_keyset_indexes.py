@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses_app', '0005_groups'),
+    ]
+
+    operations = [
+        # New indexes first, so lookups are never left without one.
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['payer', 'date', 'id'], name='expense_payer_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['date', 'id'], name='expense_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['group', 'date', 'id'], name='expense_group_date_id_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='expense_payer_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='expense_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='expense_group_date_idx',
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses_app', '0009_expense_change_log'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='spendingrollup',
+            name='unique_global_rollup',
+        ),
+        migrations.AddField(
+            model_name='spendingrollup',
+            name='stripe',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='spendingrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('day', 'split_method', 'stripe'), name='unique_global_rollup'),
+        ),
+    ]
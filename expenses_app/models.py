@@ -1,6 +1,11 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from decimal import Decimal
 from django.db import models
+from django.utils import timezone
+from django.db.models.functions import TruncMonth
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator
+from .money import CentsField
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -40,6 +45,91 @@ class User(AbstractBaseUser, PermissionsMixin):
         return User.create_user(email, name, mobile_number, password, **extra_fields)
 
 
+class Group(models.Model):
+    # A set of users sharing expenses. Group expenses are only visible to
+    # members, and each group keeps its own balance ledger (GroupBalance).
+    name = models.CharField(max_length=255)
+    members = models.ManyToManyField(
+        User, through='GroupMembership', related_name='expense_groups')
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class GroupMembership(models.Model):
+    # Covered by the unique (group, user) constraint.
+    group = models.ForeignKey(
+        Group, on_delete=models.CASCADE, related_name='memberships', db_index=False)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='group_memberships')
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['group', 'user'], name='unique_group_member'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.group_id}"
+
+
+class ExpenseQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        # Expenses outside any group, plus those of the user's groups.
+        return self.filter(
+            models.Q(group__isnull=True)
+            | models.Q(group__in=GroupMembership.objects.filter(user=user).values('group')))
+
+    def for_fields(self, fields):
+        # Prefetch splits only when the response includes them; ``fields`` is
+        # a sparse fieldset from serializers.sparse_fields, None for all.
+        if fields is None or 'splits' in fields:
+            return self.prefetch_related('splits')
+        return self
+
+    def summary(self):
+        # Totals, counts and per split method subtotals in a single query.
+        return self._summary(self.order_by().aggregate(**self._summary_aggregates()))
+
+    async def asummary(self):
+        return self._summary(await self.order_by().aaggregate(**self._summary_aggregates()))
+
+    def _summary_aggregates(self):
+        aggregates = {
+            'total_expenses': models.Sum('total_amount'),
+            'expense_count': models.Count('id'),
+        }
+        for method, _ in self.model.SPLIT_METHOD_CHOICES:
+            in_method = models.Q(split_method=method)
+            aggregates[f'{method}_total'] = models.Sum(
+                'total_amount', filter=in_method)
+            aggregates[f'{method}_count'] = models.Count('id', filter=in_method)
+        return aggregates
+
+    def _summary(self, totals):
+        return {
+            'total_expenses': totals['total_expenses'] or Decimal('0.00'),
+            'expense_count': totals['expense_count'],
+            'by_split_method': {
+                method: {
+                    'total': totals[f'{method}_total'] or Decimal('0.00'),
+                    'count': totals[f'{method}_count'],
+                }
+                for method, _ in self.model.SPLIT_METHOD_CHOICES
+            },
+        }
+
+    def monthly_totals(self):
+        return (self.order_by().annotate(month=TruncMonth('date'))
+                .values('month')
+                .annotate(total=models.Sum('total_amount'), count=models.Count('id'))
+                .order_by('month'))
+
+
 class Expense(models.Model):
     SPLIT_METHOD_CHOICES = [
         ('equal', 'Equal'),
@@ -47,14 +137,33 @@ class Expense(models.Model):
         ('percentage', 'Percentage'),
     ]
 
+    # Covered by the (payer, date, id) index below.
     payer = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name='expenses_paid')
-    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+        User, on_delete=models.CASCADE, related_name='expenses_paid',
+        db_index=False)
+    # Null for expenses shared outside any group. Protected so deleting a
+    # group can never drop expenses behind the ledger's back. Covered by the
+    # (group, date, id) index below.
+    group = models.ForeignKey(
+        Group, on_delete=models.PROTECT, null=True, blank=True,
+        related_name='expenses', db_index=False)
+    total_amount = CentsField()
     split_method = models.CharField(
         max_length=10, choices=SPLIT_METHOD_CHOICES)
     description = models.TextField(blank=True, null=True)
     date = models.DateField()
 
+    objects = ExpenseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The id column lets keyset pagination on (date, id) walk each
+            # index in order; see expenses_app.pagination.
+            models.Index(fields=['payer', 'date', 'id'], name='expense_payer_date_id_idx'),
+            models.Index(fields=['date', 'id'], name='expense_date_id_idx'),
+            models.Index(fields=['group', 'date', 'id'], name='expense_group_date_id_idx'),
+        ]
+
     def __str__(self):
         return f"Expense {self.id} - {self.description}"
 
@@ -62,8 +171,225 @@ class Expense(models.Model):
 class ExpenseSplit(models.Model):
     expense = models.ForeignKey(
         Expense, on_delete=models.CASCADE, related_name='splits')
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    amount = models.DecimalField(
-        max_digits=10, decimal_places=2, null=True, blank=True)
+    # Covered by the (user, expense) index below.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    amount = CentsField(null=True, blank=True)
     percentage = models.DecimalField(
         max_digits=5, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'expense'], name='split_user_expense_idx'),
+        ]
+
+
+class ArchivedExpense(models.Model):
+    # Expenses moved out of the hot tables by the archive_expenses command,
+    # keeping their ids. Read only: the balances, rollups and per-user
+    # ArchivedExpenseSummary rows already account for them.
+    SPLIT_METHOD_CHOICES = Expense.SPLIT_METHOD_CHOICES
+
+    id = models.BigIntegerField(primary_key=True)
+    payer = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    group = models.ForeignKey(
+        Group, on_delete=models.PROTECT, null=True, blank=True,
+        related_name='+', db_index=False)
+    total_amount = CentsField()
+    split_method = models.CharField(
+        max_length=10, choices=SPLIT_METHOD_CHOICES)
+    description = models.TextField(blank=True, null=True)
+    date = models.DateField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ExpenseQuerySet.as_manager()
+
+    class Meta:
+        # One index for keyset pages of archived expenses; payer and group
+        # lookups on cold data can afford a scan.
+        indexes = [
+            models.Index(fields=['date', 'id'], name='archived_expense_date_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived expense {self.id} - {self.description}"
+
+
+class ArchivedExpenseSplit(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    expense = models.ForeignKey(
+        ArchivedExpense, on_delete=models.CASCADE, related_name='splits')
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    amount = CentsField(null=True, blank=True)
+    percentage = models.DecimalField(
+        max_digits=5, decimal_places=2, null=True, blank=True)
+
+
+class ArchivedExpenseSummary(models.Model):
+    # What a user paid per month and split method in archived expenses, so
+    # balance sheet totals don't need the archive tables. Covered by the
+    # unique (user, month, split_method) constraint.
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    month = models.DateField()
+    split_method = models.CharField(
+        max_length=10, choices=Expense.SPLIT_METHOD_CHOICES)
+    total = CentsField(default=0)
+    expense_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'month', 'split_method'], name='unique_archived_summary'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.month} {self.split_method}"
+
+
+class PairwiseBalance(models.Model):
+    # Stored once per pair with user_low.id < user_high.id. A positive amount
+    # means user_low owes user_high, a negative one the reverse.
+    # Covered by the unique (user_low, user_high) constraint.
+    user_low = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    user_high = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+')
+    amount = CentsField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user_low', 'user_high'], name='unique_balance_pair'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_low_id} -> {self.user_high_id}: {self.amount}"
+
+
+class UserBalance(models.Model):
+    # Positive net means the user is owed money overall.
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    net = CentsField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.net}"
+
+
+class GroupBalance(models.Model):
+    # A member's net position within one group; positive when they are owed
+    # money. Covered by the unique (group, user) constraint.
+    group = models.ForeignKey(
+        Group, on_delete=models.CASCADE, related_name='balances', db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    net = CentsField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['group', 'user'], name='unique_group_balance'),
+        ]
+
+    def __str__(self):
+        return f"{self.group_id}/{self.user_id}: {self.net}"
+
+
+class DataVersion(models.Model):
+    # Monotonic counter per scope (e.g. "user:42", "group:7", or "global"
+    # for all expenses), bumped whenever the expenses visible in that scope change.
+    # Used as a cache key and for ETag / Last-Modified validators.
+    scope = models.CharField(max_length=64, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.scope}@{self.version}"
+
+
+class IdempotencyKey(models.Model):
+    # The response to a request made with an Idempotency-Key header, replayed
+    # when the client retries with the same key until expires_at. The
+    # fingerprint is a SHA-256 digest of the request body, so a key reused
+    # for a different request is refused. The row is claimed before the
+    # request runs and the response filled in by the same transaction, so it
+    # is never seen without one. Covered by the unique (user, key)
+    # constraint; expires_at is indexed for purging.
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    key = models.CharField(max_length=255)
+    fingerprint = models.BinaryField(max_length=32)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}/{self.key}"
+
+
+class ExpenseChange(models.Model):
+    # Append-only log of expense writes, one row per affected user (payer and
+    # participants), written by ledger.apply_changes in the same transaction.
+    # The id is the change feed cursor; see expenses_app.changes. Covered by
+    # the (user, id) index.
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+    ]
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    # Plain ids: the log outlives deleted expenses.
+    expense_id = models.BigIntegerField()
+    group_id = models.BigIntegerField(null=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='expense_change_user_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id}: {self.action} expense {self.expense_id} for {self.user_id}"
+
+
+class SpendingRollup(models.Model):
+    # Daily spend bucket per user and split method, maintained alongside the
+    # balance ledger. Rows with no user hold the global totals, spread over
+    # stripes (see rollups.GLOBAL_STRIPES).
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, related_name='+')
+    day = models.DateField()
+    split_method = models.CharField(
+        max_length=10, choices=Expense.SPLIT_METHOD_CHOICES)
+    stripe = models.SmallIntegerField(default=0)
+    paid = CentsField(default=0)
+    owed = CentsField(default=0)
+    expense_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'day', 'split_method'],
+                condition=models.Q(user__isnull=False),
+                name='unique_user_rollup'),
+            models.UniqueConstraint(
+                fields=['day', 'split_method', 'stripe'],
+                condition=models.Q(user__isnull=True),
+                name='unique_global_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id or 'all'} {self.day} {self.split_method}"
@@ -0,0 +1,61 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import models
+
+CENT = Decimal('0.01')
+
+
+def to_cents(value):
+    # Decimal, str or int currency amount -> integer minor units.
+    return int(Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP).scaleb(2))
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def allocate(total_cents, weights):
+    # Largest-remainder allocation: splits ``total_cents`` in proportion to
+    # the non-negative integer ``weights`` so the parts always add up to the
+    # total exactly. Leftover cents go to the largest fractional remainders,
+    # earlier entries first on ties.
+    total_weight = sum(weights)
+    if total_weight <= 0:
+        raise ValueError("At least one weight must be positive.")
+    parts, remainders = [], []
+    for index, weight in enumerate(weights):
+        part, remainder = divmod(total_cents * weight, total_weight)
+        parts.append(part)
+        remainders.append((-remainder, index))
+    for _, index in sorted(remainders)[:total_cents - sum(parts)]:
+        parts[index] += 1
+    return parts
+
+
+class CentsField(models.BigIntegerField):
+    # Money stored as an integer number of cents, so sums and comparisons in
+    # the database are integer arithmetic. Python values are Decimals with
+    # two places, like the DecimalFields this replaced.
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else from_cents(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+        except (ArithmeticError, TypeError, ValueError):
+            raise ValidationError(
+                self.error_messages['invalid'], code='invalid', params={'value': value})
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return to_cents(value)
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{'form_class': forms.DecimalField,
+                                    'decimal_places': 2, **kwargs})
@@ -0,0 +1,106 @@
+import base64
+import binascii
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class ExpenseKeysetPagination(BasePagination):
+    # Newest first, keyed on (date, id). The cursor is the position of the
+    # last expense on the previous page, so every page is a bounded range
+    # scan on a (..., date, id) index no matter how deep the client goes,
+    # unlike offsets. Forward only: the response has a ``next`` link and no
+    # ``previous`` or total count, which would cost a scan.
+    ordering = ('-date', '-id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(request, list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        # For the async views; ``request`` is a plain Django HttpRequest.
+        page_queryset = self.page_queryset(queryset, request)
+        return self.set_page(request, [row async for row in page_queryset])
+
+    def page_queryset(self, queryset, request):
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            last_date, last_id = position
+            # The redundant date bound lets the planner use it as the index
+            # range; the OR then only filters ties on that date.
+            queryset = queryset.filter(date__lte=last_date).filter(
+                Q(date__lt=last_date) | Q(date=last_date, id__lt=last_id))
+        # One extra row tells whether there is a next page.
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, request, rows):
+        page = rows[:self.page_size]
+        self.next_position = None
+        if len(rows) > self.page_size:
+            last = page[-1]
+            # Model instances, or values() rows from the payloads fast path.
+            self.next_position = ((last['date'], last['id']) if isinstance(last, dict)
+                                  else (last.date, last.pk))
+        # ``next`` is a query-only relative reference, resolved against the
+        # URL that was requested: cached pages are shared between the DRF and
+        # async views and between hosts, so it must not name either.
+        self.base_url = '?' + request.GET.urlencode()
+        return page
+
+    def get_page_size(self, request):
+        query_params = getattr(request, 'query_params', request.GET)
+        try:
+            page_size = int(query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.EXPENSE_PAGE_SIZE
+        if page_size <= 0:
+            return settings.EXPENSE_PAGE_SIZE
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        query_params = getattr(request, 'query_params', request.GET)
+        encoded = query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            last_date, _, last_id = base64.urlsafe_b64decode(
+                encoded.encode()).decode().partition(':')
+            return date.fromisoformat(last_date), int(last_id)
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        last_date, last_id = position
+        return base64.urlsafe_b64encode(f'{last_date.isoformat()}:{last_id}'.encode()).decode()
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_data(self, data):
+        return {'next': self.get_next_link(), 'results': data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri-reference'},
+                'results': schema,
+            },
+        }
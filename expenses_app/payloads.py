@@ -0,0 +1,103 @@
+from collections import defaultdict
+from decimal import ROUND_HALF_UP
+
+from .models import ExpenseSplit
+from .money import CENT
+
+# Read-only fast path for expense lists. Payloads are built straight from
+# values() rows instead of going through ExpenseSerializer, whose per-field
+# machinery (and the nested ExpenseSplitSerializer's DecimalField coercion)
+# costs more than the queries. The output is exactly what ExpenseSerializer
+# returns: same keys, same order, same string formats.
+
+# ExpenseSerializer fields and the values() columns behind them.
+EXPENSE_COLUMNS = {
+    'id': 'id',
+    'payer': 'payer_id',
+    'group': 'group_id',
+    'total_amount': 'total_amount',
+    'split_method': 'split_method',
+    'description': 'description',
+    'date': 'date',
+}
+SPLIT_COLUMNS = ('expense_id', 'user_id', 'amount', 'percentage')
+
+
+def expense_rows(queryset):
+    # Every column a payload can need; ``id`` and ``date`` are also the
+    # keyset pagination position.
+    return queryset.values(*EXPENSE_COLUMNS.values())
+
+
+def split_rows(expense_ids, split_model=ExpenseSplit):
+    # ``split_model`` is ArchivedExpenseSplit for archived expenses.
+    return (split_model.objects.filter(expense_id__in=expense_ids)
+            .order_by('id').values_list(*SPLIT_COLUMNS))
+
+
+def decimal_string(value):
+    # DecimalField(decimal_places=2) representation. Money and percentages
+    # normally come back from the database with two places already, so the
+    # quantize is rarely needed.
+    if value is None:
+        return None
+    if value.as_tuple().exponent != -2:
+        value = value.quantize(CENT, rounding=ROUND_HALF_UP)
+    return f'{value:f}'
+
+
+def split_payloads(rows):
+    splits = defaultdict(list)
+    for expense_id, user_id, amount, percentage in rows:
+        splits[expense_id].append({
+            'user': user_id,
+            'amount': decimal_string(amount),
+            'percentage': decimal_string(percentage),
+        })
+    return splits
+
+
+def build_payloads(rows, splits, fields=None):
+    # ``rows`` from expense_rows, ``splits`` from split_payloads (or None
+    # when the fieldset leaves them out).
+    payloads = []
+    for row in rows:
+        payload = {
+            'id': row['id'],
+            'payer': row['payer_id'],
+            'group': row['group_id'],
+            'total_amount': decimal_string(row['total_amount']),
+            'split_method': row['split_method'],
+            'description': row['description'],
+            'date': row['date'].isoformat(),
+        }
+        if splits is not None:
+            payload['splits'] = splits.get(row['id'], [])
+        if fields is not None:
+            payload = {name: payload[name] for name in fields}
+        payloads.append(payload)
+    return payloads
+
+
+def wants_splits(fields):
+    return fields is None or 'splits' in fields
+
+
+def expense_payloads(rows, fields=None, split_model=ExpenseSplit):
+    # Payloads for already fetched expense rows: one more query for their
+    # splits if the fieldset includes them.
+    rows = list(rows)
+    splits = None
+    if wants_splits(fields):
+        splits = split_payloads(
+            split_rows([row['id'] for row in rows], split_model) if rows else [])
+    return build_payloads(rows, splits, fields)
+
+
+async def aexpense_payloads(rows, fields=None):
+    splits = None
+    if wants_splits(fields):
+        splits = split_payloads(
+            [split async for split in split_rows([row['id'] for row in rows])]
+            if rows else [])
+    return build_payloads(rows, splits, fields)
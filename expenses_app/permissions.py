@@ -1,5 +1,9 @@
+import hmac
+
 from rest_framework import permissions
 
+from .metrics import metrics_settings
+
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -8,6 +12,15 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
         return obj.payer == request.user
 
 
+class HasMetricsToken(permissions.BasePermission):
+    # Lets scrapers in with ``Authorization: Token <REQUEST_METRICS['TOKEN']>``
+    # instead of a staff user's JWT. Nobody gets in this way without a token.
+    def has_permission(self, request, view):
+        token = metrics_settings().get('TOKEN')
+        return bool(token) and hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Token {token}')
+
+
 # class IsSelfOrReadOnly(permissions.BasePermission):
 #     def has_object_permission(self, request, view, obj):
 #         # SAFE_METHODS are GET, HEAD or OPTIONS requests.
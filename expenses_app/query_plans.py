@@ -0,0 +1,76 @@
+import re
+from datetime import date
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import (
+    DataVersion, Expense, ExpenseSplit, GroupBalance, GroupMembership,
+    PairwiseBalance, SpendingRollup, UserBalance)
+from .versions import user_scope
+
+HOT_TABLES = [
+    Expense._meta.db_table,
+    ExpenseSplit._meta.db_table,
+    PairwiseBalance._meta.db_table,
+    UserBalance._meta.db_table,
+    DataVersion._meta.db_table,
+    SpendingRollup._meta.db_table,
+    GroupMembership._meta.db_table,
+    GroupBalance._meta.db_table,
+]
+
+
+def hot_queries(user, expense_ids):
+    # The lookups behind the user- and group-scoped endpoints and the
+    # balance ledgers.
+    group_id = GroupMembership.objects.filter(user=user).values_list(
+        'group', flat=True).first()
+    return {
+        'user_expenses': Expense.objects.filter(payer=user),
+        'user_expenses_by_date': Expense.objects.filter(
+            payer=user, date__range=(date(2023, 3, 1), date(2023, 3, 31))),
+        'expenses_by_date': Expense.objects.filter(
+            date__range=(date(2023, 3, 1), date(2023, 3, 7))),
+        # A deep keyset page, as built by pagination.ExpenseKeysetPagination.
+        'user_expenses_page': Expense.objects.filter(
+            payer=user, date__lte=date(2023, 6, 1)).filter(
+            Q(date__lt=date(2023, 6, 1)) | Q(date=date(2023, 6, 1), id__lt=1000)
+        ).order_by('-date', '-id')[:101],
+        'expense_splits': ExpenseSplit.objects.filter(expense_id__in=expense_ids),
+        'user_splits': ExpenseSplit.objects.filter(user=user),
+        'user_balance': UserBalance.objects.filter(user=user),
+        'pairwise_balances_low': PairwiseBalance.objects.filter(user_low=user),
+        'pairwise_balances_high': PairwiseBalance.objects.filter(user_high=user),
+        'data_version': DataVersion.objects.filter(scope=user_scope(user.pk)),
+        'user_spending': SpendingRollup.objects.filter(
+            user=user, day__range=(date(2023, 1, 1), date(2023, 6, 30))),
+        'global_spending': SpendingRollup.objects.filter(
+            user__isnull=True, day__range=(date(2023, 1, 1), date(2023, 6, 30))),
+        'user_groups': GroupMembership.objects.filter(user=user),
+        'group_members': GroupMembership.objects.filter(group_id=group_id),
+        'group_expenses': Expense.objects.filter(group_id=group_id),
+        'group_balances': GroupBalance.objects.filter(group_id=group_id),
+    }
+
+
+def prepare_planner():
+    # Refresh statistics and, on PostgreSQL, make sequential scans a last
+    # resort for the current transaction: a plan that still uses one has no
+    # usable index, regardless of how small the seeded tables are.
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for table in HOT_TABLES:
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(table)}')
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        elif connection.vendor == 'sqlite':
+            cursor.execute('ANALYZE')
+
+
+def sequential_scans(plan):
+    if connection.vendor == 'postgresql':
+        tables = re.findall(r'Seq Scan on (\w+)', plan)
+    else:
+        # SQLite reports full table (or full index) scans as "SCAN <table>".
+        tables = re.findall(r'\bSCAN (\w+)', plan)
+    return sorted({table for table in tables if table in HOT_TABLES})
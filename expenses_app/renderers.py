@@ -0,0 +1,42 @@
+import re
+
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_drf_default = JSONEncoder().default
+
+# orjson writes float exponents as 1e16 / 1e-7, the json module as 1e+16 /
+# 1e-07. Anything that might be one (even inside a string) goes the slow way.
+# The first pattern is a much faster scan that rules most payloads out.
+_MAYBE_EXPONENT = re.compile(rb'e[-+0-9]')
+_EXPONENT = re.compile(rb'[0-9]e[-+]?[0-9]')
+
+
+class FastJSONRenderer(JSONRenderer):
+    # JSONRenderer's exact output, encoded by orjson. Plain dicts, lists,
+    # strings and numbers (everything the expense payloads contain) are
+    # encoded in C. Anything orjson does not handle natively (Decimals,
+    # dates and datetimes, lazy strings...) goes through DRF's own encoder,
+    # so it keeps DRF's formats. Indented output, floats in exponent form
+    # and payloads orjson rejects, such as non-string keys or huge integers,
+    # fall back to JSONRenderer.
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent or self.ensure_ascii or not self.compact or not self.strict:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_drf_default,
+                               option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if _MAYBE_EXPONENT.search(ret) and _EXPONENT.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like JSONRenderer, escape the two line terminators JSON allows
+        # but JavaScript does not.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -0,0 +1,114 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from .models import (
+    ArchivedExpense, ArchivedExpenseSplit, Expense, ExpenseSplit, SpendingRollup)
+
+# The global buckets (no user) are striped over GLOBAL_STRIPES rows per day
+# and split method, so concurrent writes by unrelated users do not all queue
+# on one row lock; reads sum the stripes.
+GLOBAL_STRIPES = 16
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def new_deltas():
+    # (user id or None, day, split method) -> [paid, owed, expense count]
+    return defaultdict(lambda: [Decimal('0'), Decimal('0'), 0])
+
+
+def add_expense(deltas, expense, splits, sign, include_payment=True):
+    if include_payment:
+        for user_id in (expense.payer_id, None):
+            bucket = deltas[(user_id, expense.date, expense.split_method)]
+            bucket[0] += sign * Decimal(expense.total_amount)
+            bucket[2] += sign
+    for split in splits:
+        amount = sign * (split.amount or 0)
+        for user_id in (split.user_id, None):
+            deltas[(user_id, expense.date, expense.split_method)][1] += amount
+
+
+def update_rollups(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+    user_ids = {user_id for user_id, _, _ in deltas if user_id is not None}
+    stripe = min(user_ids, default=0) % GLOBAL_STRIPES
+    SpendingRollup.objects.bulk_create(
+        [SpendingRollup(user_id=user_id, day=day, split_method=method,
+                        stripe=stripe if user_id is None else 0)
+         for user_id, day, method in deltas],
+        ignore_conflicts=True)
+    rows = (SpendingRollup.objects.select_for_update()
+            .filter(Q(user_id__in=user_ids) | Q(user__isnull=True, stripe=stripe),
+                    day__in={day for _, day, _ in deltas})
+            .order_by('pk'))
+    changed = []
+    for row in rows:
+        delta = deltas.get((row.user_id, row.day, row.split_method))
+        if delta:
+            row.paid += delta[0]
+            row.owed += delta[1]
+            row.expense_count += delta[2]
+            changed.append(row)
+    SpendingRollup.objects.bulk_update(
+        changed, ['paid', 'owed', 'expense_count'], batch_size=500)
+
+
+def compute_rollups():
+    # Derive the buckets from the expense data, live and archived, with
+    # grouped aggregates.
+    deltas = new_deltas()
+    for expense_model, split_model in [(Expense, ExpenseSplit),
+                                       (ArchivedExpense, ArchivedExpenseSplit)]:
+        paid = (expense_model.objects.order_by()
+                .values_list('payer', 'date', 'split_method')
+                .annotate(total=Sum('total_amount'), count=Count('id')))
+        for payer_id, day, method, total, count in paid:
+            for user_id in (payer_id, None):
+                bucket = deltas[(user_id, day, method)]
+                bucket[0] += total
+                bucket[2] += count
+        owed = (split_model.objects.order_by()
+                .values_list('user', 'expense__date', 'expense__split_method')
+                .annotate(total=Sum('amount')))
+        for user_id, day, method, total in owed:
+            deltas[(user_id, day, method)][1] += total or 0
+            deltas[(None, day, method)][1] += total or 0
+    return {key: delta for key, delta in deltas.items() if any(delta)}
+
+
+def spending(user=None, start_date=None, end_date=None, granularity='month'):
+    rows = SpendingRollup.objects.filter(user=user) if user else \
+        SpendingRollup.objects.filter(user__isnull=True)
+    if start_date:
+        rows = rows.filter(day__gte=start_date)
+    if end_date:
+        rows = rows.filter(day__lte=end_date)
+    rows = (rows.exclude(paid=0, owed=0, expense_count=0)
+            .annotate(period=PERIODS[granularity]('day'))
+            .values_list('period', 'split_method')
+            .annotate(paid=Sum('paid'), owed=Sum('owed'),
+                      expense_count=Sum('expense_count'))
+            .order_by('period', 'split_method'))
+
+    periods = {}
+    for period, method, paid, owed, expense_count in rows:
+        bucket = periods.setdefault(period, {
+            'period': period, 'paid': Decimal('0'), 'owed': Decimal('0'),
+            'expense_count': 0, 'by_split_method': {},
+        })
+        bucket['paid'] += paid
+        bucket['owed'] += owed
+        bucket['expense_count'] += expense_count
+        bucket['by_split_method'][method] = {
+            'paid': paid, 'owed': owed, 'expense_count': expense_count}
+    return list(periods.values())
@@ -0,0 +1,94 @@
+import contextvars
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+# Alias the current request's reads are routed to, set only while a
+# safe-method ExpenseViewSet action or an async read view runs. Everything
+# else, including all writes, uses the default database.
+_read_alias = contextvars.ContextVar('expenses_read_alias', default=None)
+
+
+def replica_settings():
+    return {'ALIAS': 'replica', 'STICKY_SECONDS': 10, 'CACHE': 'default',
+            **getattr(settings, 'READ_REPLICA', {})}
+
+
+def replica_alias():
+    # None when no replica database is configured.
+    alias = replica_settings()['ALIAS']
+    return alias if alias in settings.DATABASES else None
+
+
+def sticky_key(user_id):
+    return f"expenses_app:last-write:{user_id}"
+
+
+def mark_write(user):
+    # Keeps the user's reads on the primary for STICKY_SECONDS, so they see
+    # their own writes even while the replica lags behind.
+    options = replica_settings()
+    if replica_alias() is None or not user.is_authenticated:
+        return
+    caches[options['CACHE']].set(
+        sticky_key(user.pk), True, timeout=options['STICKY_SECONDS'])
+
+
+def read_alias_for(user):
+    # The replica, unless there is none or the user wrote recently.
+    alias = replica_alias()
+    if alias is None:
+        return None
+    if user.is_authenticated and caches[replica_settings()['CACHE']].get(
+            sticky_key(user.pk)) is not None:
+        return None
+    return alias
+
+
+async def aread_alias_for(user):
+    alias = replica_alias()
+    if alias is None:
+        return None
+    if user.is_authenticated and await caches[replica_settings()['CACHE']].aget(
+            sticky_key(user.pk)) is not None:
+        return None
+    return alias
+
+
+def route_reads(alias):
+    # Returns a token for reset_reads().
+    return _read_alias.set(alias)
+
+
+def reset_reads(token):
+    _read_alias.reset(token)
+
+
+class ReadReplicaRouter:
+    # Sends reads to the alias chosen for the current request and leaves
+    # everything else to the default database. Migrations only run on the
+    # primary; the replica gets the schema through replication (and is a
+    # TEST MIRROR of default in tests).
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related lookups follow the object they start from.
+            return instance._state.db
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_alias():
+            return False
+        return None
@@ -1,10 +1,19 @@
+import copy
+import logging
 from rest_framework import serializers
-from decimal import Decimal, ROUND_HALF_UP
+from rest_framework.exceptions import NotFound
+from django.conf import settings
 from django.db import transaction
-from .models import User, Expense, ExpenseSplit
+from .models import User, Expense, ExpenseSplit, Group, GroupMembership
+from . import ledger
+from .exporters import CSV_EXPORT_COLUMNS
+from .metrics import TimedSerializerMixin
+from .splits import plan_expenses
 
+logger = logging.getLogger(__name__)
 
-class UserSerializer(serializers.ModelSerializer):
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'name', 'mobile_number', 'password']
@@ -26,7 +35,57 @@ class UserSerializer(serializers.ModelSerializer):
         return value
 
 
+# Used by the bulk onboarding action, which checks email and mobile number
+# uniqueness for the whole batch at once instead of per record.
+class BulkUserSerializer(UserSerializer):
+    class Meta(UserSerializer.Meta):
+        extra_kwargs = {
+            'password': {'write_only': True},
+            'email': {'validators': []},
+            'mobile_number': {
+                'validators': User._meta.get_field('mobile_number').validators},
+        }
+
+    def validate_email(self, value):
+        return value
+
+    def validate_mobile_number(self, value):
+        return value
+
+
+# Resolves users from a ``users`` dict in the serializer context when one is
+# given, so bulk paths can load every referenced user in a single query.
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    model = User
+    context_key = 'users'
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('queryset', self.model.objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        objects = self.context.get(self.context_key)
+        if objects is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            obj = objects.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+# Same, from a ``groups`` dict in the context.
+class GroupPrimaryKeyRelatedField(UserPrimaryKeyRelatedField):
+    model = Group
+    context_key = 'groups'
+
+
 class ExpenseSplitSerializer(serializers.ModelSerializer):
+    user = UserPrimaryKeyRelatedField()
     percentage = serializers.DecimalField(
         max_digits=5, decimal_places=2, required=False, allow_null=True)
     amount = serializers.DecimalField(
@@ -37,103 +96,241 @@ class ExpenseSplitSerializer(serializers.ModelSerializer):
         fields = ['user', 'amount', 'percentage']
 
 
-class ExpenseSerializer(serializers.ModelSerializer):
+class ExpenseSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    payer = UserPrimaryKeyRelatedField()
+    group = GroupPrimaryKeyRelatedField(required=False, allow_null=True)
+    # Stored as integer cents; declared so the API keeps its decimal format.
+    total_amount = serializers.DecimalField(max_digits=10, decimal_places=2)
     splits = ExpenseSplitSerializer(many=True)
 
     class Meta:
         model = Expense
-        fields = ['id', 'payer', 'total_amount',
+        fields = ['id', 'payer', 'group', 'total_amount',
                   'split_method', 'description', 'date', 'splits']
 
+    def __init__(self, *args, fields=None, **kwargs):
+        # ``fields`` limits the representation to a sparse fieldset (see
+        # sparse_fields).
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def validate_group_members(self, data):
+        # The payer, every participant and the user making the change must
+        # all belong to the expense's group. Bulk callers can pass the
+        # members of every referenced group as ``group_members`` in the
+        # context ({group id: set of user ids}).
+        group = data.get('group', getattr(self.instance, 'group', None))
+        if group is None:
+            return
+        user_ids = {data['payer'].pk if 'payer' in data else self.instance.payer_id}
+        if 'splits' in data:
+            user_ids.update(split['user'].pk for split in data['splits'])
+        else:
+            user_ids.update(split.user_id for split in self.instance.splits.all())
+        request = self.context.get('request')
+        acting_user = request.user if request is not None else self.context.get('user')
+        if acting_user is not None:
+            user_ids.add(acting_user.pk)
+
+        members = self.context.get('group_members', {}).get(group.pk)
+        if members is None:
+            members = set(GroupMembership.objects.filter(
+                group=group, user_id__in=user_ids).values_list('user_id', flat=True))
+        outsiders = sorted(user_ids - members)
+        if outsiders:
+            raise serializers.ValidationError({'group': [
+                f"Users {', '.join(map(str, outsiders))} are not members of this group."]})
+
     def validate(self, data):
-        splits_data = data.get('splits', [])
-        total_amount = Decimal(data.get('total_amount', 0))
-        split_method = data.get('split_method')
-
-        print(f"Debug: split_method={split_method}")  # Debugging print
-        print(f"Debug: splits_data={splits_data}")  # Debugging print
-
-        if split_method == 'equal':
-            if not splits_data:
-                raise serializers.ValidationError(
-                    "Splits data is required for equal split.")
-            if len(splits_data) < 1:
-                raise serializers.ValidationError(
-                    "At least one split is required for equal split.")
-            equal_amount = total_amount / len(splits_data)
-            for split in splits_data:
-                amount = Decimal(split.get('amount', 0))
-                if amount and amount != equal_amount:
-                    raise serializers.ValidationError(
-                        "Each participant must have an equal amount in an equal split.")
-                if split.get('percentage') is not None:
-                    raise serializers.ValidationError(
-                        "Percentage should be null for equal split method.")
-
-        elif split_method == 'exact':
-            total_split_amount = sum(Decimal(split.get('amount', 0))
-                                     for split in splits_data)
-            if total_split_amount != total_amount:
-                raise serializers.ValidationError(
-                    "The sum of exact amounts must equal the total amount.")
-            for split in splits_data:
-                if split.get('percentage') is not None:
-                    raise serializers.ValidationError(
-                        "Percentage should be null for exact split method.")
-
-        elif split_method == 'percentage':
-            total_percentage = Decimal('0.00')
-            for split in splits_data:
-                percentage = Decimal(split.get('percentage', '0.00'))
-                print(f"Debug: percentage={percentage}")  # Debugging print
-                if percentage < 0 or percentage > 100:
-                    raise serializers.ValidationError(
-                        "Percentage must be between 0 and 100.")
-                total_percentage += percentage
-
-            # Debugging print
-            print(f"Debug: total_percentage={total_percentage}")
-
-            if not (Decimal('99.99') <= total_percentage <= Decimal('100.01')):
-                raise serializers.ValidationError(
-                    "The sum of percentages must equal 100%.")
-            for split in splits_data:
-                if split.get('amount') is not None:
-                    raise serializers.ValidationError(
-                        "Amount should be null for percentage split method.")
+        # Split rules are checked and amounts allocated by splits.plan_expenses.
+        # Bulk callers pass ``plan_splits=False`` in the context and plan the
+        # whole batch in one call instead.
+        if 'splits' in data and self.context.get('plan_splits', True):
+            split_method = data.get(
+                'split_method', getattr(self.instance, 'split_method', None))
+            total_amount = data.get(
+                'total_amount', getattr(self.instance, 'total_amount', 0))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Planning expense splits", extra={
+                    'split_method': split_method, 'split_count': len(data['splits'])})
+
+            [(planned, error)] = plan_expenses(
+                [(split_method, total_amount, data['splits'])])
+            if error:
+                raise serializers.ValidationError(error)
+            data['splits'] = planned
+
+        if self.partial and 'splits' not in data and (
+                'total_amount' in data or 'split_method' in data):
+            raise serializers.ValidationError(
+                "Splits are required when changing the total amount or split method.")
 
+        self.validate_group_members(data)
         return data
 
     def create(self, validated_data):
         splits_data = validated_data.pop('splits')
         with transaction.atomic():
             expense = Expense.objects.create(**validated_data)
-
-            if expense.split_method == 'percentage':
-                # Calculate amounts from percentages
-                for split_data in splits_data:
-                    percentage = Decimal(split_data.get('percentage', '0.00'))
-                    amount = (percentage / 100) * Decimal(expense.total_amount)
-                    split_data['amount'] = amount
-                    split_data['percentage'] = percentage
-
-            elif expense.split_method == 'equal':
-                # Calculate amounts for equal split
-                amount = Decimal(expense.total_amount) / len(splits_data)
-                for split_data in splits_data:
-                    split_data['amount'] = amount
-                    split_data['percentage'] = (
-                        amount / Decimal(expense.total_amount)) * 100
-
-            elif expense.split_method == 'exact':
-                # Calculate percentages from amounts
-                total_amount = Decimal(expense.total_amount)
-                for split_data in splits_data:
-                    amount = Decimal(split_data.get('amount', '0.00'))
-                    percentage = (amount / total_amount) * 100
-                    split_data['percentage'] = percentage
-
-            for split_data in splits_data:
-                ExpenseSplit.objects.create(expense=expense, **split_data)
+            splits = save_splits(expense, splits_data)
+            ledger.record_expenses([(expense, splits)])
 
         return expense
+
+    def update(self, instance, validated_data):
+        splits_data = validated_data.pop('splits', None)
+        with transaction.atomic():
+            # Re-read the row under a lock: ``instance`` was loaded before the
+            # transaction, and a concurrent update, delete or archive would
+            # otherwise leave the ledger working from stale values.
+            instance = Expense.objects.select_for_update().filter(pk=instance.pk).first()
+            if instance is None:
+                raise NotFound()
+            previous = copy.copy(instance)
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+
+            instance.save()
+            old_splits = list(
+                ExpenseSplit.objects.select_for_update().filter(expense=instance))
+            if splits_data is not None:
+                instance.splits.all().delete()
+                new_splits = save_splits(instance, splits_data)
+            else:
+                new_splits = old_splits
+            ledger.apply_changes(
+                [(previous, old_splits)], [(instance, new_splits)])
+
+        return instance
+
+
+class GroupSerializer(serializers.ModelSerializer):
+    # Members other than the creator can be given when the group is created;
+    # later additions go through the members action.
+    members = UserPrimaryKeyRelatedField(many=True, required=False)
+
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'members', 'created_by', 'created_at']
+        read_only_fields = ['created_by', 'created_at']
+
+    def create(self, validated_data):
+        creator = self.context['request'].user
+        members = {user.pk: user for user in validated_data.pop('members', [])}
+        members[creator.pk] = creator
+        with transaction.atomic():
+            group = Group.objects.create(created_by=creator, **validated_data)
+            GroupMembership.objects.bulk_create(
+                [GroupMembership(group=group, user=user) for user in members.values()])
+        return group
+
+
+class GroupMemberSerializer(serializers.Serializer):
+    user = UserPrimaryKeyRelatedField()
+
+
+class SparseFieldsQuerySerializer(serializers.Serializer):
+    fields = serializers.CharField(required=False)
+    exclude = serializers.CharField(required=False)
+
+    def validate_field_names(self, value):
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in ExpenseSerializer.Meta.fields]
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown fields: {', '.join(unknown)}. "
+                f"Choose from: {', '.join(ExpenseSerializer.Meta.fields)}.")
+        return names
+
+    def validate_fields(self, value):
+        return self.validate_field_names(value)
+
+    def validate_exclude(self, value):
+        return self.validate_field_names(value)
+
+
+def sparse_fields(query_params):
+    # The expense fields selected by ``fields=`` and/or ``exclude=`` query
+    # parameters (comma separated), or None when neither is given.
+    params = SparseFieldsQuerySerializer(data=query_params)
+    params.is_valid(raise_exception=True)
+    if not params.validated_data:
+        return None
+    fields = params.validated_data.get('fields', ExpenseSerializer.Meta.fields)
+    exclude = params.validated_data.get('exclude', [])
+    return [name for name in ExpenseSerializer.Meta.fields
+            if name in fields and name not in exclude]
+
+
+class ExpenseExportSerializer(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    columns = serializers.CharField(required=False)
+
+    def validate_columns(self, value):
+        columns = [column.strip() for column in value.split(',') if column.strip()]
+        unknown = [column for column in columns if column not in CSV_EXPORT_COLUMNS]
+        if unknown:
+            raise serializers.ValidationError(
+                f"Unknown columns: {', '.join(unknown)}. "
+                f"Choose from: {', '.join(CSV_EXPORT_COLUMNS)}.")
+        if not columns:
+            raise serializers.ValidationError("At least one column is required.")
+        return columns
+
+
+class BalanceSheetQuerySerializer(serializers.Serializer):
+    summary_only = serializers.BooleanField(default=False)
+    group_by = serializers.ChoiceField(choices=['month'], required=False)
+
+
+class SplitMethodTotalSerializer(serializers.Serializer):
+    total = serializers.DecimalField(max_digits=14, decimal_places=2)
+    count = serializers.IntegerField()
+
+
+class MonthlyTotalSerializer(serializers.Serializer):
+    month = serializers.DateField(format='%Y-%m')
+    total = serializers.DecimalField(max_digits=14, decimal_places=2)
+    count = serializers.IntegerField()
+
+
+class BalanceSummarySerializer(TimedSerializerMixin, serializers.Serializer):
+    total_expenses = serializers.DecimalField(max_digits=14, decimal_places=2)
+    expense_count = serializers.IntegerField()
+    by_split_method = serializers.DictField(child=SplitMethodTotalSerializer())
+    by_month = MonthlyTotalSerializer(many=True, required=False)
+
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    granularity = serializers.ChoiceField(
+        choices=['day', 'week', 'month'], default='month')
+    scope = serializers.ChoiceField(choices=['user', 'global'], default='user')
+
+
+class ChangeFeedQuerySerializer(serializers.Serializer):
+    # ``cursor`` is the id of the last change the client has seen.
+    cursor = serializers.IntegerField(min_value=0, required=False)
+    timeout = serializers.FloatField(min_value=0, required=False)
+
+
+class SpendingTotalSerializer(serializers.Serializer):
+    paid = serializers.DecimalField(max_digits=14, decimal_places=2)
+    owed = serializers.DecimalField(max_digits=14, decimal_places=2)
+    expense_count = serializers.IntegerField()
+
+
+class SpendingPeriodSerializer(TimedSerializerMixin, SpendingTotalSerializer):
+    period = serializers.DateField()
+    by_split_method = serializers.DictField(child=SpendingTotalSerializer())
+
+
+def save_splits(expense, splits_data):
+    splits = [ExpenseSplit(expense=expense, **split_data)
+              for split_data in splits_data]
+    return ExpenseSplit.objects.bulk_create(
+        splits, batch_size=settings.EXPENSE_SPLIT_BATCH_SIZE)
@@ -0,0 +1,28 @@
+import heapq
+
+
+def settle_up(net_balances):
+    # Greedy settlement plan: repeatedly match the largest creditor with the
+    # largest debtor. Every transfer clears at least one of them, so there
+    # are at most n - 1 transfers and the whole plan costs O(n log n).
+    # ``net_balances`` maps user ids to their net position (positive when
+    # they are owed money); returns (debtor, creditor, amount) transfers.
+    creditors = [(-amount, user_id)
+                 for user_id, amount in net_balances.items() if amount > 0]
+    debtors = [(amount, user_id)
+               for user_id, amount in net_balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        credit, debt = -credit, -debt
+        amount = min(credit, debt)
+        transfers.append((debtor, creditor, amount))
+        if credit > amount:
+            heapq.heappush(creditors, (amount - credit, creditor))
+        if debt > amount:
+            heapq.heappush(debtors, (amount - debt, debtor))
+    return transfers
@@ -0,0 +1,191 @@
+import numpy as np
+
+from . import money
+
+# Split planning for whole batches of expenses at once. Expenses are laid
+# out as columns (one entry per expense, one per split) and validated and
+# allocated with array operations, so the cost per split is a few machine
+# instructions instead of a round of Decimal arithmetic. The serializer
+# plans single expenses through the same code.
+
+METHODS = ('equal', 'exact', 'percentage')
+EQUAL, EXACT, PERCENTAGE = range(len(METHODS))
+METHOD_CODES = {method: code for code, method in enumerate(METHODS)}
+
+# Error codes in the order the checks run; an expense reports the first
+# check it fails. Code 0 means the expense is valid.
+ERRORS = [
+    None,
+    "Invalid split method.",
+    "Splits data is required for equal split.",
+    "Each participant must have an equal amount in an equal split.",
+    "Percentage should be null for equal split method.",
+    "The sum of exact amounts must equal the total amount.",
+    "Percentage should be null for exact split method.",
+    "Percentage must be between 0 and 100.",
+    "The sum of percentages must equal 100%.",
+    "Amount should be null for percentage split method.",
+]
+(_, INVALID_METHOD, EQUAL_REQUIRED, EQUAL_SHARE, EQUAL_PERCENTAGE, EXACT_SUM,
+ EXACT_PERCENTAGE, PERCENTAGE_RANGE, PERCENTAGE_SUM, PERCENTAGE_AMOUNT) = range(len(ERRORS))
+
+# Percentages are handled in hundredths; totals may be off by a rounding
+# step either way.
+PERCENTAGE_SUM_RANGE = (9999, 10001)
+
+
+class SplitBatch:
+    # Columnar input. Per expense: ``methods`` (codes from METHOD_CODES, -1
+    # for anything else), ``totals`` in cents and ``counts`` of splits. Per
+    # split: ``amounts`` in cents and ``percentages`` in hundredths, each
+    # with a mask saying whether the client gave a value.
+
+    def __init__(self, methods, totals, counts, amounts, amount_given,
+                 percentages, percentage_given):
+        self.methods = np.asarray(methods, dtype=np.int8)
+        self.totals = np.asarray(totals, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.amounts = np.asarray(amounts, dtype=np.int64)
+        self.amount_given = np.asarray(amount_given, dtype=bool)
+        self.percentages = np.asarray(percentages, dtype=np.int64)
+        self.percentage_given = np.asarray(percentage_given, dtype=bool)
+
+    @classmethod
+    def from_expenses(cls, expenses):
+        # ``expenses`` yields (split_method, total_amount, splits_data) with
+        # splits as dicts that may hold 'amount' and 'percentage'.
+        methods, totals, counts = [], [], []
+        amounts, amount_given, percentages, percentage_given = [], [], [], []
+        for split_method, total_amount, splits_data in expenses:
+            methods.append(METHOD_CODES.get(split_method, -1))
+            totals.append(money.to_cents(total_amount))
+            counts.append(len(splits_data))
+            for split_data in splits_data:
+                amount = split_data.get('amount')
+                amounts.append(0 if amount is None else money.to_cents(amount))
+                amount_given.append(amount is not None)
+                percentage = split_data.get('percentage')
+                percentages.append(0 if percentage is None else money.to_cents(percentage))
+                percentage_given.append(percentage is not None)
+        return cls(methods, totals, counts, amounts, amount_given,
+                   percentages, percentage_given)
+
+
+class SplitPlan:
+    # Per split ``amounts`` in cents and ``percentages`` in hundredths
+    # (meaningful where ``has_percentage``); per expense ``error_codes``.
+
+    def __init__(self, starts, counts, amounts, percentages, has_percentage, error_codes):
+        self.starts = starts
+        self.counts = counts
+        self.amounts = amounts
+        self.percentages = percentages
+        self.has_percentage = has_percentage
+        self.error_codes = error_codes
+
+    def error(self, index):
+        return ERRORS[self.error_codes[index]]
+
+    def splits(self, index, splits_data):
+        # Copies of one valid expense's splits with amount and percentage
+        # filled in as Decimals.
+        return self.all_splits([(index, splits_data)])[0]
+
+    def all_splits(self, expenses):
+        # Like ``splits`` for many (index, splits_data) pairs. Arrays are
+        # turned into lists once, since indexing numpy scalars one at a time
+        # would cost more than the planning itself.
+        starts, amounts, percentages, has_percentage = (
+            self.starts.tolist(), self.amounts.tolist(),
+            self.percentages.tolist(), self.has_percentage.tolist())
+        from_cents = money.from_cents
+        return [
+            [{**split_data,
+              'amount': from_cents(amounts[offset]),
+              'percentage': from_cents(percentages[offset]) if has_percentage[offset] else None}
+             for offset, split_data in enumerate(splits_data, starts[index])]
+            for index, splits_data in expenses
+        ]
+
+
+def segment_sum(values, starts, counts):
+    # Sum of each expense's run of splits; empty runs sum to 0.
+    sums = np.zeros(len(counts), dtype=values.dtype)
+    nonempty = counts > 0
+    if values.size:
+        sums[nonempty] = np.add.reduceat(values, starts[nonempty])
+    return sums
+
+
+def plan(batch):
+    methods, totals, counts = batch.methods, batch.totals, batch.counts
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    owner = np.repeat(np.arange(len(counts)), counts)
+    split_methods = methods[owner]
+    errors = np.zeros(len(counts), dtype=np.int8)
+
+    def fail(mask, code):
+        errors[(errors == 0) & mask] = code
+
+    def any_split(mask):
+        return segment_sum(mask.astype(np.int64), starts, counts) > 0
+
+    # Largest-remainder allocation of equal and percentage splits: floor
+    # every share, then hand the leftover cents of each expense to its
+    # largest remainders, earlier splits first on ties.
+    weights = np.where(split_methods == EQUAL, 1,
+                       np.where(split_methods == PERCENTAGE, batch.percentages, 0))
+    total_weights = segment_sum(weights, starts, counts)
+    total_weights[total_weights <= 0] = 1
+    numerators = totals[owner] * weights
+    shares, remainders = np.divmod(numerators, total_weights[owner])
+    leftovers = totals - segment_sum(shares, starts, counts)
+    order = np.lexsort((np.arange(len(owner)), -remainders, owner))
+    ranks = np.empty(len(owner), dtype=np.int64)
+    ranks[order] = np.arange(len(owner)) - starts[owner[order]]
+    shares += ranks < leftovers[owner]
+    amounts = np.where(split_methods == EXACT, batch.amounts, shares)
+
+    equal, exact, percentage = (methods == EQUAL), (methods == EXACT), (methods == PERCENTAGE)
+    fail(methods < 0, INVALID_METHOD)
+    fail(equal & (counts == 0), EQUAL_REQUIRED)
+    # An amount given for an equal split must match the allocated share.
+    fail(equal & any_split(batch.amount_given & (batch.amounts != 0)
+                           & (batch.amounts != amounts)), EQUAL_SHARE)
+    fail(equal & any_split(batch.percentage_given), EQUAL_PERCENTAGE)
+    fail(exact & (segment_sum(batch.amounts, starts, counts) != totals), EXACT_SUM)
+    fail(exact & any_split(batch.percentage_given), EXACT_PERCENTAGE)
+    fail(percentage & any_split((batch.percentages < 0) | (batch.percentages > 10000)),
+         PERCENTAGE_RANGE)
+    percentage_sums = segment_sum(batch.percentages, starts, counts)
+    fail(percentage & ((percentage_sums < PERCENTAGE_SUM_RANGE[0])
+                       | (percentage_sums > PERCENTAGE_SUM_RANGE[1])), PERCENTAGE_SUM)
+    fail(percentage & any_split(batch.amount_given), PERCENTAGE_AMOUNT)
+
+    # Percentages of the total in hundredths, rounded half up, except for
+    # percentage splits which keep the ones given.
+    split_totals = totals[owner]
+    safe_totals = np.where(split_totals == 0, 1, split_totals)
+    derived = (amounts * 20000 // safe_totals + 1) // 2
+    percentages = np.where(split_methods == PERCENTAGE, batch.percentages, derived)
+    has_percentage = (split_methods == PERCENTAGE) | (split_totals != 0)
+    return SplitPlan(starts, counts, amounts, percentages, has_percentage, errors)
+
+
+def plan_expenses(expenses):
+    # Row-oriented wrapper: plans (split_method, total_amount, splits_data)
+    # tuples and returns (planned splits, None) or (None, error message) for
+    # each.
+    expenses = list(expenses)
+    if not expenses:
+        return []
+    result = plan(SplitBatch.from_expenses(expenses))
+    error_codes = result.error_codes.tolist()
+    planned = iter(result.all_splits(
+        (index, splits_data) for index, (_, _, splits_data) in enumerate(expenses)
+        if not error_codes[index]))
+    return [
+        (None, ERRORS[code]) if code else (next(planned), None)
+        for code in error_codes
+    ]
@@ -0,0 +1,66 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+
+from . import ledger
+from .models import User, Expense, ExpenseSplit, Group, GroupMembership
+from .splits import plan_expenses
+
+
+def seed_dataset(users=100, expenses=1000, splits_per_expense=4, seed=0,
+                 start_date=date(2023, 1, 1), days=365, batch_size=1000,
+                 groups=0):
+    # Synthetic users and equally split expenses for benchmarks and query
+    # plan checks. Writes go through the ledger like real expenses do. With
+    # ``groups`` the users are dealt round robin into that many groups and
+    # every expense is shared within one of them.
+    rng = random.Random(seed)
+    token = f"{rng.getrandbits(32):08x}"
+    mobile_base = rng.randrange(10 ** 9, 9 * 10 ** 9)
+    seeded_users = User.objects.bulk_create([
+        User(email=f"seed-{token}-{i}@example.invalid", name=f"Seed User {i}",
+             mobile_number=f"{mobile_base + i:010d}", password='!')
+        for i in range(users)
+    ], batch_size=batch_size)
+
+    circles = [(None, seeded_users)]
+    if groups:
+        seeded_groups = Group.objects.bulk_create([
+            Group(name=f"Seed Group {token} {i}") for i in range(groups)])
+        circles = [(group, seeded_users[i::groups])
+                   for i, group in enumerate(seeded_groups)]
+        GroupMembership.objects.bulk_create(
+            [GroupMembership(group=group, user=user)
+             for group, members in circles for user in members],
+            batch_size=batch_size)
+        circles = [(group, members) for group, members in circles if members]
+
+    for offset in range(0, expenses, batch_size):
+        count = min(batch_size, expenses - offset)
+        with transaction.atomic():
+            sharing = [rng.choice(circles) for _ in range(count)]
+            created = Expense.objects.bulk_create([
+                Expense(payer=rng.choice(members), group=group,
+                        total_amount=Decimal(rng.randrange(100, 100000)) / 100,
+                        split_method='equal', description='Synthetic expense',
+                        date=start_date + timedelta(days=rng.randrange(days)))
+                for group, members in sharing
+            ])
+            planned = plan_expenses(
+                (expense.split_method, expense.total_amount,
+                 [{'user': user} for user in
+                  rng.sample(members, min(splits_per_expense, len(members)))])
+                for expense, (_, members) in zip(created, sharing))
+            entries = [
+                (expense, [ExpenseSplit(expense=expense, **split_data)
+                           for split_data in splits_data])
+                for expense, (splits_data, _) in zip(created, planned)
+            ]
+            ExpenseSplit.objects.bulk_create(
+                [split for _, splits in entries for split in splits],
+                batch_size=settings.EXPENSE_SPLIT_BATCH_SIZE)
+            ledger.record_expenses(entries)
+    return seeded_users
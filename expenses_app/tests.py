@@ -1,11 +1,50 @@
-from rest_framework.test import APITestCase
+import asyncio
+import json
+from datetime import date
+from decimal import Decimal
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import Future
+from io import StringIO
+from unittest import addModuleCleanup, mock, skipUnless
+from asgiref.sync import async_to_sync, sync_to_async
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
-from .models import Expense, ExpenseSplit
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+from . import (
+    balance_sheets, changes, conditional, metrics, money, payloads, routers, serializers,
+    splits)
+from .authentication import CachedJWTAuthentication, UserCache, get_user_cache
+from .models import (
+    ArchivedExpense, ArchivedExpenseSplit, ArchivedExpenseSummary, Expense, ExpenseChange,
+    ExpenseSplit, GroupBalance, IdempotencyKey, SpendingRollup, UserBalance)
+from .renderers import FastJSONRenderer
+from .settlement import settle_up
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import caches
+from django.db import connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 User = get_user_model()  # This gets your custom user model
 
 
+def setUpModule():
+    # Test transactions are only visible on the default connection, so reads
+    # stay there except in ReplicaDatabaseTests.
+    replica = override_settings(READ_REPLICA={'ALIAS': None})
+    replica.enable()
+    addModuleCleanup(replica.disable)
+
+
 class ExpenseTests(APITestCase):
 
     def setUp(self):
@@ -174,3 +213,1703 @@ class ExpenseTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         response_data = response.json()
         self.assertIn('The sum of percentages must equal 100%.', response_data)
+
+
+class ExpenseSplitPersistenceTests(APITestCase):
+
+    def setUp(self):
+        self.users = [
+            User.create_user(
+                email=f'member{i}@example.com', name=f'Member {i}',
+                mobile_number=f'{i:010d}')
+            for i in range(1, 51)
+        ]
+        self.client.force_authenticate(self.users[0])
+
+    def split_inserts(self, queries):
+        return [q for q in queries
+                if q['sql'].startswith('INSERT INTO "expenses_app_expensesplit"')]
+
+    def test_create_writes_splits_in_one_insert(self):
+        data = {
+            'payer': self.users[0].id,
+            'total_amount': '5000.00',
+            'split_method': 'equal',
+            'description': 'Offsite',
+            'date': '2024-08-25',
+            'splits': [{'user': user.id} for user in self.users],
+        }
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/expenses/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.split_inserts(ctx.captured_queries)), 1)
+        splits = ExpenseSplit.objects.filter(expense_id=response.json()['id'])
+        self.assertEqual(splits.count(), 50)
+        self.assertTrue(all(split.amount == 100 for split in splits))
+
+    def test_update_replaces_splits_in_one_insert(self):
+        data = {
+            'payer': self.users[0].id,
+            'total_amount': '100.00',
+            'split_method': 'equal',
+            'description': 'Lunch',
+            'date': '2024-08-25',
+            'splits': [{'user': user.id} for user in self.users[:2]],
+        }
+        expense_id = self.client.post(
+            '/api/expenses/', data, format='json').json()['id']
+
+        data.update({
+            'total_amount': '600.00',
+            'split_method': 'percentage',
+            'splits': [{'user': user.id, 'percentage': '2.00'} for user in self.users],
+        })
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.put(
+                f'/api/expenses/{expense_id}/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.split_inserts(ctx.captured_queries)), 1)
+        splits = ExpenseSplit.objects.filter(expense_id=expense_id)
+        self.assertEqual(splits.count(), 50)
+        self.assertTrue(all(split.amount == 12 for split in splits))
+
+    def test_partial_update_of_total_requires_splits(self):
+        data = {
+            'payer': self.users[0].id,
+            'total_amount': '100.00',
+            'split_method': 'equal',
+            'date': '2024-08-25',
+            'splits': [{'user': user.id} for user in self.users[:2]],
+        }
+        expense_id = self.client.post(
+            '/api/expenses/', data, format='json').json()['id']
+        response = self.client.patch(
+            f'/api/expenses/{expense_id}/', {'total_amount': '300.00'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_destroy_removes_splits(self):
+        data = {
+            'payer': self.users[0].id,
+            'total_amount': '100.00',
+            'split_method': 'equal',
+            'date': '2024-08-25',
+            'splits': [{'user': user.id} for user in self.users],
+        }
+        expense_id = self.client.post(
+            '/api/expenses/', data, format='json').json()['id']
+        response = self.client.delete(f'/api/expenses/{expense_id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Expense.objects.filter(id=expense_id).exists())
+        self.assertFalse(ExpenseSplit.objects.filter(expense_id=expense_id).exists())
+
+
+class ExpenseBulkImportTests(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.client.force_authenticate(self.user1)
+
+    def upload(self, name, content):
+        return self.client.post(
+            '/api/expenses/bulk-import/',
+            {'file': SimpleUploadedFile(name, content.encode())},
+            format='multipart')
+
+    def test_jsonl_import_reports_row_errors(self):
+        rows = [
+            {'payer': self.user1.id, 'total_amount': '100.00', 'split_method': 'equal',
+             'date': '2024-08-25', 'splits': [{'user': self.user1.id}, {'user': self.user2.id}]},
+            {'payer': 999, 'total_amount': '100.00', 'split_method': 'equal',
+             'date': '2024-08-25', 'splits': [{'user': self.user1.id}]},
+            {'payer': self.user2.id, 'total_amount': '90.00', 'split_method': 'exact',
+             'date': '2024-08-26', 'splits': [{'user': self.user1.id, 'amount': '90.00'}]},
+        ]
+        content = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        response = self.upload('expenses.jsonl', content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()
+        self.assertEqual(result['created'], 2)
+        self.assertEqual([error['row'] for error in result['errors']], [2, 4])
+        self.assertIn('payer', result['errors'][0]['errors'])
+        self.assertEqual(ExpenseSplit.objects.count(), 3)
+
+    def test_csv_import(self):
+        content = (
+            'payer,total_amount,split_method,description,date,splits\n'
+            f'{self.user1.id},300.00,percentage,Party,2024-08-25,'
+            f'{self.user1.id}:50;{self.user2.id}:50\n'
+            f'{self.user1.id},300.00,exact,Shopping,2024-08-25,'
+            f'{self.user1.id}:100.00;{self.user2.id}:100.00\n'
+        )
+        response = self.upload('expenses.csv', content)
+        result = response.json()
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(result['errors'][0]['errors'], {
+            'non_field_errors': ["The sum of exact amounts must equal the total amount."]})
+        expense = Expense.objects.get()
+        self.assertEqual(
+            sorted(split.amount for split in expense.splits.all()), [150, 150])
+
+    def test_invalid_utf8_is_reported_as_a_row_error(self):
+        row = json.dumps({
+            'payer': self.user1.id, 'total_amount': '10.00', 'split_method': 'equal',
+            'date': '2024-08-25', 'splits': [{'user': self.user1.id}]}).encode()
+        response = self.client.post('/api/expenses/bulk-import/', {
+            'file': SimpleUploadedFile('expenses.jsonl', row + b'\n\xff\xfe\n' + row + b'\n'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['errors'], [
+            {'row': 2, 'errors': ["Invalid UTF-8 at byte 0: invalid start byte."]}])
+
+        header = b'payer,total_amount,split_method,description,date,splits\n'
+        line = f'{self.user1.id},10.00,equal,Café,2024-08-25,{self.user1.id}\n'.encode()
+        response = self.client.post('/api/expenses/bulk-import/', {
+            'file': SimpleUploadedFile(
+                'expenses.csv', header + line + line.replace(b'\xc3\xa9', b'\xe9') + line),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([error['row'] for error in result['errors']], [3])
+        self.assertIn('The rest of the file was not read.', result['errors'][0]['errors'][0])
+        self.assertEqual(Expense.objects.count(), 3)
+
+    def test_unknown_file_type(self):
+        response = self.upload('expenses.xlsx', '')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExpenseQueryBudgetTests(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.client.force_authenticate(self.user1)
+
+    def create_expenses(self, count):
+        for _ in range(count):
+            expense = Expense.objects.create(
+                payer=self.user1, total_amount='100.00', split_method='equal',
+                date='2024-08-25')
+            ExpenseSplit.objects.bulk_create([
+                ExpenseSplit(expense=expense, user=self.user1, amount='50.00'),
+                ExpenseSplit(expense=expense, user=self.user2, amount='50.00'),
+            ])
+        return expense
+
+    def assert_query_budget(self, url, budget):
+        for count in (1, 20):
+            self.create_expenses(count)
+            with self.assertNumQueries(budget):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    # The versioned read actions also look up the data version (see
+    # ExpenseViewSet.versioned_response). Balance sheet totals also read
+    # the user's archived summaries (see expenses_app.archive).
+    def test_overall_expenses(self):
+        self.assert_query_budget('/api/expenses/overall_expenses/', 3)
+
+    def test_user_expenses(self):
+        self.assert_query_budget('/api/expenses/user_expenses/', 3)
+
+    def test_list(self):
+        self.assert_query_budget('/api/expenses/', 2)
+
+    def test_balance_sheet(self):
+        self.assert_query_budget('/api/expenses/balance_sheet/', 5)
+
+    def test_balance_sheet_summary_only(self):
+        self.assert_query_budget(
+            '/api/expenses/balance_sheet/?summary_only=true&group_by=month', 4)
+
+    def test_retrieve(self):
+        expense = self.create_expenses(1)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/expenses/{expense.id}/')
+        self.assertEqual(len(response.json()['splits']), 2)
+
+
+class BalanceLedgerTests(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.user3 = User.create_user(
+            email='user3@example.com', name='User Three', mobile_number='1029384756')
+        self.client.force_authenticate(self.user1)
+
+    def create_expense(self, payer, total_amount, users):
+        data = {
+            'payer': payer.id,
+            'total_amount': total_amount,
+            'split_method': 'equal',
+            'date': '2024-08-25',
+            'splits': [{'user': user.id} for user in users],
+        }
+        return self.client.post('/api/expenses/', data, format='json').json()
+
+    def balances(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get('/api/expenses/balances/').json()
+
+    def test_balances_follow_expense_changes(self):
+        dinner = self.create_expense(
+            self.user1, '300.00', [self.user1, self.user2, self.user3])
+        self.create_expense(self.user2, '50.00', [self.user1, self.user2])
+
+        self.assertEqual(self.balances(self.user1), {
+            'net_balance': '175.00',
+            'balances': [
+                {'user': self.user2.id, 'amount': '75.00'},
+                {'user': self.user3.id, 'amount': '100.00'},
+            ]
+        })
+        self.assertEqual(self.balances(self.user3)['net_balance'], '-100.00')
+
+        self.client.force_authenticate(self.user1)
+        dinner['splits'] = [{'user': self.user1.id}, {'user': self.user2.id}]
+        self.client.put(f"/api/expenses/{dinner['id']}/", dinner, format='json')
+        self.assertEqual(self.balances(self.user1)['net_balance'], '125.00')
+        self.assertEqual(self.balances(self.user3)['net_balance'], '0.00')
+
+        self.client.force_authenticate(self.user1)
+        self.client.delete(f"/api/expenses/{dinner['id']}/")
+        self.assertEqual(self.balances(self.user1)['net_balance'], '-25.00')
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+    def test_stale_writes_to_a_deleted_expense_leave_the_ledger_alone(self):
+        dinner = self.create_expense(
+            self.user1, '300.00', [self.user1, self.user2, self.user3])
+        self.create_expense(self.user2, '50.00', [self.user1, self.user2])
+        # Both requests loaded the expense before the first delete committed.
+        stale = Expense.objects.get(pk=dinner['id'])
+        self.client.delete(f"/api/expenses/{dinner['id']}/")
+        before = self.balances(self.user1)
+
+        self.client.force_authenticate(self.user1)
+        with mock.patch('expenses_app.views.ExpenseViewSet.get_object', return_value=stale):
+            response = self.client.delete(f"/api/expenses/{dinner['id']}/")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            dinner['splits'] = [{'user': self.user1.id}, {'user': self.user2.id}]
+            response = self.client.put(f"/api/expenses/{dinner['id']}/", dinner, format='json')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertFalse(Expense.objects.filter(pk=dinner['id']).exists())
+        self.assertEqual(self.balances(self.user1), before)
+        self.assertEqual(
+            sum(SpendingRollup.objects.filter(user=self.user1)
+                .values_list('expense_count', flat=True)), 0)
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+    def test_deleting_a_user_updates_counterparts(self):
+        self.create_expense(self.user1, '300.00', [self.user1, self.user2, self.user3])
+        self.create_expense(self.user2, '100.00', [self.user1, self.user2])
+        self.client.delete(f'/api/users/{self.user2.id}/')
+        self.assertEqual(self.balances(self.user1)['net_balance'], '100.00')
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+    def test_rebuild_repairs_drift(self):
+        self.create_expense(self.user1, '300.00', [self.user1, self.user2, self.user3])
+        UserBalance.objects.filter(user=self.user1).update(net=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', check=True,
+                         stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_balances', stdout=StringIO())
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+        self.assertEqual(self.balances(self.user1)['net_balance'], '200.00')
+
+
+class SettleUpTests(APITestCase):
+
+    def test_plan_clears_every_balance(self):
+        net_balances = {1: 500, 2: -200, 3: -200, 4: 100, 5: -150, 6: -50}
+        transfers = settle_up(net_balances)
+        self.assertLessEqual(len(transfers), len(net_balances) - 1)
+        remaining = dict(net_balances)
+        for debtor, creditor, amount in transfers:
+            self.assertGreater(amount, 0)
+            remaining[debtor] += amount
+            remaining[creditor] -= amount
+        self.assertEqual(set(remaining.values()), {0})
+
+    def test_endpoint_uses_ledger(self):
+        user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.client.force_authenticate(user1)
+        self.client.post('/api/expenses/', {
+            'payer': user1.id,
+            'total_amount': '100.00',
+            'split_method': 'equal',
+            'date': '2024-08-25',
+            'splits': [{'user': user1.id}, {'user': user2.id}],
+        }, format='json')
+        response = self.client.get('/api/expenses/settle-up/')
+        self.assertEqual(response.json(), {
+            'transfers': [{'from': user2.id, 'to': user1.id, 'amount': '50.00'}]
+        })
+
+
+class ExpenseCsvExportTests(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.client.force_authenticate(self.user1)
+        for date, method, splits in [
+            ('2024-08-01', 'equal', [{'user': self.user1.id}, {'user': self.user2.id}]),
+            ('2024-08-15', 'exact', [{'user': self.user1.id, 'amount': '40.00'},
+                                     {'user': self.user2.id, 'amount': '60.00'}]),
+        ]:
+            self.client.post('/api/expenses/', {
+                'payer': self.user1.id, 'total_amount': '100.00', 'split_method': method,
+                'description': 'Trip', 'date': date, 'splits': splits,
+            }, format='json')
+
+    def download(self, **params):
+        response = self.client.get('/api/expenses/download-csv/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_streams_expenses_with_splits(self):
+        lines = self.download()
+        self.assertEqual(
+            lines[0], 'id,payer,total_amount,split_method,description,date,splits')
+        self.assertTrue(lines[1].endswith(f'{self.user1.id};{self.user2.id}'))
+        self.assertTrue(lines[2].endswith(
+            f'{self.user1.id}:40.00;{self.user2.id}:60.00'))
+
+    def test_date_range_and_columns(self):
+        lines = self.download(start_date='2024-08-10', columns='date,total_amount')
+        self.assertEqual(lines, ['date,total_amount', '2024-08-15,100.00'])
+
+    def test_export_can_be_imported(self):
+        content = '\n'.join(self.download(
+            columns='payer,total_amount,split_method,description,date,splits'))
+        response = self.client.post('/api/expenses/bulk-import/', {
+            'file': SimpleUploadedFile('expenses.csv', content.encode()),
+        }, format='multipart')
+        self.assertEqual(response.json()['created'], 2)
+
+    def test_unknown_column(self):
+        response = self.client.get('/api/expenses/download-csv/', {'columns': 'secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BalanceSheetPdfTests(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.client.force_authenticate(self.user1)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.settings_override = override_settings(BALANCE_SHEET_CACHE_DIR=cache_dir.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def add_expense(self, total_amount):
+        self.client.post('/api/expenses/', {
+            'payer': self.user1.id, 'total_amount': total_amount, 'split_method': 'equal',
+            'date': '2024-08-25', 'splits': [{'user': self.user1.id}],
+        }, format='json')
+
+    @override_settings(BALANCE_SHEET_WORKERS=0)
+    def test_unchanged_sheet_is_served_from_cache(self):
+        self.add_expense('100.00')
+        with mock.patch('expenses_app.balance_sheets.pisa.CreatePDF',
+                        wraps=balance_sheets.pisa.CreatePDF) as create_pdf:
+            first = self.client.get('/api/expenses/download-balance-sheet/')
+            second = self.client.get('/api/expenses/download-balance-sheet/')
+            self.assertEqual(create_pdf.call_count, 1)
+            self.add_expense('50.00')
+            self.client.get('/api/expenses/download-balance-sheet/')
+            self.assertEqual(create_pdf.call_count, 2)
+        self.assertEqual(first['Content-Type'], 'application/pdf')
+        self.assertEqual(b''.join(first.streaming_content),
+                         b''.join(second.streaming_content))
+
+    def test_rendering_is_queued_on_the_worker_pool(self):
+        with mock.patch('expenses_app.balance_sheets.get_executor') as get_executor:
+            get_executor.return_value.submit.return_value = Future()
+            response = self.client.get('/api/expenses/download-balance-sheet/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['status'], 'pending')
+        status_response = self.client.get(response.json()['status_url'])
+        self.assertEqual(status_response.json()['status'], 'pending')
+        self.assertEqual(
+            self.client.get(f"/api/expenses/balance-sheet-jobs/{'0' * 64}/").status_code,
+            status.HTTP_404_NOT_FOUND)
+
+        # Job state is on disk, so any worker process sees it and does not
+        # queue the job again.
+        job_id = response.json()['job_id']
+        self.assertEqual(balance_sheets.marker_path(self.user1.pk, job_id, 'pending').read_text(), '')
+        with mock.patch('expenses_app.balance_sheets.get_executor') as get_executor:
+            self.client.get('/api/expenses/download-balance-sheet/')
+        get_executor.assert_not_called()
+
+    @override_settings(BALANCE_SHEET_WORKERS=0)
+    def test_failures_are_recorded_and_retried(self):
+        result = mock.Mock(err=1)
+        with mock.patch('expenses_app.balance_sheets.pisa.CreatePDF', return_value=result):
+            response = self.client.get('/api/expenses/download-balance-sheet/')
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual(self.client.get(response.json()['status_url']).json()['status'],
+                         'failed')
+        response = self.client.get('/api/expenses/download-balance-sheet/')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    @override_settings(BALANCE_SHEET_WORKERS=0)
+    def test_only_older_sheets_are_removed(self):
+        directory = balance_sheets.cache_path(self.user1.pk, 'x').parent
+        directory.mkdir(parents=True)
+        older, newer = directory / 'older.pdf', directory / 'newer.pdf'
+        for path, offset in [(older, -60), (newer, 60)]:
+            path.write_bytes(b'%PDF')
+            os.utime(path, (time.time() + offset,) * 2)
+        self.client.get('/api/expenses/download-balance-sheet/')
+        self.assertFalse(older.exists())
+        self.assertTrue(newer.exists())
+
+    @override_settings(BALANCE_SHEET_WORKERS=0)
+    def test_sheet_removed_before_it_is_served_is_rendered_again(self):
+        # The first answer points at a sheet that is gone by the time it is
+        # opened.
+        replies = [lambda user_id: ('0' * 64, balance_sheets.DONE), balance_sheets.submit]
+        with mock.patch('expenses_app.balance_sheets.submit',
+                        side_effect=lambda user_id: replies.pop(0)(user_id)):
+            response = self.client.get('/api/expenses/download-balance-sheet/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['status'], 'done')
+        self.assertIn('download_url', response.json())
+
+
+class BalanceSheetSummaryTests(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.client.force_authenticate(self.user1)
+        for total_amount, method, date in [('100.00', 'equal', '2024-07-05'),
+                                           ('50.50', 'exact', '2024-08-01'),
+                                           ('20.00', 'equal', '2024-08-20')]:
+            Expense.objects.create(payer=self.user1, total_amount=total_amount,
+                                   split_method=method, date=date)
+
+    def test_totals_by_split_method_and_month(self):
+        response = self.client.get(
+            '/api/expenses/balance_sheet/', {'summary_only': 'true', 'group_by': 'month'})
+        self.assertEqual(response.json(), {
+            'total_expenses': '170.50',
+            'expense_count': 3,
+            'by_split_method': {
+                'equal': {'total': '120.00', 'count': 2},
+                'exact': {'total': '50.50', 'count': 1},
+                'percentage': {'total': '0.00', 'count': 0},
+            },
+            'by_month': [
+                {'month': '2024-07', 'total': '100.00', 'count': 1},
+                {'month': '2024-08', 'total': '70.50', 'count': 2},
+            ],
+        })
+
+    def test_rows_are_listed_by_default(self):
+        data = self.client.get('/api/expenses/balance_sheet/').json()
+        self.assertEqual(len(data['user_expenses']), 3)
+        self.assertEqual(data['total_expenses'], '170.50')
+        self.assertNotIn('by_month', data)
+
+
+class QueryPlanTests(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        call_command('check_query_plans', users=20, expenses=300, stdout=StringIO())
+        self.assertFalse(Expense.objects.exists())
+
+    def test_unindexed_query_fails(self):
+        def queries(user, expense_ids):
+            return {'by_description': Expense.objects.filter(description='Dinner')}
+
+        with mock.patch(
+                'expenses_app.management.commands.check_query_plans.hot_queries', queries):
+            with self.assertRaises(CommandError):
+                call_command('check_query_plans', users=20, expenses=300, stdout=StringIO())
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        get_user_cache().clear()
+        self.addCleanup(get_user_cache().clear)
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890',
+            password='password')
+        token = RefreshToken.for_user(self.user1).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_user_is_loaded_once(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get('/api/expenses/user_expenses/')
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get('/api/expenses/user_expenses/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(second), len(first) - 1)
+        stats = get_user_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_update_and_delete_invalidate(self):
+        self.client.get('/api/expenses/user_expenses/')
+        self.client.patch(f'/api/users/{self.user1.id}/', {'name': 'Renamed'})
+        self.assertEqual(get_user_cache().stats()['size'], 0)
+
+        self.client.get('/api/expenses/user_expenses/')
+        self.client.delete(f'/api/users/{self.user1.id}/')
+        response = self.client.get('/api/expenses/user_expenses/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_saves_anywhere_invalidate(self):
+        self.client.get('/api/expenses/user_expenses/')
+        self.user1.is_active = False
+        self.user1.save()
+        response = self.client.get('/api/expenses/user_expenses/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.user1.is_active = True
+        self.user1.save()
+        self.client.get('/api/expenses/user_expenses/')
+        self.user1.delete()
+        self.assertEqual(get_user_cache().stats()['size'], 0)
+
+    def test_each_request_gets_its_own_user(self):
+        token = RefreshToken.for_user(self.user1).access_token
+        authenticator = CachedJWTAuthentication()
+        first = authenticator.get_user(token)
+        first.name = 'Changed by a request'
+        second = authenticator.get_user(token)
+        self.assertEqual(second.name, 'User One')
+        self.assertIsNot(second, authenticator.get_user(token))
+
+    def test_lru_eviction_and_ttl(self):
+        user_cache = UserCache(max_size=2, ttl=60)
+        user_cache.set(1, 'one')
+        user_cache.set(2, 'two')
+        user_cache.get(1)
+        user_cache.set(3, 'three')
+        self.assertIsNone(user_cache.get(2))
+        self.assertEqual(user_cache.get(1), 'one')
+        self.assertEqual(user_cache.stats()['evictions'], 1)
+
+        user_cache = UserCache(ttl=0)
+        user_cache.set(1, 'one')
+        self.assertIsNone(user_cache.get(1))
+
+
+class BulkUserOnboardingTests(APITestCase):
+
+    def setUp(self):
+        User.create_user(
+            email='taken@example.com', name='Taken', mobile_number='1111111111')
+        self.client.force_authenticate(User.create_user(
+            email='admin@example.com', name='Admin', mobile_number='9999999999',
+            is_staff=True))
+
+    def test_bulk_create_reports_per_record_errors(self):
+        records = [
+            {'email': f'new{i}@Example.COM', 'name': f'New {i}',
+             'mobile_number': f'20000000{i:02d}', 'password': 'secret-pass'}
+            for i in range(5)
+        ]
+        records += [
+            {'email': 'taken@example.com', 'name': 'Dup', 'mobile_number': '3000000000',
+             'password': 'secret-pass'},
+            {'email': 'other@example.com', 'name': 'Dup', 'mobile_number': '2000000001',
+             'password': 'secret-pass'},
+            {'email': 'bad', 'name': 'Bad', 'mobile_number': '12', 'password': 'secret-pass'},
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/users/bulk/', records, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.json()
+        self.assertEqual(result['created'], 5)
+        self.assertEqual([error['index'] for error in result['errors']], [5, 6, 7])
+        self.assertIn('email', result['errors'][0]['errors'])
+        self.assertIn('mobile_number', result['errors'][1]['errors'])
+        self.assertLessEqual(len(ctx.captured_queries), 5)
+
+        user = User.objects.get(email='new0@example.com')
+        self.assertTrue(user.check_password('secret-pass'))
+        self.assertFalse(User.objects.get(email='new1@example.com').check_password('x'))
+
+    def test_requires_a_list(self):
+        response = self.client.post('/api/users/bulk/', {'email': 'x'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(USER_BULK_MAX_USERS=2)
+    def test_limits_who_and_how_many(self):
+        records = [{'email': f'new{i}@example.com', 'name': f'New {i}',
+                    'mobile_number': f'20000000{i:02d}', 'password': 'secret-pass'}
+                   for i in range(3)]
+        response = self.client.post('/api/users/bulk/', records, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(User.objects.filter(email__startswith='new').exists())
+
+        self.client.force_authenticate(User.objects.get(email='taken@example.com'))
+        response = self.client.post('/api/users/bulk/', records[:1], format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/users/bulk/', records[:1], format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class SpendingAnalyticsTests(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.client.force_authenticate(self.user1)
+        for date, payer in [('2024-07-30', self.user1), ('2024-08-02', self.user1),
+                            ('2024-08-03', self.user2)]:
+            self.client.post('/api/expenses/', {
+                'payer': payer.id, 'total_amount': '100.00', 'split_method': 'equal',
+                'date': date, 'splits': [{'user': self.user1.id}, {'user': self.user2.id}],
+            }, format='json')
+
+    def test_monthly_user_spending(self):
+        response = self.client.get('/api/expenses/analytics/', {'start_date': '2024-08-01'})
+        self.assertEqual(response.json(), {
+            'scope': 'user',
+            'granularity': 'month',
+            'periods': [{
+                'paid': '100.00', 'owed': '100.00', 'expense_count': 1,
+                'period': '2024-08-01',
+                'by_split_method': {
+                    'equal': {'paid': '100.00', 'owed': '100.00', 'expense_count': 1}},
+            }],
+        })
+
+    def test_rollups_follow_updates_and_deletes(self):
+        expense = Expense.objects.filter(payer=self.user1).order_by('date').first()
+        self.client.delete(f'/api/expenses/{expense.id}/')
+        periods = self.client.get(
+            '/api/expenses/analytics/', {'granularity': 'day'}).json()['periods']
+        self.assertEqual([period['period'] for period in periods],
+                         ['2024-08-02', '2024-08-03'])
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+    def test_global_scope_requires_staff(self):
+        response = self.client.get('/api/expenses/analytics/', {'scope': 'global'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.user1.is_staff = True
+        response = self.client.get('/api/expenses/analytics/', {'scope': 'global'})
+        self.assertEqual(
+            [period['paid'] for period in response.json()['periods']], ['100.00', '200.00'])
+
+    def test_global_buckets_are_striped(self):
+        self.client.force_authenticate(self.user2)
+        self.client.post('/api/expenses/', {
+            'payer': self.user2.id, 'total_amount': '50.00', 'split_method': 'equal',
+            'date': '2024-08-03', 'splits': [{'user': self.user2.id}],
+        }, format='json')
+        self.assertEqual(SpendingRollup.objects.filter(
+            user__isnull=True, day=date(2024, 8, 3)).count(), 2)
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+        self.user2.is_staff = True
+        expected = [('2024-07-30', '100.00', 1), ('2024-08-02', '100.00', 1),
+                    ('2024-08-03', '150.00', 2)]
+        for _ in range(2):
+            periods = self.client.get('/api/expenses/analytics/', {
+                'scope': 'global', 'granularity': 'day'}).json()['periods']
+            self.assertEqual(
+                [(period['period'], period['paid'], period['expense_count'])
+                 for period in periods], expected)
+            call_command('rebuild_balances', stdout=StringIO())
+
+
+@override_settings(REQUEST_METRICS={'ENABLED': True, 'SAMPLE_RATE': 1.0})
+class RequestMetricsTests(APITestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.client.force_authenticate(self.user1)
+
+    def create_expense(self):
+        return self.client.post('/api/expenses/', {
+            'payer': self.user1.id, 'total_amount': '100.00', 'split_method': 'percentage',
+            'date': '2024-08-01', 'splits': [{'user': self.user1.id, 'percentage': '100.00'}],
+        }, format='json')
+
+    def test_metrics_endpoint_reports_routes(self):
+        self.create_expense()
+        self.client.get('/api/expenses/overall_expenses/')
+        self.user1.is_staff = True
+        exposition = self.client.get('/metrics').content.decode()
+
+        labels = 'route="expense-overall-expenses",method="GET"'
+        self.assertIn(
+            f'expenses_http_requests_total{{{labels},status="200"}} 1', exposition)
+        self.assertIn(f'expenses_http_request_duration_seconds_count{{{labels}}} 1', exposition)
+        # The data version, the expenses and their prefetched splits.
+        self.assertIn(f'expenses_db_queries_per_request_sum{{{labels}}} 3', exposition)
+        self.assertIn('expenses_serializer_duration_seconds_count{route="expense-list",method="POST"} 1',
+                      exposition)
+
+    @override_settings(REQUEST_METRICS={'ENABLED': True, 'TOKEN': 'scrape-secret'})
+    def test_metrics_need_staff_or_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get('/metrics', headers={'Authorization': 'Token wrong'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get('/metrics', headers={'Authorization': 'Token scrape-secret'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+        with override_settings(REQUEST_METRICS={'ENABLED': True}):
+            response = self.client.get('/metrics', headers={'Authorization': 'Token None'})
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(REQUEST_METRICS={'ENABLED': True, 'SAMPLE_RATE': 0.0})
+    def test_unsampled_requests_are_only_counted(self):
+        self.client.get('/api/expenses/overall_expenses/')
+        exposition = metrics.registry.render()
+        self.assertIn('expenses_http_request_duration_seconds_count', exposition)
+        self.assertNotIn('expenses_db_queries_per_request_count', exposition)
+
+    def test_validation_logging_is_level_gated(self):
+        logger = logging.getLogger('expenses_app.serializers')
+        with mock.patch.object(logger, 'debug') as debug:
+            self.create_expense()
+        debug.assert_not_called()
+        with self.assertLogs('expenses_app.serializers', level='DEBUG') as logs:
+            self.create_expense()
+        self.assertEqual(logs.records[-1].split_method, 'percentage')
+        self.assertEqual(logs.records[-1].split_count, 1)
+
+
+class AsyncReadViewTests(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        token = RefreshToken.for_user(self.user1).access_token
+        self.headers = {'Authorization': f'Bearer {token}'}
+        for date, payer in [('2024-07-30', self.user1), ('2024-08-02', self.user2)]:
+            self.client.post('/api/expenses/', {
+                'payer': payer.id, 'total_amount': '100.00', 'split_method': 'equal',
+                'date': date, 'splits': [{'user': self.user1.id}, {'user': self.user2.id}],
+            }, format='json', headers=self.headers)
+
+    def async_get(self, path, data=None, **kwargs):
+        return async_to_sync(self.async_client.get)(path, data, **kwargs)
+
+    def test_responses_match_sync_actions(self):
+        for action, params in [('user_expenses', {}), ('overall_expenses', {}),
+                               ('balance_sheet', {}),
+                               ('balance_sheet', {'summary_only': 'true', 'group_by': 'month'}),
+                               ('balance_sheet', {'group_by': 'year'})]:
+            with self.subTest(action=action, params=params):
+                expected = self.client.get(
+                    f'/api/expenses/{action}/', params, headers=self.headers)
+                response = self.async_get(
+                    f'/api/async/expenses/{action}/', params, headers=self.headers)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.content, expected.content)
+
+    def test_requires_authentication(self):
+        expected = self.client.get('/api/expenses/overall_expenses/')
+        response = self.async_get('/api/async/expenses/overall_expenses/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['WWW-Authenticate'], expected['WWW-Authenticate'])
+
+        response = self.async_get('/api/async/expenses/overall_expenses/',
+                                  headers={'Authorization': 'Bearer not-a-token'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ConditionalReadTests(APITestCase):
+
+    def setUp(self):
+        conditional.get_payload_cache().clear()
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.client.force_authenticate(self.user1)
+        self.create_expense(self.user1)
+
+    def create_expense(self, payer):
+        return self.client.post('/api/expenses/', {
+            'payer': payer.id, 'total_amount': '100.00', 'split_method': 'equal',
+            'date': '2024-08-01', 'splits': [{'user': self.user1.id}, {'user': self.user2.id}],
+        }, format='json').json()['id']
+
+    def test_unchanged_data_is_not_modified(self):
+        for url in ['/api/expenses/overall_expenses/', '/api/expenses/user_expenses/',
+                    '/api/expenses/balance_sheet/?summary_only=true']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertIn('private', response['Cache-Control'])
+                with self.assertNumQueries(1):
+                    cached = self.client.get(url, headers={
+                        'If-None-Match': response['ETag']})
+                self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+                self.assertEqual(cached['ETag'], response['ETag'])
+
+                # Last-Modified has one second resolution, so it is not
+                # enough on its own.
+                response = self.client.get(url, headers={
+                    'If-Modified-Since': response['Last-Modified']})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_writes_in_the_same_second_are_not_hidden(self):
+        url = '/api/expenses/user_expenses/'
+        first = self.client.get(url)
+        self.create_expense(self.user1)
+        response = self.client.get(url, headers={
+            'If-Modified-Since': first['Last-Modified'], 'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 2)
+        response = self.client.get(url, headers={'If-Modified-Since': first['Last-Modified']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_payloads_are_served_from_cache_until_data_changes(self):
+        url = '/api/expenses/overall_expenses/'
+        first = self.client.get(url)
+        with self.assertNumQueries(1):
+            second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        # Group expenses are not listed there.
+        group = self.client.post('/api/groups/', {
+            'name': 'Trip', 'members': [self.user2.id]}, format='json').json()
+        self.client.post('/api/expenses/', {
+            'payer': self.user1.id, 'group': group['id'], 'total_amount': '10.00',
+            'split_method': 'equal', 'date': '2024-07-01', 'splits': [{'user': self.user2.id}],
+        }, format='json')
+        response = self.client.get(url, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # A change by another user bumps the global version but not user1's.
+        self.client.force_authenticate(self.user2)
+        self.client.post('/api/expenses/', {
+            'payer': self.user2.id, 'total_amount': '10.00', 'split_method': 'equal',
+            'date': '2024-08-02', 'splits': [{'user': self.user2.id}],
+        }, format='json')
+        self.client.force_authenticate(self.user1)
+        response = self.client.get(url, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 2)
+
+        user_url = '/api/expenses/user_expenses/'
+        etag = self.client.get(user_url)['ETag']
+        self.client.patch(f'/api/expenses/{Expense.objects.get(payer=self.user1, group=None).id}/',
+                          {'description': 'Renamed'}, format='json')
+        response = self.client.get(user_url, headers={'If-None-Match': etag})
+        self.assertEqual(response.json()['results'][0]['description'], 'Renamed')
+
+    def test_async_views_share_validators(self):
+        token = RefreshToken.for_user(self.user1).access_token
+        headers = {'Authorization': f'Bearer {token}'}
+        etag = self.client.get('/api/expenses/balance_sheet/')['ETag']
+        response = async_to_sync(self.async_client.get)(
+            '/api/async/expenses/balance_sheet/',
+            headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class IntegerCentsTests(APITestCase):
+
+    def setUp(self):
+        self.users = [User.create_user(
+            email=f'user{i}@example.com', name=f'User {i}', mobile_number=f'123456789{i}')
+            for i in range(3)]
+        self.client.force_authenticate(self.users[0])
+
+    def test_allocate_sums_exactly(self):
+        self.assertEqual(money.allocate(10000, [1, 1, 1]), [3334, 3333, 3333])
+        self.assertEqual(money.allocate(1001, [3333, 3333, 3334]), [334, 333, 334])
+        self.assertEqual(money.allocate(5, [0, 1]), [0, 5])
+        self.assertEqual(sum(money.allocate(99999, [7, 11, 13, 17])), 99999)
+        with self.assertRaises(ValueError):
+            money.allocate(100, [0, 0])
+
+    def create_expense(self, total, method, shares):
+        response = self.client.post('/api/expenses/', {
+            'payer': self.users[0].id, 'total_amount': total, 'split_method': method,
+            'date': '2024-08-01',
+            'splits': [{'user': user.id, **share} for user, share in zip(self.users, shares)],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()
+
+    def test_splits_add_up_to_total(self):
+        expense = self.create_expense('100.00', 'equal', [{}, {}, {}])
+        self.assertEqual([split['amount'] for split in expense['splits']],
+                         ['33.34', '33.33', '33.33'])
+        expense = self.create_expense('10.01', 'percentage', [
+            {'percentage': '33.33'}, {'percentage': '33.33'}, {'percentage': '33.34'}])
+        self.assertEqual([split['amount'] for split in expense['splits']],
+                         ['3.34', '3.33', '3.34'])
+        self.assertEqual(
+            self.client.get(f"/api/expenses/{expense['id']}/").json(), expense)
+
+        balance = UserBalance.objects.get(user=self.users[0])
+        self.assertEqual(balance.net, Decimal('73.33'))
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+    def test_money_is_stored_as_integer_cents(self):
+        expense = self.create_expense('12.34', 'exact', [
+            {'amount': '12.00'}, {'amount': '0.34'}])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT amount FROM expenses_app_expensesplit WHERE expense_id = %s '
+                'ORDER BY amount', [expense['id']])
+            self.assertEqual([row[0] for row in cursor.fetchall()], [34, 1200])
+        self.assertEqual(Expense.objects.summary()['total_expenses'], Decimal('12.34'))
+
+
+class SplitPlanningTests(APITestCase):
+
+    def test_batch_reports_first_failing_check_per_expense(self):
+        results = splits.plan_expenses([
+            ('equal', Decimal('10.00'), [{'user': 1}, {'user': 2}, {'user': 3}]),
+            ('exact', Decimal('10.00'), [{'amount': Decimal('4.00')}]),
+            ('percentage', Decimal('10.00'), [{'percentage': Decimal('101.00')}]),
+            ('percentage', Decimal('0.03'), [{'percentage': Decimal('50.00')},
+                                            {'percentage': Decimal('50.00')}]),
+            ('equal', Decimal('10.00'), []),
+            ('shares', Decimal('10.00'), [{'user': 1}]),
+        ])
+        self.assertEqual([error for _, error in results], [
+            None,
+            "The sum of exact amounts must equal the total amount.",
+            "Percentage must be between 0 and 100.",
+            None,
+            "Splits data is required for equal split.",
+            "Invalid split method.",
+        ])
+        equal = results[0][0]
+        self.assertEqual([split['user'] for split in equal], [1, 2, 3])
+        self.assertEqual([split['amount'] for split in equal],
+                         [Decimal('3.34'), Decimal('3.33'), Decimal('3.33')])
+        self.assertEqual([split['percentage'] for split in equal],
+                         [Decimal('33.40'), Decimal('33.30'), Decimal('33.30')])
+        self.assertEqual([split['amount'] for split in results[3][0]],
+                         [Decimal('0.02'), Decimal('0.01')])
+
+    def test_batch_matches_sequential_allocation(self):
+        expenses = [('percentage', money.from_cents(total),
+                     [{'percentage': money.from_cents(p)} for p in (3333, 3333, 3334)])
+                    for total in range(1, 500, 7)]
+        for (_, total, _), (planned, error) in zip(expenses, splits.plan_expenses(expenses)):
+            self.assertIsNone(error)
+            self.assertEqual(
+                [money.to_cents(split['amount']) for split in planned],
+                money.allocate(money.to_cents(total), [3333, 3333, 3334]))
+
+    def test_partial_update_plans_with_existing_method(self):
+        users = [User.create_user(
+            email=f'user{i}@example.com', name=f'User {i}', mobile_number=f'123456789{i}')
+            for i in range(2)]
+        self.client.force_authenticate(users[0])
+        expense = self.client.post('/api/expenses/', {
+            'payer': users[0].id, 'total_amount': '10.00', 'split_method': 'equal',
+            'date': '2024-08-01', 'splits': [{'user': users[0].id}],
+        }, format='json').json()
+        response = self.client.patch(f"/api/expenses/{expense['id']}/", {
+            'splits': [{'user': user.id} for user in users]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([split['amount'] for split in response.json()['splits']],
+                         ['5.00', '5.00'])
+
+
+class GroupTests(APITestCase):
+
+    def setUp(self):
+        self.users = [User.create_user(
+            email=f'user{i}@example.com', name=f'User {i}', mobile_number=f'123456789{i}')
+            for i in range(3)]
+        self.client.force_authenticate(self.users[0])
+        response = self.client.post('/api/groups/', {
+            'name': 'Trip', 'members': [self.users[1].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.group = response.json()
+
+    def create_expense(self, splits, in_group=True):
+        return self.client.post('/api/expenses/', {
+            'payer': self.users[0].id, 'group': self.group['id'] if in_group else None,
+            'total_amount': '90.00', 'split_method': 'equal', 'date': '2024-08-01',
+            'splits': [{'user': user.id} for user in splits],
+        }, format='json')
+
+    def test_groups_are_visible_to_members_only(self):
+        self.assertEqual(sorted(self.group['members']),
+                         [self.users[0].id, self.users[1].id])
+        self.client.force_authenticate(self.users[2])
+        self.assertEqual(self.client.get('/api/groups/').json(), [])
+        response = self.client.get(f"/api/groups/{self.group['id']}/expenses/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_settle_up_leaves_out_group_debts(self):
+        self.create_expense(self.users[:2])
+        self.create_expense([self.users[0], self.users[2]], in_group=False)
+        self.client.force_authenticate(self.users[2])
+        self.assertEqual(self.client.get('/api/expenses/settle-up/').json(), {
+            'transfers': [{'from': self.users[2].id, 'to': self.users[0].id, 'amount': '45.00'}]
+        })
+
+    def test_expense_participants_must_be_members(self):
+        response = self.create_expense(self.users)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('group', response.json()['errors'])
+
+        self.client.post(f"/api/groups/{self.group['id']}/members/",
+                         {'user': self.users[2].id}, format='json')
+        self.assertEqual(self.create_expense(self.users).status_code,
+                         status.HTTP_201_CREATED)
+
+    def test_group_ledger_and_scoped_reads(self):
+        expense = self.create_expense(self.users[:2]).json()
+        self.create_expense(self.users[:2], in_group=False)
+
+        group_url = f"/api/groups/{self.group['id']}"
+        self.assertEqual(
+            [e['id'] for e in self.client.get(f'{group_url}/expenses/').json()['results']],
+            [expense['id']])
+        self.assertNotIn(expense['id'], [
+            e['id'] for e in
+            self.client.get('/api/expenses/overall_expenses/').json()['results']])
+        self.assertEqual(self.client.get(f'{group_url}/balances/').json(), {
+            'balances': [{'user': self.users[0].id, 'net': '45.00'},
+                         {'user': self.users[1].id, 'net': '-45.00'}],
+            'transfers': [{'from': self.users[1].id, 'to': self.users[0].id,
+                           'amount': '45.00'}],
+        })
+        # The group expense still counts towards the overall balances.
+        self.assertEqual(UserBalance.objects.get(user=self.users[0]).net, Decimal('90.00'))
+
+        lines = b''.join(self.client.get(
+            f'{group_url}/download-csv/', {'columns': 'id,total_amount'}).streaming_content
+        ).decode().splitlines()
+        self.assertEqual(lines, ['id,total_amount', f"{expense['id']},90.00"])
+
+        self.client.force_authenticate(self.users[2])
+        response = self.client.get(f"/api/expenses/{expense['id']}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.client.force_authenticate(self.users[0])
+        self.client.delete(f"/api/expenses/{expense['id']}/")
+        self.assertFalse(GroupBalance.objects.exclude(net=0).exists())
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+    def test_rebuild_refreshes_cached_balances(self):
+        self.create_expense(self.users[:2])
+        url = f"/api/groups/{self.group['id']}/balances/"
+        expected = self.client.get(url).json()
+        # A ledger that drifted, with a payload cached from it.
+        GroupBalance.objects.update(net=0)
+        conditional.get_payload_cache().clear()
+        self.assertEqual(self.client.get(url).json()['balances'], [])
+        call_command('rebuild_balances', stdout=StringIO())
+        self.assertEqual(self.client.get(url).json(), expected)
+
+    def test_bulk_import_checks_membership(self):
+        rows = [
+            {'payer': self.users[0].id, 'group': self.group['id'], 'total_amount': '10.00',
+             'split_method': 'equal', 'date': '2024-08-25',
+             'splits': [{'user': self.users[0].id}, {'user': self.users[1].id}]},
+            {'payer': self.users[0].id, 'group': self.group['id'], 'total_amount': '10.00',
+             'split_method': 'equal', 'date': '2024-08-25',
+             'splits': [{'user': self.users[2].id}]},
+        ]
+        response = self.client.post('/api/expenses/bulk-import/', {
+            'file': SimpleUploadedFile(
+                'expenses.jsonl', '\n'.join(json.dumps(row) for row in rows).encode()),
+        }, format='multipart')
+        result = response.json()
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([error['row'] for error in result['errors']], [2])
+        self.assertEqual(GroupBalance.objects.get(user=self.users[1]).net, Decimal('-5.00'))
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+
+class ExpensePaginationTests(APITestCase):
+
+    def setUp(self):
+        conditional.get_payload_cache().clear()
+        self.user = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.client.force_authenticate(self.user)
+        for date in ['2024-08-01', '2024-08-03', '2024-08-03', '2024-08-02', '2024-08-03']:
+            self.client.post('/api/expenses/', {
+                'payer': self.user.id, 'total_amount': '10.00', 'split_method': 'equal',
+                'date': date, 'splits': [{'user': self.user.id}],
+            }, format='json')
+
+    def test_pages_walk_date_and_id_in_order(self):
+        expected = list(Expense.objects.order_by('-date', '-id').values_list('id', flat=True))
+        seen, query = [], '?page_size=2'
+        while query:
+            # Version lookup, page and splits, however deep the page is.
+            with self.assertNumQueries(3):
+                page = self.client.get(f'/api/expenses/overall_expenses/{query}').json()
+            self.assertLessEqual(len(page['results']), 2)
+            seen += [expense['id'] for expense in page['results']]
+            query = page['next']
+        self.assertEqual(seen, expected)
+
+        self.assertEqual(self.client.get(
+            '/api/expenses/', {'cursor': 'bogus'}).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sparse_fields_skip_splits(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/expenses/user_expenses/', {'exclude': 'splits'})
+        self.assertNotIn('splits', response.json()['results'][0])
+        response = self.client.get('/api/expenses/', {'fields': 'id,date'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'date'})
+        expense = response.json()['results'][0]['id']
+        self.assertEqual(set(self.client.get(
+            f'/api/expenses/{expense}/', {'exclude': 'splits,group'}).json()),
+            {'id', 'payer', 'total_amount', 'split_method', 'description', 'date'})
+
+        response = self.client.get('/api/expenses/overall_expenses/', {'fields': 'secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_async_pages_match(self):
+        token = RefreshToken.for_user(self.user).access_token
+        params = {'page_size': 2, 'fields': 'id,total_amount'}
+        expected = self.client.get('/api/expenses/overall_expenses/', params).json()
+        response = async_to_sync(self.async_client.get)(
+            '/api/async/expenses/overall_expenses/', params,
+            headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.json(), expected)
+        self.assertTrue(expected['next'].startswith('?'))
+
+
+class FastReadPathTests(APITestCase):
+
+    def setUp(self):
+        conditional.get_payload_cache().clear()
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.client.force_authenticate(self.user1)
+        group = self.client.post('/api/groups/', {'name': 'Trip'}, format='json').json()
+        self.client.post(f'/api/groups/{group["id"]}/members/',
+                         {'user': self.user2.id}, format='json')
+        for data in [
+            {'split_method': 'equal', 'total_amount': '100.00', 'description': None,
+             'splits': [{'user': self.user1.id}, {'user': self.user2.id}]},
+            {'split_method': 'exact', 'total_amount': '10.01', 'description': 'Café\u2028"quoted"',
+             'splits': [{'user': self.user1.id, 'amount': '7.00'},
+                        {'user': self.user2.id, 'amount': '3.01'}]},
+            {'split_method': 'percentage', 'total_amount': '33.33', 'group': group['id'],
+             'description': 'Taxi e-5 \U0001f695',
+             'splits': [{'user': self.user1.id, 'percentage': '33.33'},
+                        {'user': self.user2.id, 'percentage': '66.67'}]},
+        ]:
+            response = self.client.post('/api/expenses/', {
+                'payer': self.user1.id, 'date': '2024-08-01', **data}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_payloads_render_like_the_serializer(self):
+        expenses = Expense.objects.order_by('-date', '-id')
+        expected = JSONRenderer().render(
+            serializers.ExpenseSerializer(expenses.prefetch_related('splits'), many=True).data)
+        rendered = FastJSONRenderer().render(
+            payloads.expense_payloads(payloads.expense_rows(expenses)))
+        self.assertEqual(rendered, expected)
+
+        fields = serializers.sparse_fields({'exclude': 'payer,description'})
+        expected = JSONRenderer().render(
+            serializers.ExpenseSerializer(expenses, many=True, fields=fields).data)
+        rendered = FastJSONRenderer().render(
+            payloads.expense_payloads(payloads.expense_rows(expenses), fields))
+        self.assertEqual(rendered, expected)
+
+    def test_renderer_falls_back_where_orjson_differs(self):
+        for data in [{'small': 1e-7, 'large': 1e16}, {1: 'int key'}, {'big': 2 ** 70},
+                     {'amount': Decimal('1.50'), 'on': date(2024, 8, 1)}]:
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_list_endpoints_match_the_serializer(self):
+        response = self.client.get('/api/expenses/')
+        expected = serializers.ExpenseSerializer(
+            Expense.objects.visible_to(self.user1).order_by('-date', '-id'), many=True).data
+        self.assertEqual(response.json()['results'], json.loads(JSONRenderer().render(expected)))
+        self.assertIn(b'\\u2028', response.content)
+
+
+class IdempotentCreateTests(APITestCase):
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.client.force_authenticate(self.user1)
+        self.data = {
+            'payer': self.user1.id, 'total_amount': '30.00', 'split_method': 'equal',
+            'date': '2024-08-01', 'splits': [{'user': self.user1.id}, {'user': self.user2.id}],
+        }
+
+    def post(self, data, key='retry-1'):
+        return self.client.post('/api/expenses/', data, format='json',
+                                headers={'Idempotency-Key': key})
+
+    def test_retry_replays_the_first_response(self):
+        first = self.post(self.data)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.post(self.data)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertEqual(UserBalance.objects.get(user=self.user2).net, Decimal('-15.00'))
+        touched = ' '.join(query['sql'] for query in queries.captured_queries)
+        for table in ['expenses_app_expense', 'balance', 'rollup', 'dataversion']:
+            self.assertNotIn(table, touched)
+
+        self.assertEqual(self.post(self.data, key='retry-2').status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.post(self.data)
+        response = self.post({**self.data, 'total_amount': '40.00'})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Expense.objects.count(), 1)
+
+        # Keys are per user.
+        self.client.force_authenticate(self.user2)
+        self.assertEqual(self.post({**self.data, 'payer': self.user2.id}).status_code,
+                         status.HTTP_201_CREATED)
+
+    def test_failed_request_releases_the_key(self):
+        response = self.post({**self.data, 'split_method': 'exact'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.post(self.data).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.post('not a dict', key='').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_expired_keys_are_reused_and_purged(self):
+        self.post(self.data)
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        response = self.post(self.data)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Expense.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Deleted 1 ', out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_signup_ignores_the_header(self):
+        # Only expense creation is idempotent; signups are anonymous.
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/users/', {
+            'email': 'user3@example.com', 'name': 'User Three', 'mobile_number': '1112223333',
+            'password': 'secret-pass'}, format='json', headers={'Idempotency-Key': 'signup-1'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class ReadReplicaRoutingTests(APITestCase):
+
+    def setUp(self):
+        conditional.get_payload_cache().clear()
+        caches['default'].clear()
+        self.user = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.client.force_authenticate(self.user)
+        self.data = {
+            'payer': self.user.id, 'total_amount': '10.00', 'split_method': 'equal',
+            'date': '2024-08-01', 'splits': [{'user': self.user.id}],
+        }
+
+    @override_settings(READ_REPLICA={'ALIAS': 'default', 'STICKY_SECONDS': 10})
+    def test_safe_actions_read_from_replica_until_a_write(self):
+        # 'default' stands in for the replica here; see ReplicaDatabaseTests.
+        with mock.patch.object(routers, 'route_reads', wraps=routers.route_reads) as route:
+            self.client.get('/api/expenses/user_expenses/')
+            self.assertEqual(route.call_args_list, [mock.call(None), mock.call('default')])
+            route.reset_mock()
+            self.client.post('/api/expenses/', self.data, format='json')
+            self.assertEqual(route.call_args_list, [mock.call(None)])
+            route.reset_mock()
+            self.client.get('/api/expenses/user_expenses/')
+            self.assertEqual(route.call_args_list, [mock.call(None), mock.call(None)])
+
+        caches['default'].clear()
+        self.assertEqual(routers.read_alias_for(self.user), 'default')
+
+    @override_settings(READ_REPLICA={'ALIAS': 'default', 'STICKY_SECONDS': 10})
+    def test_async_views_route_reads_the_same_way(self):
+        token = RefreshToken.for_user(self.user).access_token
+        headers = {'Authorization': f'Bearer {token}'}
+        aliases = []
+
+        def record(model, **hints):
+            # The token's user is loaded before routing, as in the sync views.
+            if model is not User:
+                aliases.append(routers._read_alias.get())
+
+        with mock.patch.object(routers.ReadReplicaRouter, 'db_for_read', side_effect=record):
+            for url in ['/api/async/expenses/user_expenses/',
+                        '/api/async/expenses/balance_sheet/']:
+                aliases.clear()
+                response = async_to_sync(self.async_client.get)(url, headers=headers)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(set(aliases), {'default'})
+
+            self.client.post('/api/expenses/', self.data, format='json')
+            aliases.clear()
+            async_to_sync(self.async_client.get)(
+                '/api/async/expenses/user_expenses/', headers=headers)
+            self.assertEqual(set(aliases), {None})
+        self.assertIsNone(routers._read_alias.get())
+
+    def test_router(self):
+        router = routers.ReadReplicaRouter()
+        self.assertIsNone(router.db_for_read(Expense))
+        token = routers.route_reads('replica')
+        try:
+            self.assertEqual(router.db_for_read(Expense), 'replica')
+            self.assertEqual(router.db_for_write(Expense), 'default')
+        finally:
+            routers.reset_reads(token)
+        self.assertIsNone(router.db_for_read(Expense))
+        self.assertIsNone(routers.read_alias_for(self.user))
+
+
+@skipUnless('replica' in settings.DATABASES, 'no replica database configured')
+@override_settings(READ_REPLICA={'ALIAS': 'replica', 'STICKY_SECONDS': 10})
+class ReplicaDatabaseTests(APITransactionTestCase):
+    # Runs when EXPENSES_DB_REPLICA_HOST configures a 'replica' alias. It
+    # mirrors default in tests; a transaction test, because only committed
+    # rows are visible through the replica connection.
+    # The runner sets up every alias named here, even for skipped tests.
+    databases = {'default', 'replica'} & set(settings.DATABASES)
+
+    def test_reads_use_the_replica_connection(self):
+        caches['default'].clear()
+        conditional.get_payload_cache().clear()
+        user = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.client.force_authenticate(user)
+        self.client.post('/api/expenses/', {
+            'payer': user.id, 'total_amount': '10.00', 'split_method': 'equal',
+            'date': '2024-08-01', 'splits': [{'user': user.id}],
+        }, format='json')
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get('/api/expenses/user_expenses/')
+        # Still within the write's sticky window.
+        self.assertEqual(len(replica.captured_queries), 0)
+
+        caches['default'].clear()
+        with CaptureQueriesContext(connections['replica']) as replica, \
+                CaptureQueriesContext(connections['default']) as primary:
+            response = self.client.get('/api/expenses/user_expenses/')
+            b''.join(self.client.get('/api/expenses/download-csv/').streaming_content)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertGreater(len(replica.captured_queries), 0)
+        self.assertEqual(len(primary.captured_queries), 0)
+
+
+class ExpenseArchiveTests(APITestCase):
+
+    def setUp(self):
+        conditional.get_payload_cache().clear()
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.user3 = User.create_user(
+            email='user3@example.com', name='User Three', mobile_number='1112223333')
+        self.client.force_authenticate(self.user1)
+        group = self.client.post('/api/groups/', {'name': 'Trip'}, format='json').json()
+        self.client.post(f'/api/groups/{group["id"]}/members/',
+                         {'user': self.user2.id}, format='json')
+        for date_, extra in [
+            ('2020-01-05', {'split_method': 'equal'}),
+            ('2020-01-20', {'split_method': 'percentage', 'group': group['id'],
+                            'splits': [{'user': self.user1.id, 'percentage': '40.00'},
+                                       {'user': self.user2.id, 'percentage': '60.00'}]}),
+            ('2020-03-01', {'split_method': 'equal'}),
+            ('2024-08-01', {'split_method': 'equal'}),
+        ]:
+            response = self.client.post('/api/expenses/', {
+                'payer': self.user1.id, 'total_amount': '100.00', 'date': date_,
+                'splits': [{'user': self.user1.id}, {'user': self.user2.id}], **extra,
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def archive(self, **options):
+        out = StringIO()
+        call_command('archive_expenses', before=date(2021, 1, 1), stdout=out, **options)
+        return out.getvalue()
+
+    def test_archiving_keeps_totals_and_balances(self):
+        url = '/api/expenses/balance_sheet/?group_by=month'
+        before = self.client.get(url).json()
+        balances = self.client.get('/api/expenses/balances/').json()
+        analytics = self.client.get('/api/expenses/analytics/').json()
+
+        self.assertIn('Done: 3 expenses archived in 3 batches, 0 left', self.archive(batch_size=1))
+        self.assertEqual(Expense.objects.count(), 1)
+        self.assertEqual(ExpenseSplit.objects.count(), 2)
+        self.assertEqual(ArchivedExpense.objects.count(), 3)
+
+        after = self.client.get(url).json()
+        self.assertEqual(len(after.pop('user_expenses')), 1)
+        before.pop('user_expenses')
+        self.assertEqual(after, before)
+        self.assertEqual(self.client.get('/api/expenses/balances/').json(), balances)
+        self.assertEqual(self.client.get('/api/expenses/analytics/').json(), analytics)
+        token = RefreshToken.for_user(self.user1).access_token
+        response = async_to_sync(self.async_client.get)(
+            '/api/async/expenses/balance_sheet/', {'summary_only': 'true'},
+            headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.json()['total_expenses'], before['total_expenses'])
+
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+        call_command('rebuild_balances', stdout=StringIO())
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+        self.assertEqual(self.client.get('/api/expenses/balances/').json(), balances)
+
+    def test_interrupted_runs_resume(self):
+        self.assertIn('3 expenses dated before 2021-01-01', self.archive(dry_run=True))
+        self.assertIn('2 left', self.archive(batch_size=1, max_batches=1))
+        self.assertIn('Done: 2 expenses archived in 1 batches, 0 left', self.archive())
+        self.assertIn('Done: 0 expenses archived', self.archive())
+        self.assertEqual(ArchivedExpenseSummary.objects.get(
+            user=self.user1, month='2020-01-01', split_method='equal').expense_count, 1)
+
+    def test_archived_expenses_are_fetched_on_demand(self):
+        self.archive()
+        page = self.client.get('/api/expenses/archived/', {'page_size': 2}).json()
+        self.assertEqual([expense['date'] for expense in page['results']],
+                         ['2020-03-01', '2020-01-20'])
+        self.assertEqual(page['results'][1]['splits'][1],
+                         {'user': self.user2.id, 'amount': '60.00', 'percentage': '60.00'})
+        self.assertEqual(len(self.client.get(
+            f"/api/expenses/archived/{page['next']}").json()['results']), 1)
+
+        expense = page['results'][1]['id']
+        self.assertEqual(self.client.get(f'/api/expenses/archived/{expense}/').json(),
+                         page['results'][1])
+        self.assertEqual(self.client.get(f'/api/expenses/{expense}/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        # Group expenses stay private to members.
+        self.client.force_authenticate(self.user3)
+        self.assertEqual(self.client.get(f'/api/expenses/archived/{expense}/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(self.client.get('/api/expenses/archived/').json()['results']), 2)
+
+    def test_deleting_a_user_reverses_their_archived_expenses(self):
+        self.client.post('/api/expenses/', {
+            'payer': self.user1.id, 'total_amount': '90.00', 'split_method': 'equal',
+            'date': '2020-02-01', 'splits': [{'user': user.id} for user in
+                                             (self.user1, self.user2, self.user3)],
+        }, format='json')
+        self.archive()
+        net = UserBalance.objects.get(user=self.user1).net
+        self.client.delete(f'/api/users/{self.user3.id}/')
+        self.assertEqual(UserBalance.objects.get(user=self.user1).net, net - Decimal('30.00'))
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+        self.client.delete(f'/api/users/{self.user2.id}/')
+        self.assertFalse(ArchivedExpenseSplit.objects.filter(user=self.user2).exists())
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+
+@override_settings(CHANGE_FEED={'POLL_INTERVAL': 0.05, 'HEARTBEAT': 0.2})
+class ChangeFeedTests(APITransactionTestCase):
+    # Transactional: the change hub reads on its own thread and connection.
+
+    def setUp(self):
+        self.user1 = User.create_user(
+            email='user1@example.com', name='User One', mobile_number='1234567890')
+        self.user2 = User.create_user(
+            email='user2@example.com', name='User Two', mobile_number='0987654321')
+        self.user3 = User.create_user(
+            email='user3@example.com', name='User Three', mobile_number='1112223333')
+        self.client.force_authenticate(self.user1)
+        token = RefreshToken.for_user(self.user2).access_token
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    def create_expense(self):
+        response = self.client.post('/api/expenses/', {
+            'payer': self.user1.id, 'total_amount': '30.00', 'split_method': 'equal',
+            'date': '2024-08-01', 'splits': [{'user': self.user1.id}, {'user': self.user2.id}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.json()['id']
+
+    def poll(self, **params):
+        return async_to_sync(self.async_client.get)(
+            '/api/async/expenses/changes/', params, headers=self.headers)
+
+    def test_expense_writes_are_logged_for_everyone_involved(self):
+        expense = self.create_expense()
+        self.client.patch(f'/api/expenses/{expense}/', {
+            'splits': [{'user': self.user1.id}, {'user': self.user3.id}]}, format='json')
+        self.client.delete(f'/api/expenses/{expense}/')
+        self.assertEqual(
+            list(ExpenseChange.objects.order_by('id').values_list('user', 'expense_id', 'action')),
+            [(self.user1.id, expense, 'created'), (self.user2.id, expense, 'created'),
+             (self.user1.id, expense, 'updated'), (self.user2.id, expense, 'updated'),
+             (self.user3.id, expense, 'updated'),
+             (self.user1.id, expense, 'deleted'), (self.user3.id, expense, 'deleted')])
+
+    def test_long_poll_follows_the_cursor(self):
+        first = self.create_expense()
+        response = self.poll()
+        cursor = ExpenseChange.objects.latest('id').id
+        self.assertEqual(response.json(), {'cursor': cursor, 'changes': []})
+        self.assertEqual(self.poll(cursor=cursor, timeout=0).json(),
+                         {'cursor': cursor, 'changes': []})
+
+        second = self.create_expense()
+        data = self.poll(cursor=0).json()
+        self.assertEqual([(change['expense'], change['action']) for change in data['changes']],
+                         [(first, 'created'), (second, 'created')])
+        self.assertEqual(data['cursor'], data['changes'][-1]['id'])
+        self.assertEqual(self.poll(cursor=data['cursor'], timeout=0).json()['changes'], [])
+        self.assertEqual(self.poll(cursor=-1).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_waiting_long_poll_wakes_up_on_a_change(self):
+        cursor = self.poll().json()['cursor']
+
+        async def wait_and_write():
+            async def write():
+                await asyncio.sleep(0.2)
+                return await sync_to_async(self.create_expense)()
+            return await asyncio.gather(self.async_client.get(
+                '/api/async/expenses/changes/', {'cursor': cursor, 'timeout': 5},
+                headers=self.headers), write())
+
+        response, expense = async_to_sync(wait_and_write)()
+        self.assertEqual([change['expense'] for change in response.json()['changes']], [expense])
+
+    def test_subscribers_only_query_their_backlog(self):
+        first = self.create_expense()
+
+        async def follow():
+            hub = changes.get_hub()
+            subscription = hub.subscribe(self.user2.id, 0)
+            received = [await subscription.get(0.1) for _ in range(3)]
+            second = await sync_to_async(self.create_expense)()
+            received.append(await subscription.get(5))
+            hub.unsubscribe(subscription)
+            return second, received
+
+        with mock.patch.object(changes, 'user_changes', wraps=changes.user_changes) as backlog:
+            second, received = async_to_sync(follow)()
+        self.assertEqual(backlog.call_count, 1)
+        self.assertEqual([[change['expense'] for change in rows] for rows in received],
+                         [[first], [], [], [second]])
+
+    def test_changes_committed_out_of_id_order_are_delivered(self):
+        expense = self.create_expense()
+        cursor = ExpenseChange.objects.latest('id').id
+
+        def add_change(change_id):
+            ExpenseChange.objects.create(
+                id=change_id, user=self.user2, expense_id=expense, action='updated')
+
+        async def follow():
+            hub = changes.get_hub()
+            subscription = hub.subscribe(self.user2.id, cursor)
+            received = [await subscription.get(0)]
+            # cursor + 1 commits after cursor + 2 has been read.
+            await sync_to_async(add_change)(cursor + 2)
+            received.append(await subscription.get(5))
+            await sync_to_async(add_change)(cursor + 1)
+            received.append(await subscription.get(5))
+            hub.unsubscribe(subscription)
+            return received
+
+        received = async_to_sync(follow)()
+        self.assertEqual([[change['id'] for change in rows] for rows in received],
+                         [[], [cursor + 2], [cursor + 1]])
+
+    def test_long_poll_cursor_stays_below_uncommitted_changes(self):
+        expense = self.create_expense()
+        cursor = ExpenseChange.objects.latest('id').id
+
+        def add_change(change_id):
+            ExpenseChange.objects.create(
+                id=change_id, user=self.user2, expense_id=expense, action='updated')
+
+        # cursor + 1 commits only after the first request has returned.
+        add_change(cursor + 2)
+        first = self.poll(cursor=cursor, timeout=0).json()
+        self.assertEqual([change['id'] for change in first['changes']], [cursor + 2])
+        self.assertEqual(first['cursor'], cursor)
+        self.assertEqual(self.poll().json()['cursor'], cursor)
+
+        add_change(cursor + 1)
+        second = self.poll(cursor=first['cursor'], timeout=0).json()
+        self.assertEqual([change['id'] for change in second['changes']],
+                         [cursor + 1, cursor + 2])
+        self.assertEqual(second['cursor'], cursor + 2)
+
+    def test_purged_cursors_are_refused(self):
+        self.create_expense()
+        out = StringIO()
+        call_command('purge_change_log', days=-1, stdout=out)
+        self.assertIn('Deleted 2 change feed entries', out.getvalue())
+        response = self.poll(cursor=0, timeout=0)
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(response.json(), {'detail': changes.CursorExpired.default_detail})
+        head = self.poll().json()['cursor']
+        self.assertEqual(self.poll(cursor=head, timeout=0).status_code, status.HTTP_200_OK)
+
+    def test_event_stream(self):
+        expense = self.create_expense()
+
+        async def first_events():
+            response = await self.async_client.get(
+                '/api/async/expenses/changes/stream/', headers={
+                    **self.headers, 'Last-Event-ID': '0'})
+            events = aiter(response.streaming_content)
+            chunks = [await anext(events) for _ in range(3)]
+            await events.aclose()
+            return response, b''.join(chunks).decode()
+
+        response, body = async_to_sync(first_events)()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        change = ExpenseChange.objects.get(user=self.user2)
+        self.assertTrue(body.startswith(
+            f'retry: 3000\n\nid: {change.id}\nevent: change\ndata: {{"id":{change.id},'
+            f'"expense":{expense},"group":null,"action":"created"'))
+        self.assertTrue(body.endswith(': keepalive\n\n'))
@@ -1,14 +1,28 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import UserViewSet, ExpenseViewSet
+from .views import UserViewSet, ExpenseViewSet, GroupViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
 router.register(r'expenses', ExpenseViewSet)
+router.register(r'groups', GroupViewSet)
 
 urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    # Async versions of the read-heavy expense actions for ASGI deployments.
+    path('async/expenses/user_expenses/', async_views.user_expenses,
+         name='async-expense-user-expenses'),
+    path('async/expenses/overall_expenses/', async_views.overall_expenses,
+         name='async-expense-overall-expenses'),
+    path('async/expenses/balance_sheet/', async_views.balance_sheet,
+         name='async-expense-balance-sheet'),
+    # Change feed: long-poll, and server-sent events (ASGI only).
+    path('async/expenses/changes/', async_views.expense_changes,
+         name='async-expense-changes'),
+    path('async/expenses/changes/stream/', async_views.expense_change_stream,
+         name='async-expense-change-stream'),
     path('', include(router.urls)),
 ]
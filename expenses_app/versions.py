@@ -0,0 +1,75 @@
+from django.db.models import F, Max, Q, Sum
+from django.db.models.functions import Now
+
+from .models import DataVersion
+
+# Expenses outside any group, as listed by overall_expenses. Its version is
+# striped over GLOBAL_STRIPES rows so that concurrent writes by unrelated
+# users do not all queue on one row lock; its state is the sum of their
+# versions and the latest of their timestamps.
+GLOBAL_SCOPE = 'global'
+GLOBAL_STRIPES = 16
+GLOBAL_STRIPE_SCOPES = [f"{GLOBAL_SCOPE}:{stripe}" for stripe in range(GLOBAL_STRIPES)]
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+def group_scope(group_id):
+    return f"group:{group_id}"
+
+
+def bump_users(user_ids, group_ids=(), outside_groups=True):
+    # Also bumps the scopes of any groups the changed expenses belong to,
+    # and one stripe of the global scope if any of them is outside a group.
+    scopes = {user_scope(user_id) for user_id in user_ids}
+    if not scopes:
+        return
+    scopes |= {group_scope(group_id) for group_id in group_ids}
+    if outside_groups:
+        scopes.add(GLOBAL_STRIPE_SCOPES[min(user_ids) % GLOBAL_STRIPES])
+    scopes = sorted(scopes)
+    DataVersion.objects.bulk_create(
+        [DataVersion(scope=scope) for scope in scopes], ignore_conflicts=True)
+    DataVersion.objects.filter(scope__in=scopes).update(
+        version=F('version') + 1, updated_at=Now())
+
+
+def bump_all_users():
+    # Every user and group scope, e.g. after the ledgers were rebuilt.
+    # Scopes that never changed have no cached payloads to invalidate.
+    DataVersion.objects.filter(
+        Q(scope__startswith=user_scope('')) | Q(scope__startswith=group_scope(''))
+    ).update(version=F('version') + 1, updated_at=Now())
+
+
+def user_version(user_id):
+    return scope_state(user_scope(user_id))[0]
+
+
+def global_state(rows):
+    return rows['version'] or 0, rows['updated_at']
+
+
+def global_rows():
+    return DataVersion.objects.filter(scope__in=GLOBAL_STRIPE_SCOPES)
+
+
+def scope_state(scope):
+    # (version, updated_at) of a scope; (0, None) if it never changed.
+    if scope == GLOBAL_SCOPE:
+        return global_state(global_rows().aggregate(
+            version=Sum('version'), updated_at=Max('updated_at')))
+    state = DataVersion.objects.filter(scope=scope).values_list(
+        'version', 'updated_at').first()
+    return state or (0, None)
+
+
+async def ascope_state(scope):
+    if scope == GLOBAL_SCOPE:
+        return global_state(await global_rows().aaggregate(
+            version=Sum('version'), updated_at=Max('updated_at')))
+    state = await DataVersion.objects.filter(scope=scope).values_list(
+        'version', 'updated_at').afirst()
+    return state or (0, None)
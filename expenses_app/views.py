@@ -1,14 +1,27 @@
-import csv
-from django.http import HttpResponse
-from rest_framework import viewsets, serializers, permissions, status
-from rest_framework.decorators import action
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from rest_framework import mixins, viewsets, serializers, permissions, status
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework_simplejwt.views import TokenObtainPairView
-from django.template.loader import render_to_string
-from xhtml2pdf import pisa
-from .models import User, Expense
-from .serializers import UserSerializer, ExpenseSerializer
-from .permissions import IsOwnerOrReadOnly
+from .models import (
+    User, ArchivedExpense, ArchivedExpenseSplit, Expense, ExpenseSplit, Group, GroupMembership)
+from .serializers import (
+    UserSerializer, ExpenseSerializer, ExpenseExportSerializer,
+    GroupSerializer, GroupMemberSerializer, BalanceSheetQuerySerializer,
+    BalanceSummarySerializer, AnalyticsQuerySerializer, SpendingPeriodSerializer,
+    sparse_fields)
+from .exporters import CSV_EXPORT_COLUMNS, stream_csv
+from .importers import import_expenses, import_users, read_csv, read_jsonl
+from .pagination import ExpenseKeysetPagination
+from .permissions import HasMetricsToken, IsOwnerOrReadOnly
+from . import (
+    archive, balance_sheets, conditional, idempotency, ledger, metrics, payloads, rollups, routers,
+    versions)
+from .authentication import get_user_cache
+from .settlement import settle_up
+from django.conf import settings
 from django.db import transaction
 
 
@@ -17,6 +30,17 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     pass
 
 
+@api_view(['GET'])
+@permission_classes([HasMetricsToken | permissions.IsAdminUser])
+def metrics_view(request):
+    # Prometheus text exposition of this process's request metrics, for
+    # staff users and scrapers holding the metrics token.
+    if not metrics.metrics_settings()['ENABLED']:
+        raise Http404
+    return HttpResponse(metrics.registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -34,62 +58,333 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response({"detail": "User has been deleted."}, status=status.HTTP_204_NO_CONTENT)
 
     def perform_destroy(self, instance):
-        instance.delete()
+        with transaction.atomic():
+            ledger.forget_user(instance)
+            instance.delete()
+
+    @action(detail=False, methods=['post'], url_path='bulk', permission_classes=[permissions.IsAdminUser])
+    def bulk_create(self, request):
+        if not isinstance(request.data, list):
+            return Response({"errors": {"non_field_errors": ["Expected a list of users."]}}, status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > settings.USER_BULK_MAX_USERS:
+            return Response({"errors": {"non_field_errors": [f"At most {settings.USER_BULK_MAX_USERS} users per request."]}}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(import_users(request.data))
+
+    @action(detail=False, methods=['get'], url_path='auth-cache-stats', permission_classes=[permissions.IsAdminUser])
+    def auth_cache_stats(self, request):
+        return Response(get_user_cache().stats())
+
+
+class VersionedResponseMixin:
+    def versioned_response(self, scope, build):
+        # Answers 304 when the client's copy matches the scope's current data
+        # version, and otherwise reuses the payload built for that version if
+        # another request already did the work. ``build`` returns the data.
+        state = versions.scope_state(scope)
+        if state[1] is None:
+            # Nothing in this scope has changed since versioning started.
+            return Response(build())
+        key = conditional.payload_key(
+            self.action, scope, state, self.request.query_params)
+        etag, last_modified = conditional.validators(
+            key, state[1], self.request.accepted_media_type)
+        response = conditional.not_modified(self.request._request, etag)
+        if response is None:
+            payload_cache = conditional.get_payload_cache()
+            data = payload_cache.get(key)
+            if data is None:
+                data = build()
+                payload_cache.set(key, data)
+            response = Response(data)
+        return conditional.add_validators(response, etag, last_modified)
+
+
+class ReplicaReadsMixin:
+    # Safe-method actions read from the replica database when one is
+    # configured (see routers.py). Any other request keeps the user's reads
+    # on the primary for a while after, so they see their own writes.
+
+    def dispatch(self, request, *args, **kwargs):
+        token = routers.route_reads(None)
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        finally:
+            routers.reset_reads(token)
+        if request.method not in permissions.SAFE_METHODS:
+            user = getattr(self.request, 'user', None)
+            if user is not None:
+                routers.mark_write(user)
+        return response
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in permissions.SAFE_METHODS:
+            # Undone by dispatch() once the response is ready.
+            routers.route_reads(routers.read_alias_for(request.user))
+
+
+class ExpenseListMixin(VersionedResponseMixin):
 
+    def requested_fields(self):
+        # Sparse fieldset of expenses for reads (``fields=``/``exclude=``);
+        # None means every field.
+        if self.request.method not in permissions.SAFE_METHODS:
+            return None
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = sparse_fields(self.request.query_params)
+        return self._requested_fields
 
-class ExpenseViewSet(viewsets.ModelViewSet):
+    def expense_page(self, expenses, split_model=ExpenseSplit):
+        # One keyset page of ``expenses`` as response data, built from
+        # values() rows (see payloads). Splits are only fetched when the
+        # requested fields include them.
+        fields = self.requested_fields()
+        paginator = ExpenseKeysetPagination()
+        rows = paginator.paginate_queryset(
+            payloads.expense_rows(expenses), self.request, view=self)
+        return paginator.get_paginated_data(
+            payloads.expense_payloads(rows, fields, split_model))
+
+
+def csv_export_response(expenses, query_params, filename):
+    params = ExpenseExportSerializer(data=query_params)
+    params.is_valid(raise_exception=True)
+    expenses = expenses.order_by('date', 'id')
+    if 'start_date' in params.validated_data:
+        expenses = expenses.filter(date__gte=params.validated_data['start_date'])
+    if 'end_date' in params.validated_data:
+        expenses = expenses.filter(date__lte=params.validated_data['end_date'])
+    columns = params.validated_data.get('columns', CSV_EXPORT_COLUMNS)
+
+    # Rows are streamed after the view returns, so pin the database now.
+    expenses = expenses.using(expenses.db)
+    response = StreamingHttpResponse(
+        stream_csv(expenses, columns), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+class ExpenseViewSet(ReplicaReadsMixin, ExpenseListMixin, viewsets.ModelViewSet):
     queryset = Expense.objects.all()
     serializer_class = ExpenseSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
+    pagination_class = ExpenseKeysetPagination
+
+    def get_queryset(self):
+        # Load every expense's splits in one extra query instead of one per
+        # row, unless the requested fields leave them out. Other groups'
+        # expenses are hidden.
+        return (Expense.objects.visible_to(self.request.user)
+                .for_fields(self.requested_fields()))
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return Response(self.expense_page(Expense.objects.visible_to(request.user)))
 
     def create(self, request, *args, **kwargs):
+        key = request.headers.get(idempotency.HEADER)
+        if key is None:
+            return self.create_expense(request, *args, **kwargs)
+        if not key or len(key) > idempotency.MAX_KEY_LENGTH:
+            return Response(
+                {"errors": {idempotency.HEADER: [
+                    f"Must be 1 to {idempotency.MAX_KEY_LENGTH} characters."]}},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        # Retries with the same key get the first response back instead of
+        # creating the expense again.
+        digest = idempotency.fingerprint(request)
+        with transaction.atomic():
+            record, claimed = idempotency.claim(request.user, key, digest)
+            if not claimed:
+                if bytes(record.fingerprint) != digest:
+                    return Response(
+                        {"errors": {idempotency.HEADER: [
+                            "This key was already used for a different request."]}},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                return Response(record.response, status=record.status_code,
+                                headers={'Idempotent-Replayed': 'true'})
+            response = self.create_expense(request, *args, **kwargs)
+            if response.status_code >= 400:
+                # Nothing was created; release the key so the client can
+                # correct the request and retry with it.
+                transaction.set_rollback(True)
+            else:
+                idempotency.store(record, response)
+        return response
+
+    def create_expense(self, request, *args, **kwargs):
         try:
             return super().create(request, *args, **kwargs)
         except serializers.ValidationError as e:
             return Response({"errors": e.detail}, status=status.HTTP_400_BAD_REQUEST)
 
+    def destroy(self, request, *args, **kwargs):
+        instance = self.get_object()
+        self.perform_destroy(instance)
+        return Response({"detail": "Expense has been deleted."}, status=status.HTTP_204_NO_CONTENT)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # Lock the row first so a concurrent delete or archive of the
+            # same expense cannot reverse it from the ledger twice.
+            instance = Expense.objects.select_for_update().filter(pk=instance.pk).first()
+            if instance is None:
+                raise Http404
+            splits = list(
+                ExpenseSplit.objects.select_for_update().filter(expense=instance))
+            ledger.reverse_expenses([(instance, splits)])
+            instance.splits.all().delete()
+            instance.delete()
+
+    @action(detail=False, methods=['post'], url_path='bulk-import', parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"errors": {"file": ["This field is required."]}}, status=status.HTTP_400_BAD_REQUEST)
+
+        file_type = request.query_params.get(
+            'file_type') or upload.name.rsplit('.', 1)[-1].lower()
+        readers = {'csv': read_csv, 'jsonl': read_jsonl, 'ndjson': read_jsonl}
+        if file_type not in readers:
+            return Response({"errors": {"file_type": ["Expected one of: csv, jsonl."]}}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = import_expenses(readers[file_type](upload), user=request.user)
+        return Response(result)
+
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def user_expenses(self, request):
+        self.requested_fields()  # 400 on unknown fields, even for cached pages
         expenses = Expense.objects.filter(payer=request.user)
-        serializer = self.get_serializer(expenses, many=True)
-        return Response(serializer.data)
+        return self.versioned_response(
+            versions.user_scope(request.user.pk), lambda: self.expense_page(expenses))
 
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def overall_expenses(self, request):
-        expenses = Expense.objects.all()
-        serializer = self.get_serializer(expenses, many=True)
-        return Response(serializer.data)
+        # Expenses outside any group; group expenses are listed per group.
+        self.requested_fields()  # 400 on unknown fields, even for cached pages
+        expenses = Expense.objects.filter(group__isnull=True)
+        return self.versioned_response(
+            versions.GLOBAL_SCOPE, lambda: self.expense_page(expenses))
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def archived(self, request):
+        # Expenses moved to the archive tables by archive_expenses, paged
+        # and filtered like the list. Read only.
+        return Response(self.expense_page(
+            ArchivedExpense.objects.visible_to(request.user), ArchivedExpenseSplit))
+
+    @action(detail=False, methods=['get'], url_path=r'archived/(?P<expense_id>[0-9]+)', permission_classes=[permissions.IsAuthenticated])
+    def archived_expense(self, request, expense_id):
+        rows = list(payloads.expense_rows(
+            ArchivedExpense.objects.visible_to(request.user).filter(id=expense_id)))
+        if not rows:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(payloads.expense_payloads(
+            rows, self.requested_fields(), ArchivedExpenseSplit)[0])
 
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def balance_sheet(self, request):
+        params = BalanceSheetQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
         user_expenses = Expense.objects.filter(payer=request.user)
-        balance_data = {
-            "user_expenses": ExpenseSerializer(user_expenses, many=True).data,
-            "total_expenses": sum(expense.total_amount for expense in user_expenses)
-        }
-        return Response(balance_data)
 
-    @action(detail=False, methods=['get'], url_path='download-balance-sheet', permission_classes=[permissions.IsAuthenticated])
-    def download_balance_sheet(self, request):
-        user_expenses = Expense.objects.filter(payer=request.user)
-        # Make sure to create this template in your templates directory
-        template_path = 'balance_sheet.html'
+        def build():
+            # Totals include archived expenses; the list only live ones.
+            summary = archive.payer_summary(
+                request.user.pk, by_month=params.validated_data.get('group_by') == 'month')
 
-        context = {
-            'user_expenses': user_expenses,
-            'total_expenses': sum(expense.total_amount for expense in user_expenses)
-        }
+            balance_data = {}
+            if not params.validated_data['summary_only']:
+                balance_data["user_expenses"] = payloads.expense_payloads(
+                    payloads.expense_rows(user_expenses))
+            balance_data.update(BalanceSummarySerializer(summary).data)
+            return balance_data
 
-        html_content = render_to_string(template_path, context)
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename="balance_sheet.pdf"'
+        return self.versioned_response(versions.user_scope(request.user.pk), build)
 
-        pisa_status = pisa.CreatePDF(html_content, dest=response)
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def balances(self, request):
+        net, balances = ledger.user_balances(request.user)
+        return Response({
+            "net_balance": str(net),
+            "balances": [
+                {"user": user_id, "amount": str(amount)}
+                for user_id, amount in balances
+            ]
+        })
 
-        if pisa_status.err:
-            return HttpResponse('We had some errors <pre>' + html_content + '</pre>')
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def analytics(self, request):
+        params = AnalyticsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        scope = params.validated_data['scope']
+        if scope == 'global' and not request.user.is_staff:
+            return Response({"detail": "Only staff users can view global analytics."}, status=status.HTTP_403_FORBIDDEN)
 
-        return response
+        periods = rollups.spending(
+            user=request.user if scope == 'user' else None,
+            start_date=params.validated_data.get('start_date'),
+            end_date=params.validated_data.get('end_date'),
+            granularity=params.validated_data['granularity'])
+        return Response({
+            "scope": scope,
+            "granularity": params.validated_data['granularity'],
+            "periods": SpendingPeriodSerializer(periods, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'], url_path='settle-up', permission_classes=[permissions.IsAuthenticated])
+    def settle_up(self, request):
+        # Only debts from expenses outside groups; each group has its own
+        # plan in /api/groups/{id}/balances/.
+        return Response({
+            "transfers": [
+                {"from": debtor, "to": creditor, "amount": str(amount)}
+                for debtor, creditor, amount in settle_up(ledger.outside_group_nets())
+            ]
+        })
+
+    @action(detail=False, methods=['get'], url_path='download-balance-sheet', permission_classes=[permissions.IsAuthenticated])
+    def download_balance_sheet(self, request):
+        # Rendering happens on a background worker; an unchanged balance
+        # sheet is served from the cache without rendering again.
+        job_id, job_status = balance_sheets.submit(request.user.pk)
+        if job_status == balance_sheets.DONE:
+            try:
+                sheet = balance_sheets.cache_path(request.user.pk, job_id).open('rb')
+            except FileNotFoundError:
+                # Replaced by a newer sheet since; queue the current one.
+                job_id, job_status = balance_sheets.submit(request.user.pk)
+            else:
+                return FileResponse(sheet, as_attachment=True,
+                                    filename='balance_sheet.pdf', content_type='application/pdf')
+        return Response(self.balance_sheet_job_data(job_id, job_status), status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'balance-sheet-jobs/(?P<job_id>[0-9a-f]{64})', permission_classes=[permissions.IsAuthenticated])
+    def balance_sheet_job(self, request, job_id):
+        job_status = balance_sheets.job_status(request.user.pk, job_id)
+        if job_status is None:
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.balance_sheet_job_data(job_id, job_status))
+
+    def balance_sheet_job_data(self, job_id, job_status):
+        data = {
+            "job_id": job_id,
+            "status": job_status,
+            "status_url": reverse('expense-balance-sheet-job', kwargs={'job_id': job_id}, request=self.request),
+        }
+        if job_status == balance_sheets.DONE:
+            data["download_url"] = reverse('expense-download-balance-sheet', request=self.request)
+        return data
+
+    @action(detail=False, methods=['get'], url_path='download-csv', permission_classes=[permissions.IsAuthenticated])
+    def download_csv(self, request):
+        return csv_export_response(
+            Expense.objects.filter(payer=request.user), request.query_params,
+            'user_expenses.csv')
 
     # @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     # def balance_sheet(self, request):
@@ -108,38 +403,60 @@ class ExpenseViewSet(viewsets.ModelViewSet):
     #     }
     #     return Response(balance_data)
 
-# @action(detail=False, methods=['get'], url_path='download-csv', permission_classes=[permissions.IsAuthenticated])
-# def download_csv(self, request):
-#     user_expenses = Expense.objects.filter(payer=request.user)
-
-#     # Create the HttpResponse object with the appropriate CSV header.
-#     response = HttpResponse(content_type='text/csv')
-#     response['Content-Disposition'] = 'attachment; filename="user_expenses.csv"'
 
-#     writer = csv.writer(response)
-#     # Write the header row
-#     writer.writerow(['ID', 'Description', 'Total Amount', 'Date'])
+class GroupViewSet(ExpenseListMixin, mixins.CreateModelMixin,
+                   mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                   viewsets.GenericViewSet):
+    # Only members can see a group, its expenses and its balances. Every
+    # group action reads that group's rows through the (group, ...) indexes,
+    # so its cost follows the size of the group, not of the whole database.
+    queryset = Group.objects.all()
+    serializer_class = GroupSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
-#     # Write data rows
-#     for expense in user_expenses:
-#         writer.writerow([expense.id, expense.description,
-#                         expense.total_amount, expense.date])
+    def get_queryset(self):
+        return (Group.objects.filter(memberships__user=self.request.user)
+                .prefetch_related('members').order_by('id'))
 
-#     return response
+    def group_expenses(self, group):
+        return Expense.objects.filter(group=group)
 
+    @action(detail=True, methods=['post'])
+    def members(self, request, pk=None):
+        group = self.get_object()
+        params = GroupMemberSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        GroupMembership.objects.get_or_create(group=group, user=params.validated_data['user'])
+        return Response(self.get_serializer(self.get_object()).data)
 
-@action(detail=False, methods=['get'], url_path='download-csv', permission_classes=[permissions.IsAuthenticated])
-def download_csv(self, request):
-    user_expenses = Expense.objects.filter(payer=request.user)
+    @action(detail=True, methods=['get'])
+    def expenses(self, request, pk=None):
+        group = self.get_object()
+        self.requested_fields()  # 400 on unknown fields, even for cached pages
+        return self.versioned_response(
+            versions.group_scope(group.pk),
+            lambda: self.expense_page(self.group_expenses(group)))
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="user_expenses.csv"'
+    @action(detail=True, methods=['get'])
+    def balances(self, request, pk=None):
+        group = self.get_object()
 
-    writer = csv.writer(response)
-    writer.writerow(['ID', 'Description', 'Total Amount', 'Date'])
+        def build():
+            balances = ledger.group_balances(group)
+            return {
+                "balances": [
+                    {"user": user_id, "net": str(net)} for user_id, net in balances
+                ],
+                "transfers": [
+                    {"from": debtor, "to": creditor, "amount": str(amount)}
+                    for debtor, creditor, amount in settle_up(dict(balances))
+                ],
+            }
 
-    for expense in user_expenses:
-        writer.writerow([expense.id, expense.description,
-                        expense.total_amount, expense.date])
+        return self.versioned_response(versions.group_scope(group.pk), build)
 
-    return response
+    @action(detail=True, methods=['get'], url_path='download-csv')
+    def download_csv(self, request, pk=None):
+        group = self.get_object()
+        return csv_export_response(
+            self.group_expenses(group), request.query_params, f'group_{group.pk}_expenses.csv')
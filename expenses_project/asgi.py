@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "expenses_project.settings")
+# Lets settings pick ASGI-friendly database connection defaults.
+os.environ.setdefault("EXPENSES_SERVER", "asgi")
 
 application = get_asgi_application()
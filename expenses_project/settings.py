@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "expenses_app.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -78,15 +79,54 @@ WSGI_APPLICATION = "expenses_project.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Under WSGI, connections are reused between requests for CONN_MAX_AGE
+# seconds (checked before reuse). Under ASGI (asgi.py sets EXPENSES_SERVER)
+# the ORM calls of each request run on a thread of their own, so a
+# persistent connection would never be reused and would stay open until the
+# thread goes away: CONN_MAX_AGE defaults to 0 there. Set EXPENSES_DB_POOL=1
+# to use psycopg's connection pool instead, which suits both (needs
+# psycopg[pool]; Django requires CONN_MAX_AGE 0 with it).
+DATABASE_POOL = os.environ.get('EXPENSES_DB_POOL') == '1'
+ASGI_SERVER = os.environ.get('EXPENSES_SERVER') == 'asgi'
+
 DATABASES = {
     "default": {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'expenses_db',
-        'USER': 'postgres',
-        'PASSWORD': 'admin123',
-        'HOST': 'localhost',
-        'PORT': '5432',
+        'NAME': os.environ.get('EXPENSES_DB_NAME', 'expenses_db'),
+        'USER': os.environ.get('EXPENSES_DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('EXPENSES_DB_PASSWORD', 'admin123'),
+        'HOST': os.environ.get('EXPENSES_DB_HOST', 'localhost'),
+        'PORT': os.environ.get('EXPENSES_DB_PORT', '5432'),
+        'CONN_MAX_AGE': 0 if DATABASE_POOL else int(
+            os.environ.get('EXPENSES_DB_CONN_MAX_AGE', '0' if ASGI_SERVER else '60')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'pool': True} if DATABASE_POOL else {},
+    }
+}
+
+# A streaming replica of the primary, e.g. a second local instance on
+# another port. When EXPENSES_DB_REPLICA_HOST is set, the safe-method
+# ExpenseViewSet actions read from it (see READ_REPLICA). In tests it mirrors
+# default, so both aliases see the same test database.
+if os.environ.get('EXPENSES_DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.environ['EXPENSES_DB_REPLICA_HOST'],
+        'PORT': os.environ.get('EXPENSES_DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['expenses_app.routers.ReadReplicaRouter']
+
+# Reads go to the ALIAS database when it is configured. After a user's
+# write, their reads stay on the primary for STICKY_SECONDS, longer than the
+# replica is expected to lag. Write times are kept in the CACHE alias, which
+# must be shared between processes (e.g. Redis or memcached) when running
+# more than one.
+READ_REPLICA = {
+    'ALIAS': 'replica',
+    'STICKY_SECONDS': 10,
+    'CACHE': 'default',
 }
 
 
@@ -140,11 +180,15 @@ AUTH_USER_MODEL = 'expenses_app.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'expenses_app.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'expenses_app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
 SIMPLE_JWT = {
@@ -154,3 +198,105 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
 }
+
+# Number of ExpenseSplit rows written per INSERT when an expense is saved.
+EXPENSE_SPLIT_BATCH_SIZE = 500
+
+# Rows validated and committed per transaction by the bulk expense import.
+EXPENSE_IMPORT_BATCH_SIZE = 1000
+
+# Default page size of the keyset-paginated expense lists; clients can ask
+# for up to 1000 with ``page_size``.
+EXPENSE_PAGE_SIZE = 100
+
+# Balance sheet PDFs are rendered by a pool of background threads and cached
+# on disk per user and data version. Set the worker count to 0 to render
+# inline in the request instead. The cache directory also holds the job
+# state, so it must be shared by all worker processes. A job still pending
+# after BALANCE_SHEET_JOB_TIMEOUT seconds is queued again.
+BALANCE_SHEET_WORKERS = 2
+BALANCE_SHEET_CACHE_DIR = BASE_DIR / 'var' / 'balance_sheets'
+BALANCE_SHEET_JOB_TIMEOUT = 10 * 60
+
+# Users resolved from JWTs are kept in a bounded per-process LRU cache for
+# TTL seconds. SHARED_CACHE optionally names a CACHES alias consulted on a
+# local miss, e.g. a file-based or local memcached cache.
+JWT_USER_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'SHARED_CACHE': None,
+}
+
+# Bulk user onboarding (staff only) accepts at most USER_BULK_MAX_USERS per
+# request, inserts this many users per statement and hashes passwords on a
+# pool of this many threads.
+USER_BULK_MAX_USERS = 10000
+USER_BULK_BATCH_SIZE = 1000
+USER_BULK_HASH_WORKERS = 4
+
+# Serialized payloads of the versioned read actions (overall_expenses,
+# user_expenses, balance_sheet) kept in memory per data version.
+EXPENSE_PAYLOAD_CACHE = {
+    'MAX_ENTRIES': 256,
+}
+
+# archive_expenses moves expenses dated more than this many days ago out of
+# the hot tables (see expenses_app/archive.py).
+EXPENSE_ARCHIVE_AFTER_DAYS = 2 * 365
+
+# Responses to POST /api/expenses/ requests sent with an Idempotency-Key
+# header are replayed for retries with the same key for this many seconds.
+# Expired keys are removed by the purge_idempotency_keys command.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Per-route request metrics, exposed at /metrics in the Prometheus text
+# format. Every request is counted and timed; database and serializer time
+# are measured for SAMPLE_RATE (0.0-1.0) of requests.
+REQUEST_METRICS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': float(os.environ.get('EXPENSES_METRICS_SAMPLE_RATE', '0.1')),
+    # Scrapers send it as "Authorization: Token <token>"; staff users can
+    # use their JWT instead.
+    'TOKEN': os.environ.get('EXPENSES_METRICS_TOKEN'),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'key_value': {
+            '()': 'expenses_app.log_format.KeyValueFormatter',
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'key_value',
+        },
+    },
+    'loggers': {
+        'expenses_app': {
+            'handlers': ['console'],
+            'level': os.environ.get('EXPENSES_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Expense change feed (see expenses_app/changes.py). Waiting subscribers of
+# each process share one query for new changes every POLL_INTERVAL seconds;
+# ids skipped by it are looked for again for GAP_SECONDS.
+# Long-poll requests wait at most LONG_POLL_TIMEOUT seconds; event streams
+# send a comment every HEARTBEAT seconds and close after STREAM_SECONDS so
+# clients reconnect. purge_change_log drops changes older than
+# RETENTION_DAYS.
+CHANGE_FEED = {
+    'POLL_INTERVAL': 1.0,
+    'HEARTBEAT': 15,
+    'LONG_POLL_TIMEOUT': 25,
+    'STREAM_SECONDS': 300,
+    'PAGE_SIZE': 500,
+    'GAP_SECONDS': 30,
+    'RETENTION_DAYS': 7,
+}